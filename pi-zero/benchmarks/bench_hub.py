@@ -0,0 +1,273 @@
+"""
+Load test of hub mode: starts main.py --hub against the fake API server and
+NetworkManager of the harness, connects more and more fake panel agents and
+reports at every step
+
+- resync: from connecting the new agents until each has its whole main page,
+- update: from a refresh tapped on the first panel until every panel has the
+  changed forecast, which is one fetch and a delta per panel,
+- touch: from every panel tapping its chart at once until each has its new
+  chart, the median and p95 over the panels,
+- CPU of the hub process per second while idle (the clock of every panel) and
+  per update.
+
+A step is sustained when the update and touch p95 stay within --budget-ms;
+the last sustained step is reported as how many panels one hub sustains.
+At the end main.py is stopped with every panel still connected and has to
+exit cleanly.
+
+    $ python benchmarks/bench_hub.py --panels 10 25 50 100 200
+
+The fake agents are in this process and answer like a display at --baud
+(return code of an instruction after its line time), no serial ports are used.
+"""
+import argparse
+import asyncio
+import re
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from harness import App, FakeApiServer, cpu_seconds
+
+PAGE_MAIN = 0x00
+B_REFRESH = 0x04
+# A point inside the forecast chart of main.py
+CHART_XY = (240, 530)
+TERMINATOR = b"\xFF\xFF\xFF"
+CLOCK = re.compile(rb"^tDatetime\.txt=")
+# The last instruction of a daily chart, the day labels are drawn last
+CHART_END = re.compile(rb"^xstr 354,740,")
+PAGES = {b"pageMain": 0, b"0": 0, b"pageMenu": 1, b"1": 1}
+
+
+@dataclass(slots = True)
+class Step:
+    panels: int
+    resync_ms: float
+    update_ms: float
+    update_bytes: float
+    touch_median_ms: float
+    touch_p95_ms: float
+    idle_cpu: float
+    update_cpu_ms: float
+
+
+class FakeAgent(asyncio.Protocol):
+    """
+    panel_agent.py and its display in one: answers sendme, get and every
+    instruction like a display at baudrate with bkcmd=3, and records the time
+    of every instruction but the clock.
+    """
+
+    def __init__(self, panel_id, baudrate):
+        self.panel_id = panel_id
+        self.baudrate = baudrate
+        self.transport = None
+        self.buffer = b""
+        self.page = PAGE_MAIN
+        # Line time of the instructions received so far ends here
+        self.busy_until = 0.0
+        # (time, instruction) of every instruction but the clock
+        self.log = []
+        self.bytes = 0
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.write(f"PANEL {self.panel_id} {self.baudrate}\n".encode("utf-8"))
+
+
+    def data_received(self, data):
+        now = time.perf_counter()
+        self.buffer += data
+        *instructions, self.buffer = self.buffer.split(TERMINATOR)
+        for text in instructions:
+            self.busy_until = max(self.busy_until, now) + (len(text) + 3) * 10 / self.baudrate
+            if not CLOCK.match(text):
+                self.log.append((self.busy_until, text))
+                self.bytes += len(text) + 3
+            answer = self.execute(text)
+            delay = self.busy_until - now
+            asyncio.get_running_loop().call_later(delay, self.transport.write, answer + TERMINATOR)
+
+
+    def execute(self, text):
+        if text == b"sendme":
+            return bytes([0x66, self.page])
+        if text.startswith(b"get "):
+            # No RTC and no text entered, like the NX8048T050
+            return b"\x1A" if not text.endswith(b".txt") else b"\x70"
+        if text.startswith(b"page "):
+            self.page = PAGES.get(text[5:], self.page)
+        return b"\x01"
+
+
+    def send(self, frame):
+        self.transport.write(frame + TERMINATOR)
+
+
+    def touch(self, page, component):
+        self.send(bytes([0x65, page, component, 1]))
+        self.send(bytes([0x65, page, component, 0]))
+
+
+    def tap(self, x, y):
+        for press in (1, 0):
+            self.send(bytes([0x67, x >> 8, x & 0xFF, y >> 8, y & 0xFF, press]))
+
+
+    def mark(self):
+        return len(self.log)
+
+
+    def last(self, mark):
+        entries = self.log[mark:]
+        return entries[-1][0] if entries else None
+
+
+async def wait_quiet(agents, marks, quiet, timeout = 30.0, until = None):
+    """
+    Wait until no agent received an instruction for quiet seconds, or every
+    agent received one matching until.
+    """
+    deadline = time.perf_counter() + timeout
+    counts = None
+    stable_since = time.perf_counter()
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(0.02)
+        if until is not None and all(any(until.match(text) for _, text in a.log[m:]) for a, m in zip(agents, marks)):
+            return True
+        current = [len(a.log) for a in agents]
+        if current != counts:
+            counts, stable_since = current, time.perf_counter()
+        elif time.perf_counter() - stable_since >= quiet and until is None:
+            return True
+    return False
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def connect(port, count, start, baudrate):
+    loop = asyncio.get_running_loop()
+    agents = []
+    for i in range(start, start + count):
+        _, agent = await loop.create_connection(lambda i = i: FakeAgent(f"bench{i}", baudrate), "127.0.0.1", port)
+        agents.append(agent)
+    return agents
+
+
+async def measure(args, app, port):
+    agents = []
+    steps = []
+    for target in args.panels:
+        # Resync of the new panels
+        start = time.perf_counter()
+        new = await connect(port, target - len(agents), len(agents), args.baud)
+        if not await wait_quiet(new, [0] * len(new), args.quiet, until = CHART_END):
+            raise RuntimeError(f"Not every panel got its main page at {target} panels")
+        resync = max(a.log[-1][0] for a in new) - start
+        agents.extend(new)
+        await wait_quiet(agents, [a.mark() for a in agents], args.quiet)
+
+        # Idle: the clock of every panel
+        cpu = cpu_seconds(app.process.pid)
+        await asyncio.sleep(args.idle_sec)
+        idle_cpu = (cpu_seconds(app.process.pid) - cpu) / args.idle_sec
+
+        # Forecast updates, one fetch and a delta to every panel
+        updates, sizes, update_cpu = [], [], []
+        for _ in range(args.iterations):
+            marks = [a.mark() for a in agents]
+            sent = [a.bytes for a in agents]
+            cpu = cpu_seconds(app.process.pid)
+            start = time.perf_counter()
+            agents[0].touch(PAGE_MAIN, B_REFRESH)
+            await wait_quiet(agents, marks, args.quiet)
+            update_cpu.append(cpu_seconds(app.process.pid) - cpu)
+            ends = [a.last(m) for a, m in zip(agents, marks)]
+            updates.append((max(t for t in ends if t is not None) - start) * 1000)
+            sizes.append(sum(a.bytes - s for a, s in zip(agents, sent)) / len(agents))
+
+        # Every panel taps its chart at once
+        touches = []
+        for _ in range(args.iterations):
+            marks = [a.mark() for a in agents]
+            start = time.perf_counter()
+            for a in agents:
+                a.tap(*CHART_XY)
+            await wait_quiet(agents, marks, args.quiet)
+            touches.extend((a.last(m) - start) * 1000 for a, m in zip(agents, marks) if a.last(m) is not None)
+
+        step = Step(target, resync * 1000, statistics.median(updates), statistics.median(sizes),
+                    statistics.median(touches), percentile(touches, 0.95), idle_cpu,
+                    statistics.median(update_cpu) * 1000)
+        steps.append(step)
+        print(f"{step.panels:>6} {step.resync_ms:>8.0f}ms {step.update_ms:>8.0f}ms {step.update_bytes:>8.0f}B "
+              f"{step.touch_median_ms:>8.0f}ms {step.touch_p95_ms:>8.0f}ms {step.idle_cpu * 100:>7.1f}% "
+              f"{step.update_cpu_ms:>8.0f}ms", flush = True)
+        if max(step.update_ms, step.touch_p95_ms) > args.budget_ms:
+            break
+
+    # Ctrl+C on a hub with its panels still connected
+    output = await asyncio.to_thread(app.stop)
+    for a in agents:
+        a.transport.close()
+    if "Bye." not in output:
+        raise RuntimeError(f"main.py did not shut down cleanly with {len(agents)} panels connected:\n{output}")
+    return steps
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--panels", type = int, nargs = "+", default = [10, 25, 50, 100], help = "panel counts to step through")
+    parser.add_argument("--iterations", type = int, default = 5, help = "updates and touches per step")
+    parser.add_argument("--budget-ms", type = float, default = 1000, help = "update and touch p95 a sustained step stays within")
+    parser.add_argument("--baud", type = int, default = 115200, help = "baud rate the fake displays answer at")
+    parser.add_argument("--latency", type = float, default = 0.05, help = "seconds every API response is delayed by")
+    parser.add_argument("--quiet", type = float, default = 0.3, help = "seconds without instructions that end a response")
+    parser.add_argument("--idle-sec", type = float, default = 3.0, help = "seconds the idle CPU is measured over")
+    parser.add_argument("--verbose", action = "store_true", help = "print the output of main.py")
+    args = parser.parse_args()
+
+    port = free_port()
+    api = FakeApiServer(latency = args.latency)
+    home = tempfile.TemporaryDirectory(prefix = "pi-zero-bench-")
+    app = App(None, api, home.name, args = ["--hub", f"127.0.0.1:{port}", "--rotate-sec", "0", "--log-level", "WARNING"])
+    try:
+        deadline = time.perf_counter() + 15
+        while time.perf_counter() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout = 1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        print(f"{'panels':>6} {'resync':>10} {'update':>10} {'B/panel':>9} {'touch':>10} {'touch p95':>10} "
+              f"{'idle cpu':>8} {'cpu/upd':>10}")
+        steps = asyncio.run(measure(args, app, port))
+    finally:
+        output = app.stop()
+        api.close()
+        home.cleanup()
+        if args.verbose:
+            print(output)
+
+    sustained = [s.panels for s in steps if max(s.update_ms, s.touch_p95_ms) <= args.budget_ms]
+    print(f"One hub sustains {max(sustained) if sustained else 0} panels within {args.budget_ms:.0f}ms "
+          f"({api.requests} API requests in total)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Micro-benchmark of Nextion.getCommands under a burst of touch events.
+
+Compares the FrameParser with the previous split-based implementation on the
+same byte stream, delivered in serial-read sized chunks.
+
+    $ python benchmarks/bench_parser.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from nextion import Command, FrameParser, Nextion
+
+
+def make_burst(n):
+    frames = [
+        b'\x65\x01\x04\x01\xFF\xFF\xFF',              # touch press
+        b'\x65\x01\x04\x00\xFF\xFF\xFF',              # touch release
+        b'\x67\x01\x2c\x02\x58\x01\xFF\xFF\xFF',      # touch coordinate
+        b'\x01\xFF\xFF\xFF',                          # instruction successful
+    ]
+    return b''.join(random.choice(frames) for _ in range(n)) + b'\x70password\xFF\xFF\xFF'
+
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def legacy_parse(reads):
+    buffer = b''
+    commands = []
+    for read in reads:
+        buffer += read
+        raw = buffer.split(b'\xFF\xFF\xFF')
+        buffer = b'' if buffer[-3:] == b'\xFF\xFF\xFF' else raw[-1]
+        for frame in raw[:-1]:
+            match frame[0]:
+                case Nextion.EVENT_TOUCH:
+                    commands.append(Command(event = frame[0], page = frame[1], component = frame[2]))
+                case Nextion.CURRENT_PAGE_NUMBER:
+                    commands.append(Command(event = frame[0], page = frame[1]))
+                case Nextion.STRING_DATA:
+                    commands.append(Command(event = frame[0], string_data = frame[1:].decode("iso8859-1")))
+    return commands
+
+
+def frame_parse(reads):
+    parser = FrameParser()
+    commands = []
+    for read in reads:
+        while read:
+            read = read[parser.feed(read):]
+            commands.extend(parser.frames())
+    return commands
+
+
+def bench(name, func, reads, repeat = 5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        commands = func(reads)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:14} {len(commands):7} frames  {len(commands) / best:12,.0f} frames/s")
+
+
+def main():
+    random.seed(1)
+    data = make_burst(100_000)
+    # 64 bytes is about what arrives between two event loop wakeups at 115200 baud
+    for size in (16, 64, 1024):
+        reads = chunks(data, size)
+        print(f"{len(data)} bytes in {len(reads)} reads of {size} bytes")
+        bench("legacy split", legacy_parse, reads)
+        bench("FrameParser", frame_parse, reads)
+
+
+if __name__ == "__main__":
+    main()
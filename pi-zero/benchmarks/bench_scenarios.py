@@ -0,0 +1,212 @@
+"""
+End-to-end benchmark: starts main.py against the fake display, API server and
+NetworkManager of the harness and replays user interactions, reporting per
+scenario the latency from the event to the last instruction of the response,
+bytes and instructions on the wire and CPU time of the process.
+
+Latency includes the line time of the bytes at the negotiated baud rate, the
+fake display reads them no faster than a real one. The clock update sent every
+second is left out of all numbers.
+
+    $ python benchmarks/bench_scenarios.py --iterations 20
+    $ python benchmarks/bench_scenarios.py --json results.json
+
+Needs pyserial and requests, no display, D-Bus or network access.
+"""
+import argparse
+import json
+import re
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from harness import App, FakeApiServer, FakeNextion
+
+# Component ids of the HMI, as in the Nextion class
+PAGE_MAIN = 0x00
+B_MENU = 0x02
+B_REFRESH = 0x04
+PAGE_MENU = 0x01
+B_BACK = 0x01
+B_LEFT = 0x0c
+B_RIGHT = 0x0d
+B_UNIT_TEMP = 0x11
+
+# A point inside the forecast chart of main.py
+CHART_XY = (240, 530)
+
+CLOCK = re.compile(r"^tDatetime\.txt=")
+# The last instruction of the first forecast, the day labels are drawn last
+FIRST_FORECAST = re.compile(r"^xstr 354,740,")
+
+
+@dataclass(slots = True)
+class Sample:
+    latency: float
+    bytes: int
+    instructions: int
+    cpu: float
+
+
+@dataclass(slots = True)
+class Result:
+    scenario: str
+    runs: int
+    median_ms: float
+    p95_ms: float
+    bytes_per_op: float
+    instructions_per_op: float
+    cpu_ms_per_op: float
+
+
+class Session:
+    """
+    One main.py process and the fakes it talks to.
+    """
+
+    def __init__(self, args):
+        self.fake = FakeNextion(simulate_line = not args.no_line, rtc = args.rtc)
+        self.api = FakeApiServer(latency = args.latency)
+        # Further displays of the same process, idle apart from the clock and forecast updates
+        self.others = [FakeNextion(simulate_line = not args.no_line, rtc = args.rtc) for _ in range(args.panels - 1)]
+        self.home = tempfile.TemporaryDirectory(prefix = "pi-zero-bench-")
+        ports = [arg for other in self.others for arg in ("--port", other.port)]
+        self.app = App(self.fake, self.api, self.home.name, access_points = args.access_points, args = ports)
+        self.quiet = args.quiet
+
+
+    def measure(self, action, quiet = None, until = None):
+        """
+        Run action, which sends events to main.py, and wait for the response.
+        """
+        mark = self.fake.mark()
+        cpu = self.app.cpu_seconds()
+        start = time.perf_counter()
+        action()
+        entries = self.fake.wait_quiet(mark, quiet = quiet or self.quiet, ignore = CLOCK, until = until)
+        if not entries:
+            raise RuntimeError("main.py did not respond")
+        return Sample(entries[-1][0] - start, sum(len(text) + 3 for _, text in entries),
+                      len(entries), self.app.cpu_seconds() - cpu)
+
+
+    def settle(self, action = None, quiet = None):
+        """
+        Run action without measuring it.
+        """
+        mark = self.fake.mark()
+        if action is not None:
+            action()
+        self.fake.wait_quiet(mark, quiet = quiet or self.quiet, ignore = CLOCK)
+
+
+    def close(self):
+        output = self.app.stop()
+        self.api.close()
+        self.fake.close()
+        for other in self.others:
+            other.close()
+        self.home.cleanup()
+        return output
+
+
+def startup(session):
+    entries = session.fake.wait_quiet(0, ignore = CLOCK, until = FIRST_FORECAST, timeout = 30)
+    if not any(FIRST_FORECAST.match(text) for _, text in entries):
+        raise RuntimeError("No forecast was drawn")
+    sample = Sample(entries[-1][0] - session.app.started, sum(len(text) + 3 for _, text in entries),
+                    len(entries), session.app.cpu_seconds())
+    session.settle()
+    return [sample]
+
+
+def refresh(session, iterations):
+    return [session.measure(lambda: session.fake.touch(PAGE_MAIN, B_REFRESH)) for _ in range(iterations)]
+
+
+def chart(session, iterations):
+    return [session.measure(lambda: session.fake.tap(*CHART_XY)) for _ in range(iterations)]
+
+
+def menu(session, iterations):
+    samples = []
+    for _ in range(iterations):
+        samples.append(session.measure(lambda: session.fake.touch(PAGE_MAIN, B_MENU)))
+        session.settle(lambda: session.fake.touch(PAGE_MENU, B_BACK))
+    return samples
+
+
+def paging(session, iterations):
+    samples = []
+    # Scan until every access point is known, so every page is full
+    session.settle(lambda: session.fake.touch(PAGE_MAIN, B_MENU), quiet = 1.0)
+    for i in range(iterations):
+        button = B_RIGHT if i % 2 == 0 else B_LEFT
+        samples.append(session.measure(lambda: session.fake.touch(PAGE_MENU, button)))
+    return samples
+
+
+def unit(session, iterations):
+    samples = [session.measure(lambda: session.fake.touch(PAGE_MENU, B_UNIT_TEMP)) for _ in range(iterations)]
+    session.settle(lambda: session.fake.touch(PAGE_MENU, B_BACK))
+    return samples
+
+
+# In the order they run, in one process
+SCENARIOS = {
+    "refresh": refresh,
+    "chart": chart,
+    "menu": menu,
+    "paging": paging,
+    "unit": unit,
+}
+
+
+def summarize(scenario, samples):
+    latencies = sorted(s.latency * 1000 for s in samples)
+    p95 = statistics.quantiles(latencies, n = 20)[18] if len(latencies) > 1 else latencies[0]
+    n = len(samples)
+    return Result(scenario, n, statistics.median(latencies), p95, sum(s.bytes for s in samples) / n,
+                  sum(s.instructions for s in samples) / n, sum(s.cpu for s in samples) * 1000 / n)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type = int, default = 10, help = "runs of every scenario")
+    parser.add_argument("--scenario", action = "append", choices = list(SCENARIOS), help = "run only these, repeatable")
+    parser.add_argument("--access-points", type = int, default = 12)
+    parser.add_argument("--latency", type = float, default = 0.05, help = "seconds every API response is delayed by")
+    parser.add_argument("--quiet", type = float, default = 0.3, help = "seconds without instructions that end a response")
+    parser.add_argument("--no-line", action = "store_true", help = "do not throttle the fake display to the baud rate")
+    parser.add_argument("--panels", type = int, default = 1, help = "displays driven by main.py, scenarios run on the first")
+    parser.add_argument("--rtc", action = "store_true", help = "give the fake display an RTC, so main.py stops sending the time")
+    parser.add_argument("--json", help = "also write the results to this file")
+    parser.add_argument("--verbose", action = "store_true", help = "print the output of main.py")
+    args = parser.parse_args()
+
+    session = Session(args)
+    results = []
+    try:
+        results.append(summarize("startup", startup(session)))
+        for name, scenario in SCENARIOS.items():
+            if args.scenario and name not in args.scenario:
+                continue
+            results.append(summarize(name, scenario(session, args.iterations)))
+    finally:
+        output = session.close()
+        if args.verbose:
+            print(output)
+
+    print(f"{'scenario':<10} {'runs':>4} {'median':>9} {'p95':>9} {'bytes/op':>9} {'instr/op':>9} {'cpu/op':>9}")
+    for r in results:
+        print(f"{r.scenario:<10} {r.runs:>4} {r.median_ms:>7.1f}ms {r.p95_ms:>7.1f}ms {r.bytes_per_op:>9.0f} "
+              f"{r.instructions_per_op:>9.1f} {r.cpu_ms_per_op:>7.1f}ms")
+    if args.json:
+        with open(args.json, "w", encoding = "utf-8") as f:
+            json.dump([asdict(r) for r in results], f, indent = 2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Measures bytes/s and commands/s of the display link for each transmit mode.
+
+Draws a 5-day bar chart sized batch of instructions on the current page, in
+plain mode (write everything, then wait for the answer to sendme) and in
+acknowledged mode (bkcmd=3 with the transmit window), at each baud rate.
+Needs a display connected to the port.
+
+    $ python benchmarks/bench_serial.py --port /dev/serial0 --baudrates 9600 115200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from nextion import Nextion
+
+
+def chart_batch():
+    instruction = ''
+    for i in range(5):
+        left = 50 + i * 76
+        instruction += f'fill {left + 28},466,20,154,65120\xFF\xFF\xFF'
+        instruction += f'xstr {left},436,76,30,3,WHITE,0,1,1,0," 13°"\xFF\xFF\xFF'
+        instruction += f'xstr {left},620,76,30,3,WHITE,0,1,1,0," 1°"\xFF\xFF\xFF'
+        instruction += f'pic {left + 13},680,10\xFF\xFF\xFF'
+        instruction += f'xstr {left},740,76,30,3,WHITE,0,1,1,0,"Mon 01"\xFF\xFF\xFF'
+    return instruction
+
+
+def run(nextion, ack, repeat):
+    instruction = chart_batch()
+    nextion.ack = ack
+    nextion.write(f'bkcmd={3 if ack else 0}\xFF\xFF\xFF'.encode('iso-8859-1'))
+    time.sleep(0.1)
+    nextion.ser.reset_input_buffer()
+    sent, commands = nextion.bytes_sent, nextion.commands_sent
+    start = time.perf_counter()
+    for _ in range(repeat):
+        nextion.send(instruction, False)
+        if ack:
+            while not nextion.is_idle():
+                time.sleep(0.001)
+                nextion.getCommands()
+                nextion.pump()
+    if not ack:
+        nextion.ser.flush()
+        # The answer to sendme arrives after every earlier instruction was executed
+        if not nextion.probe():
+            print("  no answer to sendme, figures are lower bounds")
+    elapsed = time.perf_counter() - start
+    sent = nextion.bytes_sent - sent
+    commands = nextion.commands_sent - commands
+    mode = "ack" if ack else "plain"
+    print(f"{nextion.baudrate:7} {mode:6} {sent / elapsed:9.0f} B/s {commands / elapsed:8.0f} cmd/s  "
+          f"({sent} B, {commands} commands in {elapsed:.2f} s, {nextion.errors} errors)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", default = "/dev/serial0")
+    parser.add_argument("--baudrates", type = int, nargs = "+", default = [9600, 115200])
+    parser.add_argument("--repeat", type = int, default = 10)
+    args = parser.parse_args()
+
+    nextion = Nextion(port = args.port, baudrate = 9600)
+    try:
+        for baudrate in args.baudrates:
+            if nextion.negotiate_baudrate(baudrate) != baudrate:
+                print(f"{baudrate:7} not supported by the display")
+                continue
+            for ack in (False, True):
+                nextion.send('page pageMain\xFF\xFF\xFF', False)
+                run(nextion, ack, args.repeat)
+        nextion.negotiate_baudrate(9600)
+    finally:
+        nextion.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Startup benchmark: runs main.py --startup-benchmark several times and reports
+the median import time, time to first frame and time to first forecast, plus
+the wall time from spawning the interpreter.
+
+Needs the display on --port (or the fake display from the benchmark harness)
+and network access, like a normal run. Run it twice to compare a cold start
+with one that hits the on-disk caches.
+
+    $ python benchmarks/bench_startup.py --port /dev/serial0 --runs 5
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+PI_ZERO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def run_once(port, timeout):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "main.py", "--port", port, "--startup-benchmark"],
+        cwd = PI_ZERO_DIR, capture_output = True, text = True, timeout = timeout,
+    )
+    wall = time.perf_counter() - start
+    match = re.search(r"^Startup\s+(.*)$", result.stdout, re.MULTILINE)
+    if match is None:
+        print(result.stdout[-2000:], result.stderr[-2000:])
+        raise RuntimeError("main.py did not report its startup times")
+    marks = {name: float(ms) for name, ms in re.findall(r"(\w+)=(\d+)ms", match.group(1))}
+    marks["process"] = wall * 1000
+    return marks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", default = "/dev/serial0")
+    parser.add_argument("--runs", type = int, default = 5)
+    parser.add_argument("--timeout", type = float, default = 60)
+    args = parser.parse_args()
+
+    runs = [run_once(args.port, args.timeout) for _ in range(args.runs)]
+    for name in ("import", "first_frame", "first_forecast", "process"):
+        values = [run[name] for run in runs if name in run]
+        if values:
+            print(f"{name:15} median {statistics.median(values):7.0f} ms  "
+                  f"min {min(values):7.0f} ms  max {max(values):7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Micro-benchmark of turning an Open-Meteo response into WeatherData.
+
+Compares the columnar DailySeries with the previous eager parse, which built
+a Daily dataclass per day with three strptime calls and a description lookup,
+on recorded 5-day, 16-day and 16-day/384-hour responses. "render" adds what
+render_weather reads: today's details and five days of the chart.
+
+    $ python benchmarks/bench_weather_parse.py
+"""
+import json
+import os
+import sys
+import timeit
+from dataclasses import dataclass
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from external_api import WEATHER_DESCRIPTION, ApiClient
+from timeseries import HourlySeries, to_array
+
+PAYLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads")
+PAYLOADS = {
+    "5 days": "open_meteo_forecast.json",
+    "16 days": "open_meteo_forecast_16d.json",
+    "384 hours": "open_meteo_forecast_hourly.json",
+}
+
+
+@dataclass
+class LegacyDaily:
+    date: datetime = None
+    weather_code: int = 0
+    weather_description: str = ""
+    sunrise: datetime = None
+    sunset: datetime = None
+    uv_index: float = 0.0
+    precipitation_probability: int = 0
+    temperature_max: float = 0.0
+    temperature_min: float = 0.0
+
+
+def legacy_parse(data):
+    d = data.get("daily", {})
+    daily = [
+        LegacyDaily(
+            date = datetime.strptime(d.get("time")[i], "%Y-%m-%d"),
+            weather_code = d.get("weather_code")[i],
+            weather_description = WEATHER_DESCRIPTION[d.get("weather_code")[i]],
+            temperature_max = d.get("temperature_2m_max")[i],
+            temperature_min = d.get("temperature_2m_min")[i],
+            sunrise = datetime.strptime(d.get("sunrise")[i], "%Y-%m-%dT%H:%M"),
+            sunset = datetime.strptime(d.get("sunset")[i], "%Y-%m-%dT%H:%M"),
+            uv_index = d.get("uv_index_max")[i],
+            precipitation_probability = d.get("precipitation_probability_max")[i]
+        )
+        for i in range(len(d.get("time", [])))
+    ]
+    h = data.get("hourly", {})
+    hourly = HourlySeries(
+        start = datetime.strptime(h["time"][0], "%Y-%m-%dT%H:%M"),
+        temperature = to_array(h.get("temperature_2m", [])),
+        precipitation_probability = to_array(h.get("precipitation_probability", [])),
+        wind_speed = to_array(h.get("wind_speed_10m", [])),
+    )
+    return daily, hourly
+
+
+def legacy_render(data):
+    daily, _ = legacy_parse(data)
+    today = daily[0]
+    days = daily[:5]
+    return (today.sunrise.strftime("%H:%M"), today.sunset.strftime("%H:%M"),
+            [d.temperature_min for d in days], [d.temperature_max for d in days],
+            [d.weather_code for d in days], [d.date.strftime("%a %d") for d in days])
+
+
+def columnar_render(client, data):
+    daily = client.parse_weather(data).daily
+    today = daily[0]
+    days = daily[:5]
+    return (today.sunrise.strftime("%H:%M"), today.sunset.strftime("%H:%M"),
+            days.temperature_min, days.temperature_max,
+            days.weather_code, [date.strftime("%a %d") for date in days.dates()])
+
+
+def best_usec(func, number):
+    return min(timeit.repeat(func, number = number, repeat = 5)) / number * 1e6
+
+
+def main():
+    client = ApiClient.__new__(ApiClient)
+    number = 500
+    print(f"{'payload':<10} {'bytes':>6} {'json':>9} {'eager':>9} {'columnar':>9} {'eager+render':>13} {'columnar+render':>16}")
+    for name, filename in PAYLOADS.items():
+        with open(os.path.join(PAYLOADS_DIR, filename), "rb") as f:
+            raw = f.read()
+        data = json.loads(raw)
+        assert legacy_render(data)[:2] == columnar_render(client, data)[:2]
+        times = [
+            best_usec(lambda: json.loads(raw), number),
+            best_usec(lambda: legacy_parse(data), number),
+            best_usec(lambda: client.parse_weather(data), number),
+            best_usec(lambda: legacy_render(data), number),
+            best_usec(lambda: columnar_render(client, data), number),
+        ]
+        print(f"{name:<10} {len(raw):>6} " + " ".join(f"{t:>{w - 2}.0f}us" for t, w in zip(times, (9, 9, 9, 13, 16))))
+
+
+if __name__ == "__main__":
+    main()
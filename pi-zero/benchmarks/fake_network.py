@@ -0,0 +1,148 @@
+"""
+Stand-in for network.NetworkManager with the interface main.py uses, without
+libnm or D-Bus. Access points are made up and a scan "finds" them one by one
+like a real scan does; connecting walks through the same progress states.
+
+run_main.py installs it as the network module.
+"""
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+# Access points found by a full scan, set by run_main.py
+ACCESS_POINTS = 12
+
+
+@dataclass(slots = True)
+class AccessPointInfo:
+    ssid: str
+    strength: int
+    strength_bars: str
+    security: str = "WPA2"
+    is_active_ap: bool = False
+
+
+@dataclass(slots = True)
+class Activation:
+    ssid: str
+    associate_sec: float = None
+    ip_sec: float = None
+    state: str = "activating"
+
+
+def strength_bars(strength):
+    return ("*" * (1 + strength // 25)).ljust(4)[:4]
+
+
+class NetworkManager:
+    # Seconds between access points reported by a scan
+    SCAN_INTERVAL_SEC = 0.05
+    # Seconds of each connect stage
+    CONNECT_STAGE_SEC = 0.2
+
+    def __init__(self, access_points = None, active = 1):
+        """
+        :param access_points: Access points found by a full scan (default ACCESS_POINTS).
+        :param active: Index of the access point the device is connected to.
+        """
+        access_points = access_points if access_points is not None else ACCESS_POINTS
+        self.all = [AccessPointInfo(f"network-{i:02d}", 95 - i * 5, strength_bars(95 - i * 5), is_active_ap = i == active)
+                    for i in range(access_points)]
+        # A couple are known before the first scan, like after boot
+        self.visible = min(3, access_points)
+        self.listeners = []
+        self.activations = []
+        self.scans = 0
+        self.lock = threading.Lock()
+
+
+    def print_device_info(self):
+        print(f"Device     fake, {len(self.all)} access points")
+
+
+    def call(self, func, *args):
+        future = Future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+
+    def notify(self, event):
+        for listener in list(self.listeners):
+            listener(event)
+
+
+    def close(self):
+        self.listeners.clear()
+
+
+    def request_scan(self):
+        self.scans += 1
+
+        def scan():
+            while True:
+                time.sleep(self.SCAN_INTERVAL_SEC)
+                with self.lock:
+                    if self.visible >= len(self.all):
+                        break
+                    self.visible += 1
+                self.notify("added")
+            self.notify("scanned")
+
+        threading.Thread(target = scan, name = "fake-scan", daemon = True).start()
+        return True
+
+
+    def get_access_points(self):
+        with self.lock:
+            return self.all[:self.visible]
+
+
+    def get_ssids(self, start = 0, count = 5):
+        access_points = self.get_access_points()
+        return access_points[start:start + count], len(access_points)
+
+
+    def get_current_ssid(self):
+        for ap in self.all:
+            if ap.is_active_ap:
+                return ap.ssid
+        return None
+
+
+    def add_connection(self, ssid, password, on_progress = None):
+        future = Future()
+        activation = Activation(ssid)
+        self.activations.append(activation)
+
+        def connect():
+            start = time.monotonic()
+            for state in ("associated", "connected"):
+                time.sleep(self.CONNECT_STAGE_SEC)
+                activation.state = state
+                if state == "associated":
+                    activation.associate_sec = time.monotonic() - start
+                if on_progress is not None:
+                    on_progress(state)
+            activation.ip_sec = time.monotonic() - start
+            for ap in self.all:
+                ap.is_active_ap = ap.ssid == ssid
+            future.set_result(activation)
+
+        threading.Thread(target = connect, name = "fake-connect", daemon = True).start()
+        return future
+
+
+    def print_stats(self):
+        print(f"Wi-Fi      fake, scans={self.scans}, activations={len(self.activations)}")
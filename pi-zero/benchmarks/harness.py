@@ -0,0 +1,367 @@
+"""
+Benchmark harness: runs main.py against a fake display on a pty, a local HTTP
+server with recorded API payloads and a stub NetworkManager, so scenarios can
+be measured on any Linux machine without the panel, D-Bus or network access.
+
+    fake = FakeNextion()
+    api = FakeApiServer()
+    app = App(fake, api, home = tempfile.mkdtemp())
+    ...
+    app.stop()
+
+See bench_scenarios.py for the scenarios.
+"""
+import json
+import os
+import pty
+import re
+import subprocess
+import sys
+import threading
+import time
+import tty
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PI_ZERO_DIR = os.path.join(BENCHMARKS_DIR, "..")
+PAYLOADS_DIR = os.path.join(BENCHMARKS_DIR, "payloads")
+
+TERMINATOR = b"\xFF\xFF\xFF"
+
+# Same ids as the Nextion class, repeated so the harness does not need pyserial
+PAGES = {"pageMain": 0, "pageMenu": 1}
+
+
+class FakeNextion:
+    """
+    Plays the display on the master side of a pty: answers sendme and get,
+    acknowledges instructions once bkcmd=3 was sent, keeps the text of
+    components and logs every instruction with the time it arrived.
+
+    Reading is throttled to the baud rate in use, 10 bits per byte, so bytes on
+    the wire cost the time they would on the real serial line. With rtc, it
+    has the RTC registers of the Enhanced series and the tmClock timer of the
+    HMI; otherwise get of either fails like on the Basic series.
+    """
+
+    def __init__(self, baudrate = 9600, simulate_line = True, rtc = False):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.baudrate = baudrate
+        self.simulate_line = simulate_line
+        self.page = 0
+        self.ack = False
+        self.texts = {}
+        self.numbers = {"pageMain.tmClock.tim": 1000} if rtc else {}
+        # RTC time when it was last set and time.time() then
+        self.rtc = (datetime(2000, 1, 1), time.time()) if rtc else None
+        # (time, instruction) of every instruction received
+        self.log = []
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target = self.run, name = "fake-nextion", daemon = True)
+        self.thread.start()
+
+
+    def run(self):
+        buffer = b""
+        while self.running:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            if self.simulate_line:
+                time.sleep(len(data) * 10 / self.baudrate)
+            buffer += data
+            *instructions, buffer = buffer.split(TERMINATOR)
+            now = time.perf_counter()
+            for instruction in instructions:
+                text = instruction.decode("iso-8859-1")
+                with self.lock:
+                    self.log.append((now, text))
+                self.execute(text)
+
+
+    def execute(self, text):
+        if text == "sendme":
+            self.send(bytes([0x66, self.page]))
+            return
+        if text.startswith("get "):
+            name = text[4:]
+            if name.endswith(".txt"):
+                self.send(b"\x70" + self.texts.get(name, "").encode("iso-8859-1"))
+            elif self.rtc is not None and re.match(r"^rtc[0-6]$", name):
+                now = self.rtc[0] + timedelta(seconds = time.time() - self.rtc[1])
+                value = (now.year, now.month, now.day, now.hour, now.minute, now.second, now.isoweekday() % 7)[int(name[3])]
+                self.send(b"\x71" + value.to_bytes(4, "little", signed = True))
+            elif name in self.numbers:
+                self.send(b"\x71" + self.numbers[name].to_bytes(4, "little", signed = True))
+            else:
+                # Invalid Variable name or attribute
+                self.send(b"\x1A")
+            return
+        if text.startswith("bkcmd="):
+            self.ack = text == "bkcmd=3"
+        elif text.startswith("baud="):
+            # Answer at the old rate, then switch
+            self.acknowledge()
+            self.baudrate = int(text[5:])
+            return
+        elif text.startswith("page "):
+            self.page = PAGES.get(text[5:], self.page)
+        elif self.rtc is not None and re.match(r"^rtc[0-5]=\d+$", text):
+            self.set_rtc(int(text[3]), int(text[5:]))
+        else:
+            match = re.match(r'^(\w+\.txt)="(.*)"$', text, re.DOTALL)
+            if match:
+                self.texts[match.group(1)] = match.group(2)
+        self.acknowledge()
+
+
+    def set_rtc(self, register, value):
+        now = self.rtc[0] + timedelta(seconds = time.time() - self.rtc[1])
+        fields = ["year", "month", "day", "hour", "minute", "second"]
+        self.rtc = (now.replace(**{fields[register]: value}, microsecond = 0), time.time())
+
+
+    def acknowledge(self):
+        if self.ack:
+            self.send(b"\x01")
+
+
+    def send(self, frame):
+        with self.write_lock:
+            os.write(self.master, frame + TERMINATOR)
+
+
+    def touch(self, page, component):
+        """
+        Touch press event of a component, as sent with "Send Component ID".
+        """
+        self.page = page
+        self.send(bytes([0x65, page, component, 0x01]))
+
+
+    def touch_xy(self, x, y, press = 1):
+        self.send(bytes([0x67, x >> 8, x & 0xFF, y >> 8, y & 0xFF, press]))
+
+
+    def tap(self, x, y):
+        self.touch_xy(x, y, 1)
+        self.touch_xy(x, y, 0)
+
+
+    def swipe(self, x0, y0, x1, y1):
+        """
+        Touch coordinates of a swipe, press at x0, y0 and release at x1, y1.
+        """
+        self.touch_xy(x0, y0, 1)
+        self.touch_xy(x1, y1, 0)
+
+
+    def show_page(self, page):
+        """
+        The user switched pages on the display, which reports it with 0x66.
+        """
+        self.page = page
+        self.send(bytes([0x66, page]))
+
+
+    def type_text(self, component, text):
+        """
+        Text the user typed into a component, returned by the next get.
+        """
+        self.texts[f"{component}.txt"] = text
+
+
+    def mark(self):
+        with self.lock:
+            return len(self.log)
+
+
+    def since(self, mark, ignore = None):
+        """
+        (time, instruction) received after mark, without those matching ignore.
+        """
+        with self.lock:
+            entries = self.log[mark:]
+        if ignore is not None:
+            entries = [e for e in entries if not ignore.match(e[1])]
+        return entries
+
+
+    def wait_quiet(self, mark, quiet = 0.5, timeout = 15.0, ignore = None, until = None):
+        """
+        Wait until no instruction arrived for quiet seconds, or until one matches
+        the until pattern. Returns the instructions received after mark.
+        """
+        start = time.perf_counter()
+        while time.perf_counter() - start < timeout:
+            time.sleep(0.02)
+            entries = self.since(mark, ignore)
+            if until is not None:
+                if any(until.match(text) for _, text in entries):
+                    return entries
+                continue
+            last = entries[-1][0] if entries else start
+            if time.perf_counter() - last >= quiet:
+                return entries
+        return self.since(mark, ignore)
+
+
+    def close(self):
+        self.running = False
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class FakeApiServer:
+    """
+    Serves the recorded payloads on 127.0.0.1 in place of Open-Meteo, ipinfo.io
+    and Nominatim. Forecast times are moved to the current hour and the current
+    temperature changes on every request, so every refresh has something new
+    to draw. A forecast for several coordinates is answered with a list, like
+    Open-Meteo does.
+    """
+    ROUTES = {
+        "/v1/forecast": "open_meteo_forecast.json",
+        "/json": "ipinfo.json",
+        "/search": "nominatim.json",
+    }
+
+    def __init__(self, latency = 0.05):
+        """
+        :param latency: Seconds every response is delayed by, to stand for the network.
+        """
+        self.latency = latency
+        self.payloads = {}
+        for path, name in self.ROUTES.items():
+            with open(os.path.join(PAYLOADS_DIR, name), encoding = "utf-8") as f:
+                self.payloads[path] = json.load(f)
+        self.requests = 0
+        # Coordinates per forecast request
+        self.forecast_locations = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                payload = server.payloads.get(url.path)
+                if payload is None:
+                    self.send_error(404)
+                    return
+                time.sleep(server.latency)
+                if url.path == "/v1/forecast":
+                    payload = server.forecast(payload, parse_qs(url.query))
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target = self.server.serve_forever, name = "fake-api", daemon = True).start()
+
+
+    def forecast(self, payload, query):
+        latitudes = query.get("latitude", ["0"])[0].split(",")
+        longitudes = query.get("longitude", ["0"])[0].split(",")
+        with self.lock:
+            self.requests += 1
+            self.forecast_locations.append(len(latitudes))
+        if len(latitudes) == 1:
+            return self.forecast_at(payload, query, 0)
+        return [dict(self.forecast_at(payload, query, i), latitude = float(lat), longitude = float(lng))
+                for i, (lat, lng) in enumerate(zip(latitudes, longitudes))]
+
+
+    def forecast_at(self, payload, query, i):
+        n = self.requests + i
+        now = datetime.now().replace(minute = 0, second = 0, microsecond = 0)
+        payload = json.loads(json.dumps(payload))
+        payload["current"]["time"] = now.strftime("%Y-%m-%dT%H:%M")
+        # The times above are local to this machine
+        payload["utc_offset_seconds"] = int(now.astimezone().utcoffset().total_seconds())
+        payload["current"]["temperature_2m"] = round(payload["current"]["temperature_2m"] + n * 0.1, 1)
+        hourly = payload["hourly"]
+        hours = int(query.get("forecast_hours", [len(hourly["time"])])[0])
+        for key in hourly:
+            hourly[key] = hourly[key][:hours]
+        hourly["time"] = [(now + timedelta(hours = i)).strftime("%Y-%m-%dT%H:%M") for i in range(len(hourly["time"]))]
+        daily = payload["daily"]
+        daily["time"] = [(now + timedelta(days = i)).strftime("%Y-%m-%d") for i in range(len(daily["time"]))]
+        return payload
+
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def cpu_seconds(pid):
+    """
+    User plus system CPU time of a process, from /proc.
+    """
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class App:
+    """
+    main.py started through run_main.py against the fakes, with home as its
+    home directory so caches and history start empty.
+    """
+
+    def __init__(self, fake, api, home, access_points = 12, args = (), locations = ()):
+        """
+        :param fake: FakeNextion main.py drives, or None, e.g. for hub mode.
+        :param locations: Saved locations as (name, lat, lng), written before the start.
+        """
+        if locations:
+            path = os.path.join(home, ".config", "pi-zero-weather", "locations.json")
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            with open(path, "w", encoding = "utf-8") as f:
+                json.dump([{"name": name, "lat": lat, "lng": lng, "timezone": "auto"} for name, lat, lng in locations], f)
+        env = dict(os.environ, HOME = home, PYTHONUNBUFFERED = "1")
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(BENCHMARKS_DIR, "run_main.py"), "--api-url", api.url,
+             "--access-points", str(access_points), "--", *(("--port", fake.port) if fake is not None else ()), *args],
+            cwd = PI_ZERO_DIR, env = env, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, text = True,
+        )
+        self.started = time.perf_counter()
+        # Output once stopped
+        self.output = None
+
+
+    def cpu_seconds(self):
+        return cpu_seconds(self.process.pid)
+
+
+    def stop(self, timeout = 10):
+        """
+        Stop with SIGINT like Ctrl+C and return the output, again when already stopped.
+        """
+        if self.output is not None:
+            return self.output
+        self.process.send_signal(2)
+        try:
+            self.output, _ = self.process.communicate(timeout = timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.output, _ = self.process.communicate()
+        return self.output
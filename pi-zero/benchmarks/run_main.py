@@ -0,0 +1,40 @@
+"""
+Runs main.py with the fake NetworkManager and the API clients pointed at the
+fake API server of the harness. Arguments after -- go to main.py.
+
+    $ python benchmarks/run_main.py --api-url http://127.0.0.1:8000 -- --port /dev/pts/3
+"""
+import argparse
+import os
+import runpy
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PI_ZERO_DIR = os.path.abspath(os.path.join(BENCHMARKS_DIR, ".."))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--api-url", required = True, help = "base URL of the fake API server")
+    parser.add_argument("--access-points", type = int, default = 12)
+    parser.add_argument("main_args", nargs = argparse.REMAINDER)
+    args = parser.parse_args()
+    main_args = args.main_args[1:] if args.main_args[:1] == ["--"] else args.main_args
+
+    sys.path.insert(0, PI_ZERO_DIR)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    import fake_network
+    fake_network.ACCESS_POINTS = args.access_points
+    sys.modules["network"] = fake_network
+
+    from external_api import ApiClient
+    ApiClient.WEATHER_URL = args.api_url + "/v1/forecast"
+    ApiClient.GEOCODE_URL = args.api_url + "/search"
+    ApiClient.IP_INFO_URL = args.api_url + "/json"
+
+    sys.argv = [os.path.join(PI_ZERO_DIR, "main.py"), *main_args]
+    runpy.run_path(sys.argv[0], run_name = "__main__")
+
+
+if __name__ == "__main__":
+    main()
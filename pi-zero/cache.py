@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pi-zero-weather")
+
+
+class PersistentCache:
+    """
+    Small LRU cache that is kept in memory and mirrored to a JSON file.
+
+    Entries are stored with the time they were written, so callers can decide
+    whether a value is fresh (younger than ttl) or merely usable (younger than
+    max_stale) and serve it while a newer value is being fetched.
+    """
+
+    def __init__(self, path: str, ttl: float, max_stale: float = None, max_entries: int = 32):
+        """
+        :param path: JSON file used to persist the cache, or None for memory only.
+        :param ttl: Seconds an entry is considered fresh.
+        :param max_stale: Seconds an entry may still be served stale (default 24h).
+        :param max_entries: Number of entries kept before the least recently used is evicted.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_stale = max_stale if max_stale is not None else 24 * 60 * 60
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.load()
+
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding = "utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable cache %s: %s", self.path, e)
+            return
+        with self.lock:
+            for key, (stored_at, value) in sorted(data.items(), key = lambda item: item[1][0]):
+                self.entries[key] = (stored_at, value)
+            self.evict()
+
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = dict(self.entries)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding = "utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning("Failed to write cache %s: %s", self.path, e)
+
+
+    def get(self, key):
+        """
+        Returns (value, age) for a usable entry, or (None, None) when the entry
+        is missing or older than max_stale.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, None
+            stored_at, value = entry
+            age = time.time() - stored_at
+            if age > self.max_stale:
+                del self.entries[key]
+                return None, None
+            self.entries.move_to_end(key)
+            return value, age
+
+
+    def is_fresh(self, age):
+        return age is not None and age <= self.ttl
+
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+
+    def put_many(self, items):
+        """
+        Store several (key, value) with a single write of the file.
+        """
+        now = time.time()
+        with self.lock:
+            for key, value in items:
+                self.entries[key] = (now, value)
+                self.entries.move_to_end(key)
+            self.evict()
+        self.save()
+
+
+    def evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last = False)
@@ -0,0 +1,202 @@
+from dataclasses import dataclass
+from math import isfinite
+
+TERMINATOR = "\xFF\xFF\xFF"
+
+
+@dataclass(slots = True)
+class Slot:
+    """
+    Precomputed pieces of the instructions drawn in one column of a chart.
+    """
+    left: int
+    # "fill <x>," of the bar, followed by top,width,height,color
+    bar: str
+    # "pic <x>,<y>," of the picture, followed by the picture id
+    pic: str
+    # "xstr <x>," of a label and its ",w,h,font,colors,alignment,sta,\"" tail, y goes in between
+    label: str
+    label_tail: str
+
+
+class Chart:
+    """
+    Draws forecasts into a fixed box of the page with fill/xstr/line/pic instructions.
+
+    The geometry only depends on the box and the number of columns, so it is
+    computed once per column count and every redraw just fills in the values.
+    """
+
+    def __init__(self, left: int, top: int, width: int, height: int, bar_width: int = 20, pic_width: int = 50,
+                 label_height: int = 30, font: int = 3, bar_color: int = 65120, line_color: int = 65120,
+                 axis_color: int = 31727):
+        """
+        :param left, top, width, height: Box the bars and lines are scaled into, labels go above and below it.
+        :param pic_width: Size of the square pictures under the axis.
+        """
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.bar_width = bar_width
+        self.pic_width = pic_width
+        self.label_height = label_height
+        self.font = font
+        self.bar_color = bar_color
+        self.line_color = line_color
+        # Below the labels of the lowest values
+        self.bottom = top + height + label_height + 10
+        self.pic_top = self.bottom + 20
+        self.axis = f"line {left},{self.bottom},{left + width},{self.bottom},{axis_color}{TERMINATOR}"
+        self.layouts = {}
+        self.points = {}
+
+
+    def layout(self, n):
+        """
+        The n evenly spaced columns of the chart.
+        """
+        layout = self.layouts.get(n)
+        if layout is None:
+            space = self.width // n
+            bar_margin = (space - self.bar_width) // 2
+            pic_margin = (space - self.pic_width) // 2
+            layout = []
+            for i in range(n):
+                left = self.left + i * space
+                layout.append(Slot(
+                    left = left,
+                    bar = f"fill {left + bar_margin},",
+                    pic = f"pic {left + pic_margin},{self.pic_top},",
+                    label = f"xstr {left},",
+                    label_tail = f",{space},{self.label_height},{self.font},WHITE,0,1,1,0,\"",
+                ))
+            self.layouts[n] = layout
+        return layout
+
+
+    def x_positions(self, n):
+        """
+        x of n points spread over the whole width, for line charts.
+        """
+        xs = self.points.get(n)
+        if xs is None:
+            xs = [self.x_at(i, n) for i in range(n)]
+            self.points[n] = xs
+        return xs
+
+
+    def scale(self, low, high):
+        return self.height / (high - low) if high > low else 1
+
+
+    def daily(self, lows, highs, pictures, dates):
+        """
+        N-day chart: a min/max bar per day with the day's picture and date under the axis.
+
+        :param pictures: Picture id per day.
+        :param dates: Label per day, e.g. "Mon 01".
+        """
+        n = min(len(lows), len(highs), len(pictures), len(dates))
+        if n == 0:
+            return ""
+        parts = self.range_parts(lows[:n], highs[:n])
+        label_top = self.pic_top + self.pic_width + 10
+        for slot, pic_id, date in zip(self.layout(n), pictures, dates):
+            parts.append(f"{slot.pic}{pic_id}{TERMINATOR}")
+            parts.append(f"{slot.label}{label_top}{slot.label_tail}{date}\"{TERMINATOR}")
+        return "".join(parts)
+
+
+    def range(self, lows, highs):
+        """
+        Min/max range chart: a bar from low to high per column, labelled with both.
+        """
+        return "".join(self.range_parts(lows, highs))
+
+
+    def range_parts(self, lows, highs):
+        n = min(len(lows), len(highs))
+        if n == 0:
+            return []
+        # A day Open-Meteo has no value for (null, NaN in the columns) is left empty
+        shown = [i for i in range(n) if isfinite(lows[i]) and isfinite(highs[i])]
+        if not shown:
+            return [self.axis]
+        low = min(lows[i] for i in shown)
+        high = max(highs[i] for i in shown)
+        scale = self.scale(low, high)
+        bottom = self.top + self.height
+        tail = f",{self.bar_width},"
+        color = f",{self.bar_color}{TERMINATOR}"
+        parts = []
+        for slot, day_low, day_high in zip(self.layout(n), lows, highs):
+            if not (isfinite(day_low) and isfinite(day_high)):
+                continue
+            top = bottom - int((day_high - low) * scale)
+            height = int((day_high - day_low) * scale)
+            parts.append(f"{slot.bar}{top}{tail}{height}{color}")
+            parts.append(f"{slot.label}{top - self.label_height}{slot.label_tail} {int(day_high)}°\"{TERMINATOR}")
+            parts.append(f"{slot.label}{top + height}{slot.label_tail} {int(day_low)}°\"{TERMINATOR}")
+        parts.append(self.axis)
+        return parts
+
+
+    def line(self, values, labels = None, positions = None, span = None, unit = "°", unit_width = 60):
+        """
+        Hourly chart: a line through the values, spread over the whole width.
+
+        :param labels: Optional (position, text) pairs written under the axis at those points.
+        :param positions: Position of each value out of span, for series that were
+                          downsampled or have gaps; by default the values are evenly spaced.
+        :param span: Number of positions the width stands for.
+        :param unit: Written after the labels of the highest and lowest value.
+        :param unit_width: Width of those labels, wider for longer units.
+        """
+        n = len(values)
+        if n == 0:
+            return ""
+        low = min(values)
+        high = max(values)
+        scale = self.scale(low, high)
+        bottom = self.top + self.height
+        color = f",{self.line_color}{TERMINATOR}"
+        if positions is None:
+            xs = self.x_positions(n)
+            span = n
+        else:
+            xs = [self.x_at(p, span) for p in positions]
+        ys = [bottom - int((value - low) * scale) for value in values]
+        parts = [f"line {xs[i]},{ys[i]},{xs[i + 1]},{ys[i + 1]}{color}" for i in range(n - 1)]
+        if n == 1:
+            parts.append(f"line {xs[0]},{ys[0]},{xs[0]},{ys[0]}{color}")
+        # Extremes are labelled next to their points
+        value_tail = f",{unit_width},{self.label_height},{self.font},WHITE,0,1,1,0,\""
+        value_right = self.left + self.width - unit_width
+        i_high = values.index(high)
+        i_low = values.index(low)
+        parts.append(f"xstr {min(xs[i_high], value_right)},{ys[i_high] - self.label_height}{value_tail}{int(high)}{unit}\"{TERMINATOR}")
+        if i_low != i_high:
+            parts.append(f"xstr {min(xs[i_low], value_right)},{ys[i_low]}{value_tail}{int(low)}{unit}\"{TERMINATOR}")
+        parts.append(self.axis)
+        tail = f",60,{self.label_height},{self.font},WHITE,0,1,1,0,\""
+        right = self.left + self.width - 60
+        if labels:
+            for p, text in labels:
+                x = min(max(self.x_at(p, span) - 30, self.left), right)
+                parts.append(f"xstr {x},{self.bottom + 10}{tail}{text}\"{TERMINATOR}")
+        return "".join(parts)
+
+
+    def x_at(self, position, span):
+        if span <= 1:
+            return self.left + self.width // 2
+        return self.left + position * (self.width - 1) // (span - 1)
+
+
+    def contains(self, x, y):
+        """
+        Whether a touch at x, y is on the chart, including its labels and pictures.
+        """
+        bottom = self.pic_top + self.pic_width + 10 + self.label_height
+        return self.left <= x < self.left + self.width and self.top - self.label_height <= y < bottom
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from commands import CommandBatch
+
+log = logging.getLogger(__name__)
+
+
+class DisplayClock:
+    """
+    Keeps the date and time on the display.
+
+    Displays with an RTC (Enhanced and Intelligent series) run the clock
+    themselves: the RTC registers rtc0-rtc5 are set once and the tmClock timer
+    of the HMI renders them into tDatetime, see the README. The time is only
+    written again when the system clock was stepped (e.g. by NTP), the
+    timezone changed or the RTC drifted. Displays without an RTC, like the
+    NX8048T050 of the Basic series, or without the timer in their HMI get
+    tDatetime every second as before.
+    """
+    # Seconds between the local checks for a stepped clock or another timezone, no traffic
+    CHECK_SEC = 10
+    # Seconds between reading the RTC back to measure its drift
+    DRIFT_CHECK_SEC = 15 * 60
+    MAX_DRIFT_SEC = 2
+    # Seconds to wait for an answer to get
+    QUERY_TIMEOUT_SEC = 2
+    # Component of the HMI that renders the RTC, checked to exist before relying on it
+    TIMER = "pageMain.tmClock.tim"
+
+    def __init__(self, nextion, shown = None):
+        """
+        :param nextion: Nextion of the display.
+        :param shown: Callable returning whether the page with tDatetime is shown,
+                      the time is only sent every second while it is.
+        """
+        self.nextion = nextion
+        self.shown = shown
+        self.has_rtc = None
+        self.syncs = 0
+        self.last_drift = None
+        # time.time() - time.monotonic() and timezone at the last sync, a change means the clock was set
+        self.offset = None
+        self.zone = None
+        self.batch = CommandBatch(64)
+        self.task = None
+
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+    async def run(self):
+        self.has_rtc = await self.query("rtc0") is not None and await self.query(self.TIMER) is not None
+        if not self.has_rtc:
+            log.info("No RTC clock on the display, sending the time every second")
+            await self.tick()
+            return
+        log.info("Display RTC found, the display renders the clock")
+        await self.sync("start")
+        last_drift_check = time.monotonic()
+        while True:
+            await asyncio.sleep(self.CHECK_SEC)
+            reason = self.changed()
+            if reason is None and time.monotonic() - last_drift_check >= self.DRIFT_CHECK_SEC:
+                last_drift_check = time.monotonic()
+                self.last_drift = await self.drift()
+                if self.last_drift is not None and abs(self.last_drift) > self.MAX_DRIFT_SEC:
+                    reason = f"drift {self.last_drift:+.0f}s"
+            if reason is not None:
+                await self.sync(reason)
+
+
+    async def tick(self):
+        while True:
+            now = datetime.now()
+            # Other pages have no tDatetime, the display would answer Invalid Component ID
+            if self.shown is None or self.shown():
+                self.send_time(now)
+            # Wake just after the next second boundary instead of polling
+            await asyncio.sleep(1.005 - now.microsecond / 1_000_000)
+
+
+    def send_time(self, now):
+        self.nextion.send(f'tDatetime.txt="{now.strftime("%Y-%m-%d %H:%M:%S")}"\xFF\xFF\xFF', False)
+
+
+    def show(self):
+        """
+        The page with tDatetime was loaded, send the time without waiting for the next tick.
+        """
+        if self.has_rtc is False:
+            self.send_time(datetime.now())
+
+
+    def changed(self):
+        """
+        Why the RTC needs setting again without asking the display, or None.
+        """
+        time.tzset()
+        if self.zone != (time.timezone, time.altzone, time.tzname):
+            return "timezone change"
+        offset = time.time() - time.monotonic()
+        if abs(offset - self.offset) > 1:
+            return f"clock stepped {offset - self.offset:+.0f}s"
+        return None
+
+
+    async def sync(self, reason):
+        # Right after a second boundary, so the seconds written stay right for longest
+        await asyncio.sleep(1.005 - datetime.now().microsecond / 1_000_000)
+        now = datetime.now()
+        batch = self.batch
+        batch.clear()
+        for register, value in enumerate((now.year, now.month, now.day, now.hour, now.minute, now.second)):
+            batch.set_attr(f"rtc{register}", value)
+        self.nextion.send_batch(batch)
+        self.offset = time.time() - time.monotonic()
+        self.zone = (time.timezone, time.altzone, time.tzname)
+        self.syncs += 1
+        log.info("Set the display RTC to %s (%s)", now.strftime("%Y-%m-%d %H:%M:%S"), reason)
+
+
+    async def drift(self):
+        """
+        Seconds the RTC is ahead of the system clock, or None if it cannot be read.
+        """
+        values = []
+        for register in range(6):
+            value = await self.query(f"rtc{register}")
+            if value is None:
+                return None
+            values.append(value)
+        now = datetime.now()
+        try:
+            rtc = datetime(*values)
+        except ValueError:
+            # Never set or lost, e.g. a flat battery
+            return float("inf")
+        # The registers are read one after another, the seconds come last
+        return (rtc - now.replace(microsecond = 0)) / timedelta(seconds = 1)
+
+
+    async def query(self, variable):
+        future = asyncio.get_running_loop().create_future()
+
+        def answer(value):
+            if not future.done():
+                future.set_result(value)
+
+        self.nextion.get(variable, answer)
+        try:
+            return await asyncio.wait_for(future, self.QUERY_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            return None
+
+
+    def print_stats(self):
+        mode = "display RTC" if self.has_rtc else "sent every second"
+        drift = f"{self.last_drift:+.0f}s" if self.last_drift is not None else "-"
+        print(f"Clock      {mode}, syncs={self.syncs}, last drift={drift}")
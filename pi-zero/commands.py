@@ -0,0 +1,146 @@
+import re
+
+TERMINATOR = b'\xFF\xFF\xFF'
+
+# Kinds of instructions, by what a later instruction of the batch can make redundant
+ATTRIBUTE = 0
+DRAWING = 1
+PAGE = 2
+CLEAR = 3
+OTHER = 4
+
+# GPU instructions that paint over the page and do not change any component
+DRAWING_INSTRUCTIONS = frozenset(("fill", "xstr", "line", "pic", "picq", "xpic", "cir", "cirs", "draw", "crop"))
+
+ASSIGNMENT = re.compile(r'(\w+\.\w+)=')
+
+
+def classify(instruction):
+    """
+    (kind, key) of an instruction without its terminator, the key is the
+    component attribute an assignment writes.
+    """
+    match = ASSIGNMENT.match(instruction)
+    if match:
+        return ATTRIBUTE, match.group(1)
+    word = instruction.split(" ", 1)[0]
+    if word in DRAWING_INSTRUCTIONS:
+        return DRAWING, None
+    if word == "page":
+        return PAGE, None
+    if word == "cls":
+        return CLEAR, None
+    return OTHER, None
+
+
+class CommandBatch:
+    """
+    Instructions for one transmission, encoded once into a reusable bytearray.
+
+    optimize() drops what a later instruction of the same batch makes pointless:
+    an attribute written again later (only the last value is sent), attributes
+    and drawings followed by a page load, which resets the page, and drawings
+    followed by cls. Any other instruction, e.g. get or sendme, may observe
+    the screen and is a barrier nothing is dropped across.
+    """
+
+    def __init__(self, size: int = 1024):
+        """
+        :param size: Initial capacity in bytes, grown as needed and kept across batches.
+        """
+        self.buffer = bytearray(size)
+        self.end = 0
+        # (start, stop, kind, key) of every instruction, stop includes the terminator
+        self.spans = []
+        self.dropped = 0
+        self.dropped_bytes = 0
+
+
+    def clear(self):
+        self.end = 0
+        self.spans.clear()
+
+
+    def append(self, data, kind, key = None):
+        end = self.end + len(data) + 3
+        if end > len(self.buffer):
+            self.buffer.extend(bytes(max(end - len(self.buffer), len(self.buffer))))
+        self.buffer[self.end:end] = data + TERMINATOR
+        self.spans.append((self.end, end, kind, key))
+        self.end = end
+
+
+    def set_attr(self, name, value):
+        """
+        Add name=value, e.g. set_attr("tSSID1.bco", 65535).
+        """
+        self.append(f'{name}={value}'.encode('iso-8859-1'), ATTRIBUTE, name)
+
+
+    def add(self, instructions):
+        """
+        Add instructions as str, one or several each ending with the terminator.
+        """
+        for instruction in instructions.split("\xFF\xFF\xFF"):
+            if instruction:
+                kind, key = classify(instruction)
+                self.append(instruction.encode('iso-8859-1'), kind, key)
+
+
+    def optimize(self):
+        """
+        Drop the redundant instructions, returns how many were dropped.
+        """
+        live = []
+        written = set()
+        page_loaded = cleared = False
+        for span in reversed(self.spans):
+            kind, key = span[2], span[3]
+            if kind is ATTRIBUTE:
+                if page_loaded or key in written:
+                    self.drop(span)
+                    continue
+                written.add(key)
+            elif kind is DRAWING:
+                if page_loaded or cleared:
+                    self.drop(span)
+                    continue
+            elif kind is PAGE:
+                page_loaded = True
+            elif kind is CLEAR:
+                cleared = True
+            else:
+                written.clear()
+                page_loaded = cleared = False
+            live.append(span)
+        dropped = len(self.spans) - len(live)
+        live.reverse()
+        self.spans = live
+        return dropped
+
+
+    def drop(self, span):
+        self.dropped += 1
+        self.dropped_bytes += span[1] - span[0]
+
+
+    def instructions(self):
+        """
+        Copies of the instructions, each with its terminator.
+        """
+        return [bytes(self.buffer[start:stop]) for start, stop, _, _ in self.spans]
+
+
+    def __len__(self):
+        return len(self.spans)
+
+
+    def size(self):
+        return sum(stop - start for start, stop, _, _ in self.spans)
+
+
+    def transmit_seconds(self, baudrate):
+        """
+        Line time of the batch, 10 bits per byte.
+        """
+        return self.size() * 10 / baudrate
@@ -0,0 +1,110 @@
+from commands import CommandBatch
+
+
+class DisplayState:
+    """
+    Retained-mode layer above Nextion.
+
+    Callers describe the desired attribute values and drawings of a page and
+    call commit(); only the values that differ from what is already on the
+    screen are transmitted. Component attributes are reset by the display
+    whenever a page is loaded, so the shadow copy is dropped on every page
+    change and the desired state of the new page is sent again in full.
+    """
+
+    def __init__(self, nextion, page_names):
+        """
+        :param nextion: Nextion instance used to transmit the changes.
+        :param page_names: Map of page ID to page name, used to reload a page.
+        """
+        self.nextion = nextion
+        self.page_names = page_names
+        self.page = None
+        # page -> {"tSSID1.bco": "65535"}, what the screen should show
+        self.desired = {page: {} for page in page_names}
+        # page -> {name: (key, instruction)}, drawing commands that are not component attributes
+        self.desired_drawings = {page: {} for page in page_names}
+        # Attributes and drawing keys currently on the screen of self.page
+        self.shadow = {}
+        self.shadow_drawings = {}
+        # Reused by every commit
+        self.batch = CommandBatch()
+        self.bytes_sent = 0
+        self.bytes_skipped = 0
+
+
+    def set_txt(self, page, component, text):
+        self.set_attr(page, component, "txt", f'"{self.escape(text)}"')
+
+
+    def set_attr(self, page, component, attr, value):
+        self.desired[page][f"{component}.{attr}"] = str(value)
+
+
+    def set_drawing(self, page, name, key, instruction):
+        """
+        Set a drawing (fill, xstr, line, pic, ...) identified by name. It is only
+        transmitted when key changes; a drawing that replaces an older one on
+        the screen reloads the page first to erase it.
+        """
+        self.desired_drawings[page][name] = (key, instruction)
+
+
+    def clear_drawing(self, page, name):
+        self.desired_drawings[page].pop(name, None)
+
+
+    def page_changed(self, page):
+        """
+        The display has loaded a page, so everything on it is back to the HMI defaults.
+        """
+        self.page = page
+        self.shadow = {}
+        self.shadow_drawings = {}
+
+
+    def reload_page(self):
+        self.batch.add(f'page {self.page_names[self.page]}\xFF\xFF\xFF')
+        self.page_changed(self.page)
+
+
+    def commit(self):
+        if self.page is None:
+            return
+        batch = self.batch
+        batch.clear()
+        drawings = self.desired_drawings[self.page]
+        for name, key in self.shadow_drawings.items():
+            if name not in drawings or drawings[name][0] != key:
+                self.reload_page()
+                break
+
+        for name, value in self.desired[self.page].items():
+            if self.shadow.get(name) == value:
+                self.bytes_skipped += len(name) + len(value) + 4
+                continue
+            self.shadow[name] = value
+            batch.set_attr(name, value)
+        for name, (key, drawing) in drawings.items():
+            if self.shadow_drawings.get(name) == key:
+                self.bytes_skipped += len(drawing)
+                continue
+            self.shadow_drawings[name] = key
+            batch.add(drawing)
+
+        if batch:
+            batch.optimize()
+            self.bytes_sent += batch.size()
+            self.nextion.send_batch(batch)
+
+
+    def print_stats(self):
+        total = self.bytes_sent + self.bytes_skipped
+        saved = 100 * self.bytes_skipped / total if total else 0
+        print(f"Display    sent={self.bytes_sent}B, skipped={self.bytes_skipped}B ({saved:.0f}% saved), "
+              f"dropped={self.batch.dropped} instructions ({self.batch.dropped_bytes}B)")
+
+
+    @staticmethod
+    def escape(text):
+        return str(text).replace('\\', '\\\\').replace('"', '\\"')
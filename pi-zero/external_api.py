@@ -1,6 +1,27 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
 import requests
-from dataclasses import dataclass, field
+from requests.adapters import HTTPAdapter
+from array import array
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
+from cache import PersistentCache, DEFAULT_CACHE_DIR
+from units import convert_weather
+from ratelimit import NOMINATIM
+from timeseries import HourlySeries, to_array
+import metrics
+
+log = logging.getLogger(__name__)
+
+HTTP_SECONDS = metrics.summary("http_request_seconds", "Latency of each HTTP attempt by endpoint.")
+HTTP_ERRORS = metrics.counter("http_errors_total", "Failed HTTP attempts by endpoint.")
+HTTP_RETRIES = metrics.counter("http_retries_total", "Retried HTTP attempts by endpoint.")
+PARSE_SECONDS = metrics.summary("parse_seconds", "Time spent decoding JSON (stage=json) and building the dataclasses (stage=objects).")
 
 WEATHER_DESCRIPTION = {
     0: "Clear",
@@ -56,16 +77,106 @@ class Current:
 
 
 @dataclass
+class DailySeries:
+    """
+    Daily forecast stored column-wise: the lists of the Open-Meteo response as
+    they are and the temperatures as typed arrays. Indexing returns a Daily
+    view, its dates are parsed and its weather described only when read, so
+    days that are never shown cost nothing.
+    """
+    # ISO dates, "2024-06-01"
+    time: list = field(default_factory = list)
+    weather_code: list = field(default_factory = list)
+    temperature_max: array = field(default_factory = lambda: array("d"))
+    temperature_min: array = field(default_factory = lambda: array("d"))
+    # ISO times, "2024-06-01T05:42"
+    sunrise: list = field(default_factory = list)
+    sunset: list = field(default_factory = list)
+    uv_index: list = field(default_factory = list)
+    precipitation_probability: list = field(default_factory = list)
+
+    def __len__(self):
+        return len(self.time)
+
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return DailySeries(self.time[i], self.weather_code[i], self.temperature_max[i], self.temperature_min[i],
+                               self.sunrise[i], self.sunset[i], self.uv_index[i], self.precipitation_probability[i])
+        if i < 0:
+            i += len(self.time)
+        if not 0 <= i < len(self.time):
+            raise IndexError("day out of range")
+        return Daily(self, i)
+
+
+    def __iter__(self):
+        return (Daily(self, i) for i in range(len(self.time)))
+
+
+    def dates(self):
+        return [datetime.fromisoformat(t) for t in self.time]
+
+
 class Daily:
-    date: datetime = None
-    weather_code: int = 0
-    weather_description: str = ""
-    sunrise: datetime = None
-    sunset: datetime = None
-    uv_index: float = 0.0
-    precipitation_probability: int = 0
-    temperature_max: float = 0.0
-    temperature_min: float = 0.0
+    """
+    One day of a DailySeries, reading through to its columns.
+    """
+    __slots__ = ("series", "i")
+
+    def __init__(self, series, i):
+        self.series = series
+        self.i = i
+
+
+    def __repr__(self):
+        return f"Daily({self.series.time[self.i]}, weather_code={self.weather_code}, " \
+               f"temperature={self.temperature_min}..{self.temperature_max})"
+
+
+    @property
+    def date(self):
+        return datetime.fromisoformat(self.series.time[self.i])
+
+
+    @property
+    def weather_code(self):
+        return self.series.weather_code[self.i]
+
+
+    @property
+    def weather_description(self):
+        return WEATHER_DESCRIPTION[self.series.weather_code[self.i]]
+
+
+    @property
+    def sunrise(self):
+        return datetime.fromisoformat(self.series.sunrise[self.i])
+
+
+    @property
+    def sunset(self):
+        return datetime.fromisoformat(self.series.sunset[self.i])
+
+
+    @property
+    def uv_index(self):
+        return self.series.uv_index[self.i]
+
+
+    @property
+    def precipitation_probability(self):
+        return self.series.precipitation_probability[self.i]
+
+
+    @property
+    def temperature_max(self):
+        return self.series.temperature_max[self.i]
+
+
+    @property
+    def temperature_min(self):
+        return self.series.temperature_min[self.i]
 
 
 @dataclass
@@ -73,9 +184,41 @@ class WeatherData:
     latitude: float = 0.0
     longitude: float = 0.0
     timezone: str = ""
+    # Offset of the times in the response, which are local to the location, from UTC
+    utc_offset_seconds: int = 0
     current_units: CurrentUnits = None
     current: Current = None
-    daily: list = field(default_factory=list)
+    daily: DailySeries = field(default_factory = DailySeries)
+    hourly: HourlySeries = None
+
+
+def normalize_query(address):
+    """
+    Cache key of a geocode query: case, punctuation and spacing are ignored,
+    so "New York,  NY" and "new york ny" share a cache entry. Nominatim is
+    sent the text as typed, its commas separate the parts of an address.
+    """
+    address = unicodedata.normalize("NFKC", address).casefold()
+    address = re.sub(r"[^\w]+", " ", address)
+    return address.strip()
+
+
+@dataclass
+class EndpointStats:
+    requests: int = 0
+    errors: int = 0
+    retries: int = 0
+    total_sec: float = 0.0
+    max_sec: float = 0.0
+    last_sec: float = 0.0
+
+    @property
+    def mean_sec(self):
+        return self.total_sec / self.requests if self.requests else 0.0
+
+    def __str__(self):
+        return f"requests={self.requests}, errors={self.errors}, retries={self.retries}, " \
+               f"last={self.last_sec * 1000:.0f}ms, mean={self.mean_sec * 1000:.0f}ms, max={self.max_sec * 1000:.0f}ms"
 
 
 @dataclass
@@ -103,108 +246,282 @@ class IPInfo:
 
 
 class ApiClient:
-    def get_weather(self, lat, lng, timezone = "", temp_unit = "celsius"):
-        url = "https://api.open-meteo.com/v1/forecast"
-        params = {
+    WEATHER_URL = "https://api.open-meteo.com/v1/forecast"
+    GEOCODE_URL = "https://nominatim.openstreetmap.org/search"
+    IP_INFO_URL = "https://ipinfo.io/json"
+    WEATHER_CURRENT_FIELDS = "temperature_2m,is_day,precipitation,weather_code,relative_humidity_2m"
+    WEATHER_DAILY_FIELDS = "weather_code,temperature_2m_max,temperature_2m_min,sunrise,sunset,uv_index_max,precipitation_probability_max"
+    WEATHER_HOURLY_FIELDS = "temperature_2m,precipitation_probability,wind_speed_10m"
+    WEATHER_FORECAST_DAYS = 5
+    # Hourly values start at the current hour; the chart shows 48 of them, the
+    # rest keeps a cached forecast useful for a while
+    WEATHER_FORECAST_HOURS = 72
+    WEATHER_TTL_SEC = 10 * 60
+    IP_INFO_TTL_SEC = 24 * 60 * 60
+    GEOCODE_TTL_SEC = 30 * 24 * 60 * 60
+    # "No result" is cached for a shorter time in case the place gets mapped
+    GEOCODE_NEGATIVE_TTL_SEC = 24 * 60 * 60
+
+    # (connect, read) deadlines in seconds
+    TIMEOUT = (3.05, 10)
+    MAX_RETRIES = 3
+    BACKOFF_BASE_SEC = 0.5
+    BACKOFF_MAX_SEC = 8
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+    def __init__(self, cache_dir = DEFAULT_CACHE_DIR, weather_ttl = WEATHER_TTL_SEC, weather_cache_size = 16):
+        """
+        :param cache_dir: Directory for the on-disk caches, or None to keep them in memory only.
+        :param weather_ttl: Seconds a cached forecast is served before it is fetched again.
+        :param weather_cache_size: Number of forecasts kept before LRU eviction.
+        """
+        # One keep-alive session so repeated calls skip the TCP+TLS handshake.
+        # Retries are handled in request() to add jitter and count them.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = 4, pool_maxsize = 2, max_retries = 0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+        weather_path = os.path.join(cache_dir, "weather.json") if cache_dir else None
+        self.weather_cache = PersistentCache(weather_path, weather_ttl, max_entries = weather_cache_size)
+        ip_info_path = os.path.join(cache_dir, "ip_info.json") if cache_dir else None
+        self.ip_info_cache = PersistentCache(ip_info_path, self.IP_INFO_TTL_SEC, max_entries = 16)
+        geocode_path = os.path.join(cache_dir, "geocode.json") if cache_dir else None
+        self.geocode_cache = PersistentCache(geocode_path, self.GEOCODE_TTL_SEC, self.GEOCODE_TTL_SEC, max_entries = 256)
+
+
+    def get_weather(self, lat, lng, timezone = "", temp_unit = "celsius", refresh = False):
+        """
+        Returns the forecast, from the cache while it is younger than the TTL
+        and fetched otherwise; a failed fetch falls back to the cached forecast
+        however old. With refresh it is fetched even when fresh.
+
+        Forecasts are always fetched and cached in Open-Meteo's default units
+        (°C, km/h, mm) and converted to temp_unit locally, so changing units
+        never needs a request.
+        """
+        return self.get_weather_batch([(lat, lng, timezone)], temp_unit, refresh)[0]
+
+
+    def peek_weather(self, lat, lng, timezone = "", temp_unit = "celsius"):
+        """
+        Returns the cached forecast however old it is, or None. Never touches the network.
+        """
+        data, _ = self.weather_cache.get(self.weather_cache_key(self.weather_params(lat, lng, timezone)))
+        if data is None:
+            return None
+        with PARSE_SECONDS.time(endpoint = "weather", stage = "objects"):
+            weatherData = self.parse_weather(data)
+        return convert_weather(weatherData, temperature = temp_unit)
+
+
+    def get_weather_batch(self, locations, temp_unit = "celsius", refresh = False):
+        """
+        get_weather() for several (lat, lng, timezone) at once. The forecasts
+        that have to be fetched come from one request, Open-Meteo takes lists of
+        coordinates, and are cached one by one like single forecasts.
+
+        Returns a WeatherData or None per location, in the same order.
+        """
+        params = [self.weather_params(lat, lng, timezone) for lat, lng, timezone in locations]
+        keys = [self.weather_cache_key(p) for p in params]
+        cached = [self.weather_cache.get(key) for key in keys]
+        missing = [i for i, (data, age) in enumerate(cached) if refresh or not self.weather_cache.is_fresh(age)]
+        results = [data for data, _ in cached]
+        if missing:
+            fetched = self.fetch_weather_batch([keys[i] for i in missing], [params[i] for i in missing])
+            for i, data in zip(missing, fetched):
+                if data is not None:
+                    results[i] = data
+        forecasts = []
+        for data in results:
+            if data is None:
+                forecasts.append(None)
+                continue
+            with PARSE_SECONDS.time(endpoint = "weather", stage = "objects"):
+                weatherData = self.parse_weather(data)
+            forecasts.append(convert_weather(weatherData, temperature = temp_unit))
+        return forecasts
+
+
+    def fetch_weather_batch(self, keys, params):
+        """
+        Fetch the forecasts of several parameter sets in one request, returns a
+        response object or None per set.
+        """
+        if len(params) == 1:
+            return [self.fetch_weather(keys[0], params[0])]
+        batch = dict(params[0])
+        for name in ("latitude", "longitude", "timezone"):
+            # An empty timezone means Open-Meteo's default, which has to be spelled out in a list
+            batch[name] = ",".join(str(p[name]) or "GMT" for p in params)
+        try:
+            response = self.request("weather", self.WEATHER_URL, params = batch)
+            with PARSE_SECONDS.time(endpoint = "weather", stage = "json"):
+                results = response.json()
+        except requests.exceptions.RequestException as e:
+            log.warning("Error fetching weather data for %d locations: %s", len(params), e)
+            return [None] * len(params)
+        if not isinstance(results, list) or len(results) != len(params):
+            log.warning("Expected %d forecasts, got %s", len(params), type(results).__name__)
+            return [None] * len(params)
+        self.weather_cache.put_many(zip(keys, results))
+        return results
+
+
+    def weather_params(self, lat, lng, timezone):
+        return {
             "latitude": lat,
             "longitude": lng,
-            "current": "temperature_2m,is_day,precipitation,weather_code,relative_humidity_2m",
-            "daily": "weather_code,temperature_2m_max,temperature_2m_min,sunrise,sunset,uv_index_max,precipitation_probability_max",
+            "current": self.WEATHER_CURRENT_FIELDS,
+            "daily": self.WEATHER_DAILY_FIELDS,
+            "hourly": self.WEATHER_HOURLY_FIELDS,
             "timezone": timezone,
-            "temperature_unit": temp_unit,
-            "forecast_days": 5
+            "forecast_days": self.WEATHER_FORECAST_DAYS,
+            "forecast_hours": self.WEATHER_FORECAST_HOURS
         }
 
-        try:
-            response = requests.get(url, params = params)
-            response.raise_for_status()
-            data = response.json()
-            
-            cur = data.get("current", {})
-            current = Current(
-                time = cur.get("time", ""),
-                temperature = cur.get("temperature_2m", 0.0),
-                humidity = cur.get("relative_humidity_2m", 0.0),
-                is_day = cur.get("is_day") == 1,
-                precipitation = cur.get("precipitation", 0.0),
-                weather_code = cur.get("weather_code", 0),
-                weather_description = WEATHER_DESCRIPTION[cur.get("weather_code", 0)],
-                cloud_cover = cur.get("cloud_cover"),
-                wind_speed = cur.get("wind_speed_10m", 0.0),
-                wind_direction = cur.get("wind_direction_10m", 0)
-            )
 
-            units = data.get("current_units", {})
-            cur_units = CurrentUnits(
-                temperature = units.get("temperature_2m", ""),
-                precipitation = units.get("precipitation", ""),
-                wind_speed = units.get("wind_speed_10m", ""),
-            )
+    def weather_cache_key(self, params):
+        # Two decimals is roughly 1 km, well below the forecast model resolution
+        lat = round(float(params["latitude"]), 2)
+        lng = round(float(params["longitude"]), 2)
+        return f'{lat:.2f},{lng:.2f}|{params["timezone"]}|' \
+               f'{params["current"]}|{params["daily"]}|{params["forecast_days"]}|' \
+               f'{params["hourly"]}|{params["forecast_hours"]}'
 
-            d = data.get("daily", {})
-            daily = [
-                Daily(
-                    date = datetime.strptime(d.get("time")[i], "%Y-%m-%d"),
-                    weather_code = d.get("weather_code")[i],
-                    weather_description = WEATHER_DESCRIPTION[d.get("weather_code")[i]],
-                    temperature_max = d.get("temperature_2m_max")[i],
-                    temperature_min = d.get("temperature_2m_min")[i],
-                    sunrise = datetime.strptime(d.get("sunrise")[i], "%Y-%m-%dT%H:%M"),
-                    sunset = datetime.strptime(d.get("sunset")[i], "%Y-%m-%dT%H:%M"),
-                    uv_index = d.get("uv_index_max")[i],
-                    precipitation_probability = d.get("precipitation_probability_max")[i]
-                )
-                for i in range(len(d.get("time", [])))
-            ]
-
-            weatherData = WeatherData(
-                latitude = data.get("latitude", 0.0),
-                longitude = data.get("longitude", 0.0),
-                timezone = data.get("timezone", ""),
-                current_units = cur_units,
-                current = current,
-                daily = daily
-            )
-            return weatherData
+
+    def fetch_weather(self, key, params):
+        try:
+            response = self.request("weather", self.WEATHER_URL, params = params)
+            with PARSE_SECONDS.time(endpoint = "weather", stage = "json"):
+                data = response.json()
         except requests.exceptions.RequestException as e:
-            print(f"Error fetching weather data: {e}")
+            log.warning("Error fetching weather data: %s", e)
             return None
+        self.weather_cache.put(key, data)
+        return data
+
+
+    def parse_weather(self, data):
+        cur = data.get("current", {})
+        current = Current(
+            time = cur.get("time", ""),
+            temperature = cur.get("temperature_2m", 0.0),
+            humidity = cur.get("relative_humidity_2m", 0.0),
+            is_day = cur.get("is_day") == 1,
+            precipitation = cur.get("precipitation", 0.0),
+            weather_code = cur.get("weather_code", 0),
+            weather_description = WEATHER_DESCRIPTION[cur.get("weather_code", 0)],
+            cloud_cover = cur.get("cloud_cover"),
+            wind_speed = cur.get("wind_speed_10m", 0.0),
+            wind_direction = cur.get("wind_direction_10m", 0)
+        )
+
+        units = data.get("current_units", {})
+        cur_units = CurrentUnits(
+            temperature = units.get("temperature_2m", ""),
+            precipitation = units.get("precipitation", ""),
+            wind_speed = units.get("wind_speed_10m", ""),
+        )
+
+        # The lists of the response become the columns, nothing is copied per day
+        d = data.get("daily", {})
+        daily = DailySeries(
+            time = d.get("time") or [],
+            weather_code = d.get("weather_code") or [],
+            temperature_max = to_array(d.get("temperature_2m_max") or [], "d"),
+            temperature_min = to_array(d.get("temperature_2m_min") or [], "d"),
+            sunrise = d.get("sunrise") or [],
+            sunset = d.get("sunset") or [],
+            uv_index = d.get("uv_index_max") or [],
+            precipitation_probability = d.get("precipitation_probability_max") or [],
+        )
+
+        h = data.get("hourly", {})
+        hourly = None
+        if h.get("time"):
+            # Hours are consecutive, so only the first timestamp is parsed
+            hourly = HourlySeries(
+                start = datetime.fromisoformat(h["time"][0]),
+                temperature = to_array(h.get("temperature_2m", [])),
+                precipitation_probability = to_array(h.get("precipitation_probability", [])),
+                wind_speed = to_array(h.get("wind_speed_10m", [])),
+            )
+
+        return WeatherData(
+            latitude = data.get("latitude", 0.0),
+            longitude = data.get("longitude", 0.0),
+            timezone = data.get("timezone", ""),
+            utc_offset_seconds = data.get("utc_offset_seconds", 0),
+            current_units = cur_units,
+            current = current,
+            daily = daily,
+            hourly = hourly
+        )
 
 
     def get_geocode(self, address):
-        url = "https://nominatim.openstreetmap.org/search"
+        query = normalize_query(address)
+        if not query:
+            return None
+        cached, age = self.geocode_cache.get(query)
+        if age is not None and (cached is not None or age <= self.GEOCODE_NEGATIVE_TTL_SEC):
+            return Geocode(**cached) if cached is not None else None
+
         headers = {
             "User-Agent": "RaspberryPiZero/1.0 (clin4185@usc.edu)"
         }
         params = {
-            "q": address,
+            "q": address.strip(),
             "format": "json",
             "addressdetails": 1
         }
         try:
-            response = requests.get(url, params = params, headers = headers)
-            response.raise_for_status()
-            data = response.json()[0]
-            address = data.get("address", {})
-            return Geocode(
-                lat = data.get("lat", 0.0),
-                lng = data.get("lon", 0.0),
-                display_name = data.get("display_name", ""),
-                city = address.get("city", ""),
-                country_code = address.get("country_code", ""),
-                country = address.get("country", "")
-            )
+            response = self.request("geocode", self.GEOCODE_URL, limiter = NOMINATIM, params = params, headers = headers)
+            with PARSE_SECONDS.time(endpoint = "geocode", stage = "json"):
+                results = response.json()
         except requests.RequestException as e:
-            print(f"Error fetching Geocode: {e}")
+            log.warning("Error fetching Geocode: %s", e)
             return None
+        if not results:
+            log.info("No Geocode found for %r", address)
+            self.geocode_cache.put(query, None)
+            return None
+        data = results[0]
+        address = data.get("address", {})
+        geocode = Geocode(
+            lat = data.get("lat", 0.0),
+            lng = data.get("lon", 0.0),
+            display_name = data.get("display_name", ""),
+            city = address.get("city", ""),
+            country_code = address.get("country_code", ""),
+            country = address.get("country", "")
+        )
+        self.geocode_cache.put(query, asdict(geocode))
+        return geocode
+
 
+    def get_ip_info(self, network = None, refresh = False):
+        """
+        :param network: Key of the connected network (e.g. the SSID). The public IP,
+                        and so the location, rarely changes for a network, so the
+                        result is cached per network and reused across restarts.
+        :param refresh: Skip the cache, e.g. right after connecting.
+        """
+        key = network or ""
+        if not refresh:
+            cached, age = self.ip_info_cache.get(key)
+            if cached is not None and self.ip_info_cache.is_fresh(age):
+                return IPInfo(**cached)
 
-    def get_ip_info(self):
-        url = "https://ipinfo.io/json"
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
+            response = self.request("ip_info", self.IP_INFO_URL)
+            with PARSE_SECONDS.time(endpoint = "ip_info", stage = "json"):
+                data = response.json()
             lat, lng = map(float, data.get("loc", "0.0,0.0").split(","))
             ip_info = IPInfo(
                 ip = data.get("ip", ""),
@@ -218,9 +535,79 @@ class ApiClient:
                 postal = data.get("postal", ""),
                 timezone = data.get("timezone", ""),
             )
-            print(f'Detected city: {ip_info.city}, lat: {ip_info.lat}, lng: {ip_info.lng}')
+            log.info("Detected city: %s, lat: %s, lng: %s", ip_info.city, ip_info.lat, ip_info.lng)
+            self.ip_info_cache.put(key, asdict(ip_info))
             return ip_info
         except requests.RequestException as e:
-            print(f"Error fetching IP information: {e}")
+            log.warning("Error fetching IP information: %s", e)
             return None
 
+
+    def request(self, endpoint, url, limiter = None, **kwargs):
+        """
+        GET through the shared session, retrying connection errors, timeouts and
+        retryable status codes with jittered exponential backoff. With a limiter
+        (TokenBucket) every attempt, retries included, waits for a token.
+        Raises requests.RequestException once the retries are exhausted.
+        """
+        kwargs.setdefault("timeout", self.TIMEOUT)
+        attempt = 0
+        while True:
+            if limiter is not None:
+                limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, **kwargs)
+                if response.status_code in self.RETRY_STATUS and attempt < self.MAX_RETRIES:
+                    self.record(endpoint, time.monotonic() - start, error = True, retry = True)
+                    self.backoff(attempt, response.headers.get("Retry-After"))
+                    attempt += 1
+                    continue
+                response.raise_for_status()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                retry = attempt < self.MAX_RETRIES
+                self.record(endpoint, time.monotonic() - start, error = True, retry = retry)
+                if not retry:
+                    raise
+                self.backoff(attempt)
+                attempt += 1
+                continue
+            except requests.exceptions.RequestException:
+                self.record(endpoint, time.monotonic() - start, error = True)
+                raise
+            self.record(endpoint, time.monotonic() - start)
+            return response
+
+
+    def backoff(self, attempt, retry_after = None):
+        delay = random.uniform(0, min(self.BACKOFF_MAX_SEC, self.BACKOFF_BASE_SEC * 2 ** attempt))
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, min(self.BACKOFF_MAX_SEC, int(retry_after)))
+        time.sleep(delay)
+
+
+    def record(self, endpoint, elapsed, error = False, retry = False):
+        with self.stats_lock:
+            stats = self.stats.setdefault(endpoint, EndpointStats())
+            stats.requests += 1
+            stats.errors += error
+            stats.retries += retry
+            stats.total_sec += elapsed
+            stats.max_sec = max(stats.max_sec, elapsed)
+            stats.last_sec = elapsed
+        HTTP_SECONDS.observe(elapsed, endpoint = endpoint)
+        if error:
+            HTTP_ERRORS.inc(endpoint = endpoint)
+        if retry:
+            HTTP_RETRIES.inc(endpoint = endpoint)
+
+
+    def print_stats(self):
+        with self.stats_lock:
+            for endpoint, stats in sorted(self.stats.items()):
+                print(f"{endpoint:10} {stats}")
+        print(f"Nominatim  {NOMINATIM}")
+
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,230 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from cache import DEFAULT_CACHE_DIR
+
+DEFAULT_HISTORY_DIR = os.path.join(DEFAULT_CACHE_DIR, "history")
+
+# time (when the record was written, the index), valid (time the values are for), kind,
+# weather code, humidity (%), padding, temperature (°C), precipitation (mm observed,
+# probability in % forecast), wind speed (km/h)
+RECORD = struct.Struct("<IIBBBxfff")
+
+OBSERVED = 0
+FORECAST = 1
+
+
+@dataclass(slots = True)
+class Record:
+    time: int
+    valid: int
+    kind: int
+    weather_code: int
+    humidity: int
+    temperature: float
+    precipitation: float
+    wind_speed: float
+
+
+class History:
+    """
+    Append-only store of observed conditions and forecasts in fixed-width records.
+
+    Records are appended in time order to segment files named after their first
+    record time, so a query picks the segments by name, maps them and binary
+    searches the record times; only the requested slice is unpacked.
+
+    Segments are only ever appended to and a full one is never rewritten, which
+    keeps SD card writes to one small append per fetch. The oldest segment is
+    deleted once there are more than max_segments.
+    """
+    # Forecast lead times kept from every fetch, to compare with what was observed later
+    FORECAST_LEADS_HOURS = (1, 3, 6, 12, 24)
+
+    def __init__(self, path = DEFAULT_HISTORY_DIR, segment_records = 2048, max_segments = 8):
+        """
+        :param path: Directory of the segment files.
+        :param segment_records: Records per segment, 2048 records are 48 KiB.
+        :param max_segments: Segments kept, about a month at one fetch every 15 minutes.
+        """
+        self.path = path
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+        # Time of the last record appended and valid time of the last observation
+        self.last_time = 0
+        self.last_observed = None
+        os.makedirs(path, exist_ok = True)
+        self.segments = self.list_segments()
+        if self.segments:
+            self.repair(self.segments[-1])
+            self.restore(self.segments[-1])
+
+
+    def list_segments(self):
+        segments = []
+        for name in os.listdir(self.path):
+            if name.startswith("history-") and name.endswith(".bin"):
+                try:
+                    segments.append(int(name[8:-4]))
+                except ValueError:
+                    pass
+        return sorted(segments)
+
+
+    def segment_path(self, first):
+        return os.path.join(self.path, f"history-{first:010d}.bin")
+
+
+    def repair(self, first):
+        """
+        Drop a partial record left by a crash in the middle of an append.
+        """
+        path = self.segment_path(first)
+        size = os.path.getsize(path)
+        if size % RECORD.size:
+            with open(path, "r+b") as f:
+                f.truncate(size - size % RECORD.size)
+
+
+    def restore(self, first):
+        """
+        Continue after the last record of a segment, e.g. after a restart.
+        """
+        with open(self.segment_path(first), "rb") as f:
+            records = list(RECORD.iter_unpack(f.read()))
+        if records:
+            self.last_time = records[-1][0]
+        for r in reversed(records):
+            if r[2] == OBSERVED:
+                self.last_observed = r[1]
+                break
+
+
+    def append(self, records):
+        """
+        :param records: Records in time order. A time before the last appended
+                        record is written as that record's time.
+        """
+        if not records:
+            return
+        with self.lock:
+            # The clock of a Pi without RTC can step back at boot, e.g. from
+            # fake-hwclock to NTP; bisect() and the segment names need times in order
+            times = []
+            last = self.last_time
+            for r in records:
+                last = max(last, r.time)
+                times.append(last)
+            data = b"".join(RECORD.pack(t, r.valid, r.kind, r.weather_code, r.humidity,
+                                        r.temperature, r.precipitation, r.wind_speed) for t, r in zip(times, records))
+            if not self.segments or self.count(self.segments[-1]) >= self.segment_records:
+                self.segments.append(times[0])
+                self.rotate()
+            with open(self.segment_path(self.segments[-1]), "ab") as f:
+                f.write(data)
+            self.last_time = last
+
+
+    def rotate(self):
+        while len(self.segments) > self.max_segments:
+            first = self.segments.pop(0)
+            try:
+                os.remove(self.segment_path(first))
+            except FileNotFoundError:
+                pass
+
+
+    def count(self, first):
+        try:
+            return os.path.getsize(self.segment_path(first)) // RECORD.size
+        except FileNotFoundError:
+            return 0
+
+
+    def append_weather(self, weatherData, now = None):
+        """
+        Record the current conditions and the forecast for FORECAST_LEADS_HOURS
+        of a WeatherData in the canonical units (°C, km/h, mm).
+        """
+        now = int(now if now is not None else time.time())
+        current = weatherData.current
+        # Open-Meteo reports times in the location's timezone, not the Pi's
+        zone = timezone(timedelta(seconds = weatherData.utc_offset_seconds or 0))
+        observed = datetime.fromisoformat(current.time) if current.time else datetime.fromtimestamp(now, zone).replace(tzinfo = None)
+        valid = int(observed.replace(tzinfo = zone).timestamp())
+        records = []
+        # A forecast served from the cache repeats the last observation
+        if valid != self.last_observed:
+            self.last_observed = valid
+            records.append(Record(now, valid, OBSERVED, current.weather_code or 0, int(current.humidity or 0),
+                                  current.temperature or 0.0, current.precipitation or 0.0, current.wind_speed or 0.0))
+        hourly = weatherData.hourly
+        if hourly is not None and len(hourly):
+            first = hourly.index(observed)
+            for lead in self.FORECAST_LEADS_HOURS:
+                i = first + lead
+                if 0 <= i < len(hourly):
+                    records.append(Record(now, valid + lead * 3600, FORECAST, 0, 0, hourly.temperature[i],
+                                          hourly.precipitation_probability[i], hourly.wind_speed[i]))
+        self.append(records)
+
+
+    def query(self, start, end = None, kind = None):
+        """
+        Records written from start up to end (epoch seconds), oldest first.
+        """
+        end = end if end is not None else time.time()
+        with self.lock:
+            segments = list(self.segments)
+        records = []
+        for i, first in enumerate(segments):
+            # A segment ends where the next one starts
+            if first > end or (i + 1 < len(segments) and segments[i + 1] <= start):
+                continue
+            records.extend(self.read_segment(first, start, end, kind))
+        return records
+
+
+    def read_segment(self, first, start, end, kind):
+        try:
+            f = open(self.segment_path(first), "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            n = os.fstat(f.fileno()).st_size // RECORD.size
+            if n == 0:
+                return []
+            with mmap.mmap(f.fileno(), n * RECORD.size, access = mmap.ACCESS_READ) as m:
+                lo = self.bisect(m, n, start)
+                hi = self.bisect(m, n, end + 1)
+                # Only the slice is copied out of the mapping
+                data = m[lo * RECORD.size:hi * RECORD.size]
+        return [Record(*r) for r in RECORD.iter_unpack(data) if kind is None or r[2] == kind]
+
+
+    @staticmethod
+    def bisect(m, n, t):
+        """
+        Index of the first of the n records in m written at or after t.
+        """
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if struct.unpack_from("<I", m, mid * RECORD.size)[0] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+    def trend(self, hours, kind = OBSERVED):
+        """
+        Records of the last hours.
+        """
+        now = time.time()
+        return self.query(now - hours * 3600, now, kind)
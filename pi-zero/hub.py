@@ -0,0 +1,268 @@
+"""
+Hub mode: one main.py fetches, caches and renders for all the displays of a
+site, each connected over TCP through panel_agent.py on the Pi next to it.
+
+    $ python main.py --hub 0.0.0.0:7300                       # on the hub
+    $ python panel_agent.py --hub hub.local:7300 --id lobby   # on every panel
+
+The agent only forwards bytes between its serial port and the connection, so
+to the hub an agent is a display on a long cable: a Panel of main.py with its
+own pages and selections, while the forecasts and rendered views are shared.
+DisplayState sends each panel only the attributes that changed, as one
+optimized batch per render, and the ack window keeps the display's input
+buffer from overrunning across the network.
+
+An agent opens the connection with the line
+
+    PANEL <id> <baud>\\n
+
+after which raw Nextion bytes flow in both directions. A panel reconnecting
+under the same id keeps its selections; its display may show anything by then,
+so the main page is reloaded and sent in full.
+"""
+import asyncio
+import logging
+import socket
+import metrics
+from nextion import FrameParser, Nextion
+
+log = logging.getLogger(__name__)
+
+HUB_PANELS = metrics.gauge("hub_panels", "Panel agents connected to the hub.")
+HUB_CONNECTIONS = metrics.counter("hub_connections_total", "Connections of panel agents, each followed by a full resync.")
+
+DEFAULT_PORT = 7300
+# Longest accepted hello line
+MAX_HELLO = 128
+
+
+def hello(panel_id, baudrate):
+    return f"PANEL {panel_id} {baudrate}\n".encode("utf-8")
+
+
+def parse_hello(line):
+    """
+    Returns (panel id, baud rate) of a hello line, raises ValueError if it is none.
+    """
+    parts = line.decode("utf-8").split()
+    if len(parts) != 3 or parts[0] != "PANEL":
+        raise ValueError(f"not a hello: {line[:40]!r}")
+    baudrate = int(parts[2])
+    if baudrate not in Nextion.BAUDRATES:
+        raise ValueError(f"unsupported baud rate {baudrate}")
+    return parts[1], baudrate
+
+
+def parse_address(address, default_host = "0.0.0.0"):
+    """
+    (host, port) of "[host:]port".
+    """
+    host, _, port = address.rpartition(":")
+    return host or default_host, int(port)
+
+
+class RemoteNextion(Nextion):
+    """
+    Nextion behind a panel agent. Instructions are written to the agent's
+    connection and the frames it forwards are fed to the parser by the hub.
+    Without a connection nothing is sent, attach() starts over.
+    """
+    # Bytes the connection may buffer before the agent counts as stalled; it is
+    # dropped and resyncs when it reconnects
+    MAX_BUFFERED = 64 * 1024
+
+    def __init__(self, panel_id, ack = True):
+        self.panel_id = panel_id
+        self.transport = None
+        self.bytes_dropped = 0
+        super().__init__(port = f"agent {panel_id}", baudrate = 115200, ack = ack)
+
+
+    def open(self):
+        return None
+
+
+    def attach(self, transport, baudrate):
+        self.detach()
+        self.transport = transport
+        self.baudrate = baudrate
+        # Ack timeouts are handled without new traffic, as for a local display
+        self.call_later = asyncio.get_running_loop().call_later
+        self.parser = FrameParser()
+        if self.ack:
+            # Through the window, the display may already be at bkcmd=3 and answer it
+            self.send('bkcmd=3\xFF\xFF\xFF')
+
+
+    def detach(self):
+        """
+        Nothing sent or queued is acknowledged any more, get() callbacks get None.
+        """
+        self.transport = None
+        self.acknowledge_all()
+        for command in self.queue:
+            self.answer_query(command, None)
+        self.queue.clear()
+        self.update_busy()
+
+
+    def read(self):
+        # The hub has fed the bytes already
+        return True
+
+
+    def transmit(self, data):
+        transport = self.transport
+        if transport is None or transport.is_closing():
+            self.bytes_dropped += len(data)
+            return
+        transport.write(data)
+        if transport.get_write_buffer_size() > self.MAX_BUFFERED:
+            log.warning("%s is not reading, dropping the connection", self.port)
+            transport.abort()
+
+
+    def close(self):
+        # Nothing to do once detached, the loop may be closed by now
+        transport, self.transport = self.transport, None
+        if transport is not None:
+            transport.close()
+
+
+class Hub:
+    """
+    TCP server the panel agents connect to.
+
+    create_panel(nextion) is called with a RemoteNextion for every new panel
+    id and returns the panel, which needs read_commands(), called after frames
+    were fed, resync(), called on every connection, and suspend(), called when
+    the connection is lost.
+    """
+    MAX_PANELS = 256
+
+    def __init__(self, create_panel, max_panels = MAX_PANELS):
+        self.create_panel = create_panel
+        self.max_panels = max_panels
+        # id -> panel, kept after a disconnect so the panel keeps its selections
+        self.panels = {}
+        self.connections = 0
+        self.rejected = 0
+        self.server = None
+
+
+    async def start(self, host, port):
+        loop = asyncio.get_running_loop()
+        self.server = await loop.create_server(lambda: AgentConnection(self), host, port)
+        log.info("Hub listening on %s", ", ".join(str(s.getsockname()) for s in self.server.sockets))
+
+
+    def close(self):
+        """
+        Stop accepting agents and close the connected ones, while the loop still runs.
+        """
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        for panel in self.panels.values():
+            transport = panel.nextion.transport
+            if transport is not None:
+                panel.nextion.detach()
+                transport.close()
+
+
+    def attach(self, panel_id, baudrate, transport):
+        panel = self.panels.get(panel_id)
+        if panel is None:
+            if len(self.panels) >= self.max_panels:
+                log.warning("Rejecting panel %s, %d panels already", panel_id, len(self.panels))
+                self.rejected += 1
+                return None
+            panel = self.create_panel(RemoteNextion(panel_id))
+            self.panels[panel_id] = panel
+        elif panel.nextion.transport is not None:
+            # Reconnected before the old connection was noticed to be gone
+            panel.nextion.transport.abort()
+        log.info("Panel %s connected from %s", panel_id, transport.get_extra_info("peername"))
+        panel.nextion.attach(transport, baudrate)
+        self.connections += 1
+        HUB_CONNECTIONS.inc()
+        HUB_PANELS.set(self.connected())
+        panel.resync()
+        return panel
+
+
+    def detach(self, panel, transport):
+        if panel.nextion.transport is not transport:
+            return
+        log.info("Panel %s disconnected", panel.nextion.panel_id)
+        panel.nextion.detach()
+        panel.suspend()
+        HUB_PANELS.set(self.connected())
+
+
+    def receive(self, panel, data):
+        parser = panel.nextion.parser
+        view = memoryview(data)
+        while view:
+            n = parser.feed(view)
+            view = view[n:]
+            panel.read_commands()
+
+
+    def connected(self):
+        return sum(1 for panel in self.panels.values() if panel.nextion.transport is not None)
+
+
+    def print_stats(self):
+        dropped = sum(panel.nextion.bytes_dropped for panel in self.panels.values())
+        print(f"Hub        panels={len(self.panels)}, connected={self.connected()}, connections={self.connections}, "
+              f"rejected={self.rejected}, dropped={dropped}B while disconnected")
+
+
+class AgentConnection(asyncio.Protocol):
+    """
+    One connection of a panel agent: the hello line, then the frames of its display.
+    """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.transport = None
+        self.panel = None
+        self.hello = b""
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            # Notice agents that are gone when nothing is sent, e.g. displays with an RTC
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+
+    def data_received(self, data):
+        if self.panel is None:
+            self.hello += data
+            line, newline, data = self.hello.partition(b"\n")
+            if not newline:
+                if len(self.hello) > MAX_HELLO:
+                    log.warning("No hello from %s", self.transport.get_extra_info("peername"))
+                    self.transport.abort()
+                return
+            try:
+                panel_id, baudrate = parse_hello(line)
+            except ValueError as e:
+                log.warning("Bad hello from %s: %s", self.transport.get_extra_info("peername"), e)
+                self.transport.abort()
+                return
+            self.panel = self.hub.attach(panel_id, baudrate, self.transport)
+            if self.panel is None:
+                self.transport.abort()
+                return
+            if not data:
+                return
+        self.hub.receive(self.panel, data)
+
+
+    def connection_lost(self, exc):
+        if self.panel is not None:
+            self.hub.detach(self.panel, self.transport)
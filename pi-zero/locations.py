@@ -0,0 +1,143 @@
+"""
+Saved locations the main page rotates through after the one found from the IP
+address. Locations entered on the menu page are saved here; the file can also
+be edited with:
+
+    $ python locations.py add "Office" 40.7128 -74.0060
+    $ python locations.py list
+    $ python locations.py remove "Office"
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+from dataclasses import asdict, dataclass
+
+log = logging.getLogger(__name__)
+
+DEFAULT_LOCATIONS_PATH = os.path.join(os.path.expanduser("~"), ".config", "pi-zero-weather", "locations.json")
+
+
+@dataclass(slots = True)
+class Location:
+    name: str
+    lat: float
+    lng: float
+    # Open-Meteo timezone, "auto" for the local time of the location
+    timezone: str = "auto"
+
+    @property
+    def key(self):
+        """
+        (lat, lng, timezone), what a forecast is requested and cached by.
+        """
+        return (self.lat, self.lng, self.timezone)
+
+
+class LocationStore:
+    """
+    Saved locations in the order they were added, mirrored to a JSON file.
+    """
+    MAX_LOCATIONS = 8
+
+    def __init__(self, path = DEFAULT_LOCATIONS_PATH, max_locations = MAX_LOCATIONS):
+        """
+        :param path: JSON file of the locations, or None for memory only.
+        :param max_locations: Locations kept, the oldest is dropped when another is added.
+        """
+        self.path = path
+        self.max_locations = max_locations
+        self.locations = []
+        self.lock = threading.Lock()
+        self.load()
+
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding = "utf-8") as f:
+                self.locations = [Location(**entry) for entry in json.load(f)]
+        except (OSError, ValueError, TypeError) as e:
+            log.warning("Ignoring unreadable locations %s: %s", self.path, e)
+
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = [asdict(location) for location in self.locations]
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding = "utf-8") as f:
+                json.dump(data, f, indent = 1, ensure_ascii = False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning("Failed to write locations %s: %s", self.path, e)
+
+
+    def add(self, location):
+        """
+        Save location, replacing one with the same name or coordinates. Returns its index.
+        """
+        with self.lock:
+            self.locations = [l for l in self.locations if not self.same(l, location)]
+            self.locations.append(location)
+            del self.locations[:-self.max_locations]
+            index = len(self.locations) - 1
+        self.save()
+        return index
+
+
+    def remove(self, name):
+        with self.lock:
+            count = len(self.locations)
+            self.locations = [l for l in self.locations if l.name != name]
+            removed = len(self.locations) != count
+        if removed:
+            self.save()
+        return removed
+
+
+    @staticmethod
+    def same(a, b):
+        # Two decimals is roughly 1 km, like the weather cache key
+        return a.name == b.name or (round(a.lat, 2), round(a.lng, 2)) == (round(b.lat, 2), round(b.lng, 2))
+
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.locations))
+
+
+    def __len__(self):
+        return len(self.locations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Edit the saved locations.")
+    parser.add_argument("--path", default = DEFAULT_LOCATIONS_PATH)
+    commands = parser.add_subparsers(dest = "command", required = True)
+    add = commands.add_parser("add")
+    add.add_argument("name")
+    add.add_argument("lat", type = float)
+    add.add_argument("lng", type = float)
+    add.add_argument("timezone", nargs = "?", default = "auto")
+    remove = commands.add_parser("remove")
+    remove.add_argument("name")
+    commands.add_parser("list")
+    args = parser.parse_args()
+
+    store = LocationStore(args.path)
+    if args.command == "add":
+        store.add(Location(args.name, args.lat, args.lng, args.timezone))
+    elif args.command == "remove" and not store.remove(args.name):
+        parser.exit(1, f"No location named {args.name!r}\n")
+    for location in store:
+        print(f"{location.name}: {location.lat}, {location.lng} ({location.timezone})")
+
+
+if __name__ == "__main__":
+    main()
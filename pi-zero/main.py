@@ -1,8 +1,31 @@
-from time import sleep
+import time
+STARTUP_MARKS = {"start": time.perf_counter()}
+
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass
 from datetime import datetime
+import serial
 from nextion import Nextion
-from network import NetworkManager
-from external_api import ApiClient
+from display_state import DisplayState
+from hub import DEFAULT_PORT as HUB_PORT, Hub, parse_address
+from chart import Chart
+from clock import DisplayClock
+from locations import Location, LocationStore
+from scheduler import ForecastScheduler
+from units import convert, convert_weather
+from timeseries import finite, lttb
+import metrics
+
+log = logging.getLogger("main")
+
+COMMAND_SECONDS = metrics.summary("command_seconds", "Time processCommand takes per event from the display.")
+TOUCH_RESPONSE_SECONDS = metrics.summary("touch_response_seconds", "Time from reading a touch event until the display acknowledged everything sent in response.")
+# network (gi) and external_api (requests) are slow to import on a Pi Zero,
+# they are imported on worker threads once the display is up.
+
+STARTUP_MARKS["import"] = time.perf_counter()
 
 # Map to Nextion Picture ID
 WEATHER_IMAGE = {
@@ -39,327 +62,826 @@ WEATHER_IMAGE = {
 # Increment by 9 for Picture ID
 WEATHER_IMAGE_SMALL = {key: value + 9 for key, value in WEATHER_IMAGE.items()}
 
-# Global variables
-nextion = Nextion(port="/dev/serial0", baudrate=9600)
-nm = NetworkManager()
-nm.print_device_info()
-api = ApiClient()
-ip_info = api.get_ip_info()
-geocode = None
-
-ap_list = []
-setting_selected_row = -1
-setting_ssid_page = 0
-setting_unit_of_temp = 'fahrenheit'
-
-# Flag for fetching string data after user push buttons
-is_password = False
-is_location = False
+# 16-bit RGB565 colors of the SSID rows
+COLOR_ROW = 65535
+COLOR_ROW_ACTIVE = 2032
+COLOR_ROW_SELECTED = 65504
+
+# Forecast chart on the main page, the pictures and dates go under its axis.
+# Tapping it switches between the daily bars, the hourly lines and the history.
+FORECAST_CHART = Chart(left = 50, top = 440, width = 380, height = 180)
+HOURLY_CHART_HOURS = 48
+# Chart mode -> HourlySeries variable drawn as a line
+HOURLY_CHART_SERIES = {
+    "hourly": "temperature",
+    "precipitation": "precipitation_probability",
+    "wind": "wind_speed",
+}
+# Longer series are downsampled to one point per this many pixels
+HOURLY_CHART_PIXELS_PER_POINT = 4
+# Observed conditions shown by the history chart
+HISTORY_CHART_HOURS = 24
+# Tapping the chart goes through these in order
+CHART_MODES = ("daily", "hourly", "precipitation", "wind", "history")
+
+# Rate negotiated with the display at startup, the display boots at 9600
+BAUDRATE = 115200
+
+METRICS_INTERVAL_SEC = 60
+
+# Default seconds each location stays on the main page
+LOCATION_ROTATE_SEC = 30
+# Horizontal distance in pixels between touch press and release that counts as a swipe
+SWIPE_MIN_PX = 120
+
+# Views kept for sharing between the panels, cleared when full
+VIEW_CACHE_SIZE = 64
+
+# Global variables, set up by run()
+panels = []
+# Accepts panel agents in hub mode
+hub = None
+hub_address = None
+nm = None
+api = None
+history = None
+ip_info = None
+# Saved locations, shown after the one found from the IP address
+locations = None
+# Seconds between rotations, 0 to only change on swipe
+rotate_sec = LOCATION_ROTATE_SEC
+
+# Progress of the last connection attempt as (ssid, state), shown in its row on every panel
+connect_state = None
+
+# Startup tasks resolving to the NetworkManager and ApiClient, awaited by whoever needs them first
+nm_task = None
+api_task = None
+
+# Exit once the first forecast is on screen, for benchmarks/bench_startup.py
+startup_benchmark = False
+# Rewritten every METRICS_INTERVAL_SEC when set
+metrics_file = None
+stopping = None
+located = False
+
+# (id(snapshot), unit, chart mode) -> (snapshot, WeatherView); the snapshot keeps its id from being reused
+views = {}
+views_built = 0
+views_shared = 0
+
+
+def fetch_weather(keys, refresh):
+    """
+    The forecasts of all locations from one request, cached ones while fresh
+    unless refresh; the history is kept for the first, where the panel is.
+    """
+    forecasts = api.get_weather_batch(keys, refresh = refresh)
+    if forecasts and forecasts[0] is not None and history is not None:
+        try:
+            history.append_weather(forecasts[0])
+        except OSError as e:
+            log.warning("Error writing history: %s", e)
+    return forecasts
+
+
+def render_all():
+    for panel in panels:
+        panel.render_weather(panel.active_snapshot())
+
+
+scheduler = ForecastScheduler(fetch_weather, on_update = lambda snapshots: render_all())
+
+# Running background jobs by name; starting a job cancels the previous one with the same name
+jobs = {}
 
 
 def main():
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    nextion.send('sendme\xFF\xFF\xFF')
+    global startup_benchmark, metrics_file, rotate_sec, hub_address
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", action = "append",
+                        help = "serial port of a display, repeat for several displays (default /dev/serial0)")
+    parser.add_argument("--startup-benchmark", action = "store_true", help = "print startup times and exit after the first forecast")
+    parser.add_argument("--log-level", default = "INFO", choices = ["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help = "DEBUG logs every instruction sent to and frame received from the display")
+    parser.add_argument("--metrics-file", help = "write Prometheus metrics to this file, e.g. for node_exporter's textfile collector")
+    parser.add_argument("--metrics-port", type = int, help = "serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--rotate-sec", type = float, default = LOCATION_ROTATE_SEC,
+                        help = "seconds each saved location is shown, 0 to only change on swipe")
+    parser.add_argument("--hub", metavar = "[HOST:]PORT",
+                        help = f"drive the displays of panel_agent.py connecting to this address, e.g. 0.0.0.0:{HUB_PORT}; "
+                               "no serial port is used unless --port is given")
+    args = parser.parse_args()
+    startup_benchmark = args.startup_benchmark
+    metrics_file = args.metrics_file
+    rotate_sec = args.rotate_sec
+    hub_address = args.hub
+    logging.basicConfig(level = args.log_level, format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.metrics_port:
+        metrics.REGISTRY.serve(args.metrics_port)
+
+    for port in args.port or ([] if hub_address else ["/dev/serial0"]):
+        try:
+            panels.append(Panel(Nextion(port = port, baudrate = 9600, ack = True)))
+        except (serial.SerialException, RuntimeError) as e:
+            # The other displays still work without this one
+            log.error("Display on %s unavailable: %s", port, e)
+    if not panels and not hub_address:
+        raise SystemExit("No display available.")
     try:
-        while True:
-            commands = nextion.getCommands()
-            if len(commands) > 0:
-                for cmd in commands:
-                    processCommand(cmd)
-            else:
-                new_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                if new_time != current_time:
-                    current_time = new_time
-                    nextion.send(f'tDatetime.txt="{current_time}"\xFF\xFF\xFF', False)
-                sleep(0.03)
+        asyncio.run(run())
     except KeyboardInterrupt:
         print("Program terminated.")
     finally:
-        nextion.close()
+        for panel in panels:
+            panel.nextion.close()
+        if nm is not None:
+            nm.close()
+            nm.print_stats()
+        if api is not None:
+            api.print_stats()
+            api.close()
+        scheduler.print_stats()
+        for panel in panels:
+            panel.print_stats()
+        if hub is not None:
+            hub.print_stats()
+        if len(panels) > 1:
+            print(f"Render     views={views_built}, shared={views_shared}")
+        print_startup()
+        if metrics_file:
+            write_metrics()
+        metrics.REGISTRY.close()
         print("Bye.")
 
 
-def processCommand(cmd):
-    global setting_selected_row, setting_unit_of_temp, is_password, is_location
-    if cmd.event is nextion.CURRENT_PAGE_NUMBER:
-        if cmd.page is nextion.PAGE_MAIN:
-            show_main()
-        elif cmd.page is nextion.PAGE_MENU:
-            show_menu()
-        return
+async def run():
+    global nm_task, api_task, stopping, hub
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    # NetworkManager, the HTTP client and the IP lookup start in parallel while the displays come up
+    nm_task = loop.create_task(start_nm())
+    api_task = loop.create_task(asyncio.to_thread(start_api))
+    for panel in panels:
+        panel.start_job("start", panel.start())
+    if hub_address:
+        hub = Hub(add_remote_panel)
+        await hub.start(*parse_address(hub_address))
+    start_job("locate", locate())
+    scheduler.start()
+    if metrics_file:
+        start_job("metrics", export_metrics())
+    try:
+        await stopping.wait()
+    finally:
+        if hub is not None:
+            hub.close()
+        for panel in panels:
+            panel.stop()
+        scheduler.stop()
+
+
+def add_remote_panel(nextion):
+    # Wi-Fi of the hub is not the business of a panel somewhere else
+    panel = Panel(nextion, wifi = False)
+    panels.append(panel)
+    return panel
+
+
+def start_api():
+    global api, history, locations
+    from external_api import ApiClient
+    from history import History
+    api = ApiClient()
+    locations = LocationStore()
+    try:
+        history = History()
+    except OSError as e:
+        log.warning("History unavailable: %s", e)
+    return api
 
-    if cmd.page is nextion.PAGE_MAIN:
-        match cmd.component:
-            case nextion.B_MENU:
-                show_menu()
-            case nextion.B_REFRESH:
-                nextion.send(f'page pageMain\xFF\xFF\xFF') # Erase charts and reset main page
-                show_main()
-    elif cmd.page is nextion.PAGE_MENU:
-        match cmd.component:
-            case nextion.B_LEFT:
-                show_prev_ssid_page()
-            case nextion.B_RIGHT:
-                show_next_ssid_page()
-            case nextion.T_ID1:
-                select_row(0)
-            case nextion.T_ID2:
-                select_row(1)
-            case nextion.T_ID3:
-                select_row(2)
-            case nextion.T_ID4:
-                select_row(3)
-            case nextion.T_ID5:
-                select_row(4)
-            case nextion.T_SSID1:
-                select_row(0)
-            case nextion.T_SSID2:
-                select_row(1)
-            case nextion.T_SSID3:
-                select_row(2)
-            case nextion.T_SSID4:
-                select_row(3)
-            case nextion.T_SSID5:
-                select_row(4)
-            case nextion.B_CONNECT:
-                nextion.send("get tPassword.txt\xFF\xFF\xFF")
-                is_password = True
-            case nextion.B_UPDATE_LOCATION:
-                nextion.send("get tLocation.txt\xFF\xFF\xFF")
-                is_location = True
-            case nextion.B_UNIT_TEMP:
-                if setting_unit_of_temp == "fahrenheit":
-                    setting_unit_of_temp = "celsius"
-                else:
-                    setting_unit_of_temp = "fahrenheit"
-                nextion.send(f'bUnitTemp.txt="Unit of Temperature: {setting_unit_of_temp}"\xFF\xFF\xFF')
-            case nextion.B_BACK:
-                show_main()
-    elif cmd.page == -1:
-        if cmd.string_data is not None:
-            handle_string_data(cmd.string_data)
-
-
-def show_main():
-    global ip_info, geocode, setting_ssid_page, setting_selected_row, ap_list
-    # Reset menu settings
-    setting_ssid_page = 0
-    setting_selected_row = -1
-    ap_list = []
-    
-    if geocode is not None:
-        nextion.send(f'tAddress.txt="{geocode.city}, {geocode.country_code.upper()}"\xFF\xFF\xFF')
-        update_weather(geocode.lat, geocode.lng, ip_info.timezone)
-        return
 
-    if ip_info is not None:
-        nextion.send(f'tAddress.txt="{ip_info.city}, {ip_info.region}, {ip_info.country}"\xFF\xFF\xFF')
-        update_weather(ip_info.lat, ip_info.lng, ip_info.timezone)
+async def start_nm():
+    global nm
+
+    def create():
+        from network import NetworkManager
+        manager = NetworkManager()
+        # libnm objects belong to the GLib thread, which is running by now
+        manager.call(manager.print_device_info).result()
+        return manager
+
+    try:
+        nm = await asyncio.to_thread(create)
+    except Exception as e:
+        log.warning("NetworkManager unavailable: %r", e)
+        return None
+    loop = asyncio.get_running_loop()
+    nm.add_listener(lambda event: loop.call_soon_threadsafe(on_access_points_changed, event))
+    return nm
+
+
+async def locate():
+    """
+    Find the location from the IP address, cached per Wi-Fi network so a
+    restart on a known network renders without waiting for ipinfo.io.
+    """
+    global ip_info, located
+    await api_task
+    manager = await nm_task
+    network = await run_nm(manager.get_current_ssid) if manager is not None else None
+    ip_info = await asyncio.to_thread(api.get_ip_info, network)
+    located = True
+    update_locations()
+    for panel in panels:
+        if panel.display.page is Nextion.PAGE_MAIN:
+            panel.show_main()
+
+
+def mark_startup(name):
+    if name in STARTUP_MARKS:
         return
+    STARTUP_MARKS[name] = time.perf_counter()
+    if name == "first_forecast" and startup_benchmark:
+        stopping.set()
 
-    nextion.send(f'tAddress.txt="NO WI-FI"\xFF\xFF\xFF')
 
+def print_startup():
+    start = STARTUP_MARKS["start"]
+    marks = ", ".join(f"{name}={(t - start) * 1000:.0f}ms" for name, t in STARTUP_MARKS.items() if name != "start")
+    print(f"Startup    {marks}")
 
-def show_menu():
-    global setting_ssid_page, setting_unit_of_temp, ap_list
-    nm.request_scan()
-    ap_list = nm.get_access_points()
-    instruction = get_ssids(setting_ssid_page * 5)
-    instruction += f'bUnitTemp.txt="Unit of Temperature: {setting_unit_of_temp}"\xFF\xFF\xFF'
-    nextion.send(instruction)
 
+async def export_metrics():
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL_SEC)
+        await asyncio.to_thread(write_metrics)
 
-def show_prev_ssid_page():
-    global setting_ssid_page, setting_selected_row
-    if setting_ssid_page == 0:
-        return
-    setting_ssid_page = setting_ssid_page - 1
-    setting_selected_row = -1
-    instruction = get_ssids(setting_ssid_page * 5)
-    nextion.send(instruction)
 
+def write_metrics():
+    try:
+        metrics.REGISTRY.write_textfile(metrics_file)
+    except OSError as e:
+        log.warning("Error writing metrics: %s", e)
 
-def show_next_ssid_page():
-    global setting_ssid_page, setting_selected_row, ap_list
-    if (setting_ssid_page + 1) * 5 >= len(ap_list):
-        return
-    setting_ssid_page = setting_ssid_page + 1
-    setting_selected_row = -1
-    instruction = get_ssids(setting_ssid_page * 5)
-    nextion.send(instruction)
-
-
-def handle_string_data(data):
-    global ip_info, geocode, setting_selected_row, setting_ssid_page, ap_list, is_password, is_location
-    if is_password:
-        is_password = False
-        if setting_selected_row == -1:
-            print("Failed to connect. No SSID is selected.")
-            return
-        ssid = ap_list[setting_ssid_page * 5 + setting_selected_row].ssid
-        print(f"Start connecting {ssid}")
-        nm.add_connection(ssid, data)
-        show_menu()
- 
-        for i in range(5):
-            sleep(2)
-            ip_info = api.get_ip_info()
-            if ip_info is not None:
-                break
 
-        if ssid != nm.get_current_ssid():
-            print("Failed to connect.")
-            return
-    elif is_location:
-        is_location = False
-        geocode = api.get_geocode(data)
-        if geocode is not None:
-            print("Update location:", geocode.city, geocode.country)
-
-        
-def select_row(row):
-    global setting_selected_row
-    instruction = ""
-    match setting_selected_row:
-        case 0:
-            instruction += f'tSSID1.bco=65535\xFF\xFF\xFF'
-        case 1:
-            instruction += f'tSSID2.bco=65535\xFF\xFF\xFF'
-        case 2:
-            instruction += f'tSSID3.bco=65535\xFF\xFF\xFF'
-        case 3:
-            instruction += f'tSSID4.bco=65535\xFF\xFF\xFF'
-        case 4:
-            instruction += f'tSSID5.bco=65535\xFF\xFF\xFF'
-    match row:
-        case 0:
-            instruction += f'tSSID1.bco=65504\xFF\xFF\xFF'
-        case 1:
-            instruction += f'tSSID2.bco=65504\xFF\xFF\xFF'
-        case 2:
-            instruction += f'tSSID3.bco=65504\xFF\xFF\xFF'
-        case 3:
-            instruction += f'tSSID4.bco=65504\xFF\xFF\xFF'
-        case 4:
-            instruction += f'tSSID5.bco=65504\xFF\xFF\xFF'
-    setting_selected_row = row
-    nextion.send(instruction)
-
-
-def get_ssids(first):
-    global ap_list
-    active_ssid = nm.get_current_ssid()
-    instruction = ""
-
-    instruction += f'tId1.txt="{first + 1:02}"\xFF\xFF\xFF'
-    if first < len(ap_list):
-        instruction += f'tSSID1.txt="{ap_list[first].strength_bars:5} {ap_list[first].ssid}"\xFF\xFF\xFF'
-        if ap_list[first].ssid == active_ssid:
-            instruction += f'tSSID1.bco=2032\xFF\xFF\xFF'
-        else:
-            instruction += f'tSSID1.bco=65535\xFF\xFF\xFF'
-    else:
-        instruction += f'tSSID1.txt="--"\xFF\xFF\xFF'
-    
-    instruction += f'tId2.txt="{first + 2:02}"\xFF\xFF\xFF'
-    if first + 1 < len(ap_list):
-        instruction += f'tSSID2.txt="{ap_list[first + 1].strength_bars:5} {ap_list[first + 1].ssid}"\xFF\xFF\xFF'
-        if ap_list[first + 1].ssid == active_ssid:
-            instruction += f'tSSID2.bco=2032\xFF\xFF\xFF'
-        else:
-            instruction += f'tSSID2.bco=65535\xFF\xFF\xFF'
-    else:
-        instruction += f'tSSID2.txt="--"\xFF\xFF\xFF'
+def start_job(name, coro):
+    previous = jobs.get(name)
+    if previous is not None and not previous.done():
+        previous.cancel()
+    task = asyncio.get_running_loop().create_task(coro)
+    jobs[name] = task
 
-    instruction += f'tId3.txt="{first + 3:02}"\xFF\xFF\xFF'
-    if first + 2 < len(ap_list):
-        instruction += f'tSSID3.txt="{ap_list[first + 2].strength_bars:5} {ap_list[first + 2].ssid}"\xFF\xFF\xFF'
-        if ap_list[first + 2].ssid == active_ssid:
-            instruction += f'tSSID3.bco=2032\xFF\xFF\xFF'
-        else:
-            instruction += f'tSSID3.bco=65535\xFF\xFF\xFF'
-    else:
-        instruction += f'tSSID3.txt="--"\xFF\xFF\xFF'
+    def done(t):
+        if jobs.get(name) is t:
+            del jobs[name]
+        if not t.cancelled() and t.exception() is not None:
+            log.error("Job %s failed: %r", name, t.exception())
 
-    instruction += f'tId4.txt="{first + 4:02}"\xFF\xFF\xFF'
-    if first + 3 < len(ap_list):
-        instruction += f'tSSID4.txt="{ap_list[first + 3].strength_bars:5} {ap_list[first + 3].ssid}"\xFF\xFF\xFF'
-        if ap_list[first + 3].ssid == active_ssid:
-            instruction += f'tSSID4.bco=2032\xFF\xFF\xFF'
-        else:
-            instruction += f'tSSID4.bco=65535\xFF\xFF\xFF'
-    else:
-        instruction += f'tSSID4.txt="--"\xFF\xFF\xFF'
+    task.add_done_callback(done)
 
-    instruction += f'tId5.txt="{first + 5:02}"\xFF\xFF\xFF'
-    if first + 4 < len(ap_list):
-        instruction += f'tSSID5.txt="{ap_list[first + 4].strength_bars:5} {ap_list[first + 4].ssid}"\xFF\xFF\xFF'
-        if ap_list[first + 4].ssid == active_ssid:
-            instruction += f'tSSID5.bco=2032\xFF\xFF\xFF'
-        else:
-            instruction += f'tSSID5.bco=65535\xFF\xFF\xFF'
-    else:
-        instruction += f'tSSID5.txt="--"\xFF\xFF\xFF'
 
-    return instruction
+async def run_nm(func, *args):
+    return await asyncio.wrap_future(nm.call(func, *args))
 
 
-def update_weather(lat, lng, timezone = ""):
-    global setting_unit_of_temp
-    weatherData = api.get_weather(lat, lng, timezone, setting_unit_of_temp)
-    if weatherData is None:
-        nextion.send(f'tAddress.txt="Error fetching weather"\xFF\xFF\xFF')
-        return
+def rotation():
+    """
+    The locations the main page cycles through: the one found from the IP
+    address first, then the saved ones.
+    """
+    entries = []
+    if ip_info is not None:
+        entries.append(Location(f"{ip_info.city}, {ip_info.region}, {ip_info.country}",
+                                ip_info.lat, ip_info.lng, ip_info.timezone))
+    if locations is not None:
+        entries.extend(locations)
+    return entries
+
+
+def update_locations():
+    """
+    Point the scheduler at every location, returns rotation().
+    """
+    if not located:
+        return []
+    entries = rotation()
+    if entries:
+        # A cached forecast, even a stale one, is shown until the scheduler has fetched
+        scheduler.set_locations([e.key for e in entries], lambda key: api.peek_weather(*key))
+    return entries
+
+
+def on_access_points_changed(event):
+    if event == "reconnected":
+        # Possibly another network, the IP lookup is cached per network
+        start_job("locate", locate())
+    for panel in panels:
+        if panel.display.page is Nextion.PAGE_MENU:
+            panel.start_job("access_points", panel.refresh_access_points(0.2))
+
+
+def show_connect_state(ssid, state):
+    global connect_state
+    connect_state = (ssid, state)
+    for panel in panels:
+        if panel.display.page is Nextion.PAGE_MENU:
+            panel.render_menu()
+
+
+@dataclass(slots = True)
+class WeatherView:
+    """
+    The main page for one snapshot, unit and chart mode, built once and shared
+    by every panel showing it; each panel's DisplayState only sends what differs
+    from its screen.
+    """
+    # (component, attribute, value) with text values already quoted
+    attributes: list
+    chart: str
+
+
+def weather_view(snapshot, unit, mode):
+    global views_built, views_shared
+    key = (id(snapshot), unit, mode)
+    entry = views.get(key)
+    if entry is not None and entry[0] is snapshot:
+        views_shared += 1
+        return entry[1]
+    view = build_weather_view(snapshot, unit, mode)
+    views_built += 1
+    if len(views) >= VIEW_CACHE_SIZE:
+        views.clear()
+    views[key] = (snapshot, view)
+    return view
+
+
+def build_weather_view(weatherData, unit, mode):
+    weatherData = convert_weather(weatherData, temperature = unit)
     current = weatherData.current
     cur_units = weatherData.current_units
     daily = weatherData.daily
-    imgId = WEATHER_IMAGE[current.weather_code]
-    
+
     # Current weather
-    instruction = ''
-    instruction += f'pWeather.pic={imgId}\xFF\xFF\xFF'
-    instruction += f'tWeather.txt="{current.weather_description}"\xFF\xFF\xFF'
-    instruction += f'tTemperature.txt="{current.temperature}{cur_units.temperature}"\xFF\xFF\xFF'
-    instruction += f'tPrecipitation.txt="{daily[0].precipitation_probability}%"\xFF\xFF\xFF'
-    instruction += f'tHumidity.txt="{current.humidity}%"\xFF\xFF\xFF'
-    instruction += f'tUVIndex.txt="{daily[0].uv_index}"\xFF\xFF\xFF'
-    instruction += f'tSunrise.txt="{daily[0].sunrise.strftime("%H:%M")}"\xFF\xFF\xFF'
-    instruction += f'tSunset.txt="{daily[0].sunset.strftime("%H:%M")}"\xFF\xFF\xFF'
-    nextion.send(instruction)
-
-    # 5-day bar chart
-    instruction = ''
-    chart_left, chart_top = 50, 440
-    bar_width = 20
-    chart_width, chart_height = 380, 180
-    chart_bottom = chart_top + chart_height + 40
-    bar_space = chart_width // 5
-    bar_margin = (bar_space - bar_width) // 2
-    max_temp = max(d.temperature_max for d in daily)
-    min_temp = min(d.temperature_min for d in daily)
-    temp_range = max_temp - min_temp
-    scale = chart_height / temp_range if temp_range > 0 else 1
-    for i in range(5):
-        left = chart_left + i * bar_space
-        top = chart_top + chart_height - int((daily[i].temperature_max - min_temp) * scale)
-        height = int((daily[i].temperature_max - daily[i].temperature_min) * scale)
-        instruction += f'fill {left + bar_margin},{top},{bar_width},{height},{65120}\xFF\xFF\xFF'
-        instruction += f'xstr {left},{top - 30},{bar_space},30,3,WHITE,0,1,1,0," {int(daily[i].temperature_max)}°"\xFF\xFF\xFF'
-        instruction += f'xstr {left},{top + height},{bar_space},30,3,WHITE,0,1,1,0," {int(daily[i].temperature_min)}°"\xFF\xFF\xFF'
-    instruction += f'line {chart_left},{chart_bottom},{chart_left + chart_width},{chart_bottom},{31727}\xFF\xFF\xFF'
-    nextion.send(instruction)
-
-    # 5-day weather picture
-    instruction = ''
-    pic_left, pic_top, pic_width = chart_left, chart_bottom + 20, 50
-    pic_margin = (bar_space - pic_width) // 2
-    for i in range(5):
-        left = pic_left + i * bar_space
-        pic_id = WEATHER_IMAGE_SMALL[daily[i].weather_code]
-        date = daily[i].date.strftime("%a %d")
-        instruction += f'pic {left + pic_margin},{pic_top},{pic_id}\xFF\xFF\xFF'
-        instruction += f'xstr {left},{pic_top + pic_width + 10},{bar_space},30,3,WHITE,0,1,1,0,"{date}"\xFF\xFF\xFF'
-    nextion.send(instruction)
+    texts = [
+        ("tWeather", current.weather_description),
+        ("tTemperature", f"{current.temperature}{cur_units.temperature}"),
+        ("tHumidity", f"{current.humidity}%"),
+    ]
+    if daily:
+        texts.append(("tPrecipitation", f"{daily[0].precipitation_probability}%"))
+        texts.append(("tUVIndex", daily[0].uv_index))
+        texts.append(("tSunrise", daily[0].sunrise.strftime("%H:%M")))
+        texts.append(("tSunset", daily[0].sunset.strftime("%H:%M")))
+    attributes = [("pWeather", "pic", str(WEATHER_IMAGE[current.weather_code]))]
+    attributes.extend((component, "txt", f'"{DisplayState.escape(text)}"') for component, text in texts)
+
+    if mode in HOURLY_CHART_SERIES and weatherData.hourly is not None:
+        instruction = hourly_chart(weatherData, HOURLY_CHART_SERIES[mode])
+    elif mode == "history" and history is not None:
+        instruction = history_chart(unit)
+    else:
+        # Up to 5-day bar chart with the weather picture and date of each day
+        days = daily[:5]
+        instruction = FORECAST_CHART.daily(
+            days.temperature_min,
+            days.temperature_max,
+            [WEATHER_IMAGE_SMALL[code] for code in days.weather_code],
+            [date.strftime("%a %d") for date in days.dates()],
+        )
+    return WeatherView(attributes, instruction)
+
+
+def hourly_chart(weatherData, variable = "temperature"):
+    """
+    Line of one hourly variable over the next HOURLY_CHART_HOURS hours with the weekday at each midnight.
+    """
+    current_time = weatherData.current.time
+    now = datetime.fromisoformat(current_time) if current_time else datetime.now()
+    series = weatherData.hourly.window(now, HOURLY_CHART_HOURS)
+    positions, values = finite(getattr(series, variable))
+    # Downsampled before any instruction is built, each point costs a line instruction
+    kept = lttb(positions, values, FORECAST_CHART.width // HOURLY_CHART_PIXELS_PER_POINT)
+    labels = [(i, series.time(i).strftime("%a")) for i in range(len(series)) if series.time(i).hour == 0]
+    if variable == "precipitation_probability":
+        unit, unit_width = "%", 60
+    elif variable == "wind_speed":
+        # Fetched in km/h, only temperatures are converted
+        unit, unit_width = weatherData.current_units.wind_speed or "km/h", 100
+    else:
+        unit, unit_width = "°", 60
+    return FORECAST_CHART.line([values[k] for k in kept], labels, [positions[k] for k in kept], len(series),
+                               unit, unit_width)
+
+
+def history_chart(unit):
+    """
+    Observed temperature of the last HISTORY_CHART_HOURS hours, read from the history store.
+    """
+    records = history.trend(HISTORY_CHART_HOURS)
+    if not records:
+        return ""
+    start = time.time() - HISTORY_CHART_HOURS * 3600
+    # Positions in minutes, observations are not evenly spaced
+    positions = [max(0, int((r.valid - start) // 60)) for r in records]
+    values = [convert(r.temperature, "celsius", unit) for r in records]
+    labels = [(HISTORY_CHART_HOURS * 60 - h * 60, f"-{h}h") for h in range(HISTORY_CHART_HOURS, 0, -6)]
+    return FORECAST_CHART.line(values, labels, positions, HISTORY_CHART_HOURS * 60 + 1)
+
+
+class Panel:
+    """
+    One display and what its user has selected on it: page, menu row, unit,
+    chart and location. Every panel has its own serial port, reader and writer
+    thread, or its agent connection in hub mode; the forecasts, locations and
+    Wi-Fi are shared.
+    """
+
+    def __init__(self, nextion, wifi = True):
+        """
+        :param nextion: Nextion of the display, a RemoteNextion for panel agents.
+        :param wifi: Show and connect the access points on the menu page.
+        """
+        self.nextion = nextion
+        self.wifi = wifi
+        self.display = DisplayState(self.nextion, {Nextion.PAGE_MAIN: "pageMain", Nextion.PAGE_MENU: "pageMenu"})
+        self.clock = DisplayClock(self.nextion, lambda: self.display.page is Nextion.PAGE_MAIN)
+        self.started = False
+        # Position in rotation() of the location on the main page
+        self.location_index = 0
+        # Touch press coordinates (x, y), to tell a tap from a swipe on release
+        self.touch_start = None
+        # The access points shown on the current menu page and the number of SSIDs in range
+        self.ap_page = []
+        self.ap_count = 0
+        self.setting_selected_ssid = None
+        self.setting_ssid_page = 0
+        self.setting_unit_of_temp = 'fahrenheit'
+        # Flag for fetching string data after user push buttons
+        self.is_password = False
+        self.is_location = False
+        # One of CHART_MODES
+        self.chart_mode = "daily"
+
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.nextion.call_later = loop.call_later
+        # Probing waits for answers, on a thread so the other panels are not held up
+        await asyncio.to_thread(self.nextion.negotiate_baudrate, BAUDRATE)
+        self.nextion.start_writer()
+        loop.add_reader(self.nextion.fileno(), self.read_commands)
+        self.started = True
+        self.nextion.send('sendme\xFF\xFF\xFF')
+        # Report touch coordinates (0x67), the chart has no component to tap
+        self.nextion.send('sendxy=1\xFF\xFF\xFF')
+        self.clock.start()
+        if rotate_sec:
+            self.start_job("rotate", self.rotate_locations())
+
+
+    def stop(self):
+        self.clock.stop()
+        if self.started:
+            asyncio.get_running_loop().remove_reader(self.nextion.fileno())
+            self.started = False
+
+
+    def resync(self):
+        """
+        The display connected through its agent and may show anything: load
+        the main page and send all of it, the clock starts over.
+        """
+        self.nextion.send('sendxy=1\xFF\xFF\xFF')
+        self.nextion.send('page pageMain\xFF\xFF\xFF')
+        self.display.page_changed(Nextion.PAGE_MAIN)
+        self.show_main()
+        self.clock.stop()
+        self.clock.start()
+        if rotate_sec:
+            self.start_job("rotate", self.rotate_locations())
+
+
+    def suspend(self):
+        """
+        The agent is gone, nothing is rendered until resync().
+        """
+        self.clock.stop()
+        self.display.page_changed(None)
+
+
+    def start_job(self, name, coro):
+        start_job(f"{name} {self.nextion.port}", coro)
+
+
+    def print_stats(self):
+        self.clock.print_stats()
+        self.nextion.print_stats()
+        self.display.print_stats()
+
+
+    def read_commands(self):
+        nextion = self.nextion
+        for cmd in nextion.getCommands():
+            start = time.perf_counter()
+            self.processCommand(cmd)
+            COMMAND_SECONDS.observe(time.perf_counter() - start, event = f"0x{cmd.event:02x}")
+            if cmd.event is nextion.EVENT_TOUCH and cmd.value == 1:
+                page, component = cmd.page, cmd.component
+                nextion.when_idle(lambda: TOUCH_RESPONSE_SECONDS.observe(
+                    time.perf_counter() - start, page = page, component = component))
+
+
+    def processCommand(self, cmd):
+        nextion = self.nextion
+        display = self.display
+        if cmd.event is nextion.CURRENT_PAGE_NUMBER:
+            display.page_changed(cmd.page)
+            if cmd.page is nextion.PAGE_MAIN:
+                self.show_main()
+            elif cmd.page is nextion.PAGE_MENU:
+                self.start_job("page", self.show_menu())
+            return
+
+        if cmd.event is nextion.TOUCH_COORDINATE:
+            if display.page is nextion.PAGE_MAIN:
+                self.touch_main(cmd)
+            return
+
+        if cmd.page != -1 and cmd.page != display.page:
+            display.page_changed(cmd.page)
+
+        if cmd.page is nextion.PAGE_MAIN:
+            match cmd.component:
+                case nextion.B_MENU:
+                    display.page_changed(nextion.PAGE_MENU)
+                    self.start_job("page", self.show_menu())
+                case nextion.B_REFRESH:
+                    self.show_main()
+                    scheduler.trigger(refresh = True)
+        elif cmd.page is nextion.PAGE_MENU:
+            match cmd.component:
+                case nextion.B_LEFT:
+                    self.show_prev_ssid_page()
+                case nextion.B_RIGHT:
+                    self.show_next_ssid_page()
+                case nextion.T_ID1:
+                    self.select_row(0)
+                case nextion.T_ID2:
+                    self.select_row(1)
+                case nextion.T_ID3:
+                    self.select_row(2)
+                case nextion.T_ID4:
+                    self.select_row(3)
+                case nextion.T_ID5:
+                    self.select_row(4)
+                case nextion.T_SSID1:
+                    self.select_row(0)
+                case nextion.T_SSID2:
+                    self.select_row(1)
+                case nextion.T_SSID3:
+                    self.select_row(2)
+                case nextion.T_SSID4:
+                    self.select_row(3)
+                case nextion.T_SSID5:
+                    self.select_row(4)
+                case nextion.B_CONNECT if self.wifi:
+                    nextion.send("get tPassword.txt\xFF\xFF\xFF")
+                    self.is_password = True
+                case nextion.B_UPDATE_LOCATION:
+                    nextion.send("get tLocation.txt\xFF\xFF\xFF")
+                    self.is_location = True
+                case nextion.B_UNIT_TEMP:
+                    if self.setting_unit_of_temp == "fahrenheit":
+                        self.setting_unit_of_temp = "celsius"
+                    else:
+                        self.setting_unit_of_temp = "fahrenheit"
+                    self.render_menu()
+                    snapshot = self.active_snapshot()
+                    if snapshot is not None:
+                        self.render_weather(snapshot)
+                case nextion.B_BACK:
+                    display.page_changed(nextion.PAGE_MAIN)
+                    self.show_main()
+        elif cmd.page == -1:
+            if cmd.string_data is not None:
+                self.start_job("connect" if self.is_password else "location", self.handle_string_data(cmd.string_data))
+
+
+    def show_main(self):
+        """
+        Render the main page from the latest snapshot, fetching is left to the scheduler.
+        """
+        # Reset menu settings, the access points are kept to show on the next menu visit
+        self.setting_ssid_page = 0
+        self.setting_selected_ssid = None
+
+        self.display.set_txt(Nextion.PAGE_MAIN, "tAddress", self.address())
+        snapshot = self.active_snapshot()
+        if snapshot is not None:
+            self.render_weather(snapshot)
+        else:
+            self.display.commit()
+        if self.display.page is Nextion.PAGE_MAIN:
+            self.clock.show()
+            mark_startup("first_frame")
+
+
+    def address(self):
+        """
+        The address line of the shown location.
+        """
+        if not located:
+            return "Locating..."
+        entries = update_locations()
+        if not entries:
+            return "NO WI-FI"
+        self.location_index %= len(entries)
+        return entries[self.location_index].name
+
+
+    def active_snapshot(self):
+        entries = rotation() if located else []
+        if not entries:
+            return None
+        return scheduler.snapshot(entries[self.location_index % len(entries)].key)
+
+
+    def rotate_location(self, step):
+        """
+        Show the next (step 1) or previous (step -1) location, from memory.
+        """
+        entries = rotation()
+        if len(entries) < 2:
+            return
+        self.location_index = (self.location_index + step) % len(entries)
+        if self.display.page is Nextion.PAGE_MAIN:
+            self.show_main()
+
+
+    async def rotate_locations(self):
+        while True:
+            await asyncio.sleep(rotate_sec)
+            if self.display.page is Nextion.PAGE_MAIN:
+                self.rotate_location(1)
+
+
+    def touch_main(self, cmd):
+        """
+        A swipe across the main page rotates the locations, a tap on the chart switches the chart.
+        """
+        if cmd.value == 1:
+            self.touch_start = (cmd.x, cmd.y)
+            return
+        if self.touch_start is None:
+            return
+        (x, y), self.touch_start = self.touch_start, None
+        dx, dy = cmd.x - x, cmd.y - y
+        if abs(dx) >= SWIPE_MIN_PX and abs(dx) > 2 * abs(dy):
+            self.rotate_location(-1 if dx > 0 else 1)
+            if rotate_sec:
+                # A full period on the chosen location
+                self.start_job("rotate", self.rotate_locations())
+        elif FORECAST_CHART.contains(x, y) and FORECAST_CHART.contains(cmd.x, cmd.y):
+            self.toggle_chart()
+
+
+    async def show_menu(self):
+        """
+        Render the access points from the last scan right away, then scan;
+        rows are updated as NetworkManager reports access points.
+        """
+        self.render_menu()
+        if not self.wifi or await nm_task is None:
+            return
+        await run_nm(nm.request_scan)
+        await self.refresh_access_points()
+
+
+    async def refresh_access_points(self, delay = 0):
+        # A scan reports many access points at once, the restarted job collapses them into one render
+        await asyncio.sleep(delay)
+        if not self.wifi or await nm_task is None:
+            return
+        self.ap_page, self.ap_count = await run_nm(nm.get_ssids, self.setting_ssid_page * 5, 5)
+        self.render_menu()
+
+
+    def show_prev_ssid_page(self):
+        if self.setting_ssid_page == 0:
+            return
+        self.setting_ssid_page = self.setting_ssid_page - 1
+        self.setting_selected_ssid = None
+        self.start_job("access_points", self.refresh_access_points())
+
+
+    def show_next_ssid_page(self):
+        if (self.setting_ssid_page + 1) * 5 >= self.ap_count:
+            return
+        self.setting_ssid_page = self.setting_ssid_page + 1
+        self.setting_selected_ssid = None
+        self.start_job("access_points", self.refresh_access_points())
+
+
+    async def handle_string_data(self, data):
+        global ip_info
+        if self.is_password:
+            self.is_password = False
+            # The list may have been re-sorted by a scan since the row was tapped, so go by SSID
+            ssid = self.setting_selected_ssid
+            if ssid is None:
+                log.warning("Failed to connect. No SSID is selected.")
+                return
+            log.info("Start connecting %s", ssid)
+            if await nm_task is None:
+                return
+            loop = asyncio.get_running_loop()
+            show_connect_state(ssid, "connecting")
+            self.start_job("page", self.show_menu())
+            try:
+                future = await run_nm(nm.add_connection, ssid, data,
+                                      lambda state: loop.call_soon_threadsafe(show_connect_state, ssid, state))
+                activation = await asyncio.wrap_future(future)
+            except Exception as e:
+                log.warning("Failed to connect. %s", e)
+                show_connect_state(ssid, "failed")
+                return
+            log.info("Connected %s: associated in %.2fs, IP in %.2fs", ssid, activation.associate_sec or 0, activation.ip_sec)
+            self.start_job("access_points", self.refresh_access_points())
+            # The new network is up, one lookup is enough
+            await api_task
+            ip_info = await asyncio.to_thread(api.get_ip_info, ssid, True)
+            if ip_info is not None:
+                update_locations()
+        elif self.is_location:
+            self.is_location = False
+            await api_task
+            geocode = await asyncio.to_thread(api.get_geocode, data)
+            if geocode is not None:
+                log.info("Update location: %s, %s", geocode.city, geocode.country)
+                # Saved to the rotation and shown next on this panel
+                location = Location(f"{geocode.city}, {geocode.country_code.upper()}", float(geocode.lat), float(geocode.lng))
+                index = await asyncio.to_thread(locations.add, location)
+                self.location_index = index + (1 if ip_info is not None else 0)
+                update_locations()
+
+
+    def select_row(self, row):
+        if row < len(self.ap_page):
+            self.setting_selected_ssid = self.ap_page[row].ssid
+            self.render_menu()
+
+
+    def render_menu(self):
+        """
+        Describe the whole menu page; DisplayState only sends what changed.
+        """
+        display = self.display
+        first = self.setting_ssid_page * 5
+        for row in range(5):
+            display.set_txt(Nextion.PAGE_MENU, f"tId{row + 1}", f"{first + row + 1:02}")
+            if row < len(self.ap_page):
+                ap = self.ap_page[row]
+                text = f"{ap.strength_bars:5} {ap.ssid}"
+                if connect_state is not None and connect_state[0] == ap.ssid:
+                    text += f" ({connect_state[1]})"
+                display.set_txt(Nextion.PAGE_MENU, f"tSSID{row + 1}", text)
+                if ap.ssid == self.setting_selected_ssid:
+                    color = COLOR_ROW_SELECTED
+                elif ap.is_active_ap:
+                    color = COLOR_ROW_ACTIVE
+                else:
+                    color = COLOR_ROW
+            else:
+                display.set_txt(Nextion.PAGE_MENU, f"tSSID{row + 1}", "--")
+                color = COLOR_ROW
+            display.set_attr(Nextion.PAGE_MENU, f"tSSID{row + 1}", "bco", color)
+        display.set_txt(Nextion.PAGE_MENU, "bUnitTemp", f"Unit of Temperature: {self.setting_unit_of_temp}")
+        display.commit()
+
+
+    def render_weather(self, weatherData):
+        display = self.display
+        if weatherData is None:
+            display.set_txt(Nextion.PAGE_MAIN, "tAddress", "Error fetching weather")
+            display.commit()
+            return
+        if display.page is Nextion.PAGE_MAIN:
+            mark_startup("first_forecast")
+        view = weather_view(weatherData, self.setting_unit_of_temp, self.chart_mode)
+        page = Nextion.PAGE_MAIN
+        for component, attr, value in view.attributes:
+            display.set_attr(page, component, attr, value)
+        # The chart is only redrawn when it changes; a different chart reloads the page to erase the old one
+        display.set_drawing(page, "chart", view.chart, view.chart)
+        display.commit()
+
+
+    def toggle_chart(self):
+        self.chart_mode = CHART_MODES[(CHART_MODES.index(self.chart_mode) + 1) % len(CHART_MODES)]
+        snapshot = self.active_snapshot()
+        if snapshot is not None:
+            self.render_weather(snapshot)
 
 
 if __name__ == "__main__":
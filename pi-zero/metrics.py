@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "pi_zero_weather_"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+
+class Metric:
+    """
+    One metric family, a value per set of labels. Updates take a lock, so
+    metrics can be updated from worker threads and the GLib thread.
+    """
+    TYPE = "untyped"
+
+    def __init__(self, name, help, lock):
+        self.name = PREFIX + name
+        self.help = help
+        self.lock = lock
+        self.values = {}
+
+
+    def key(self, labels):
+        return tuple(sorted(labels.items()))
+
+
+    def samples(self):
+        """
+        (suffix, labels, value) of every sample, called with the lock held.
+        """
+        return [("", key, value) for key, value in self.values.items()]
+
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        for suffix, key, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(key)} {value:.6g}")
+        return lines
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Summary(Metric):
+    """
+    Count and sum of observations, plus the largest one as <name>_max.
+    """
+    TYPE = "summary"
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            count, total, largest = self.values.get(key, (0, 0.0, 0.0))
+            self.values[key] = (count + 1, total + value, max(largest, value))
+
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+    def samples(self):
+        samples = []
+        for key, (count, total, largest) in self.values.items():
+            samples.append(("_count", key, count))
+            samples.append(("_sum", key, total))
+        return samples
+
+
+    def render(self):
+        lines = super().render()
+        if self.values:
+            lines.append(f"# TYPE {self.name}_max gauge")
+            for key, (count, total, largest) in self.values.items():
+                lines.append(f"{self.name}_max{format_labels(key)} {largest:.6g}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics of the process in the Prometheus text format, written to a file
+    for node_exporter's textfile collector or served over HTTP.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.server = None
+
+
+    def add(self, cls, name, help):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, self.lock)
+        return metric
+
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics.values():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+    def write_textfile(self, path):
+        """
+        Replace path atomically, so the collector never reads a partial file.
+        """
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding = "utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+    def serve(self, port, host = "127.0.0.1"):
+        """
+        Serve /metrics from a daemon thread.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target = self.server.serve_forever, name = "metrics", daemon = True).start()
+        return self.server
+
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help):
+    return REGISTRY.add(Counter, name, help)
+
+
+def gauge(name, help):
+    return REGISTRY.add(Gauge, name, help)
+
+
+def summary(name, help):
+    return REGISTRY.add(Summary, name, help)
@@ -1,13 +1,24 @@
 import gi
+import logging
 import time
 import math
 import re
+import threading
+from concurrent.futures import Future
 from dataclasses import dataclass
 gi.require_version("NM", "1.0")
 gi.require_version("GLib", "2.0")
 from gi.repository import GLib, NM
+import metrics
 
-@dataclass
+log = logging.getLogger(__name__)
+
+SCAN_SECONDS = metrics.summary("wifi_scan_seconds", "Time from requesting a Wi-Fi scan to its completion.")
+CONNECT_SECONDS = metrics.summary("wifi_connect_seconds", "Time from activating a connection to association (stage=associate) and an IP address (stage=ip).")
+CONNECTS = metrics.counter("wifi_connects_total", "Connection attempts by result.")
+
+
+@dataclass(slots = True)
 class AccessPointInfo:
     dbus_path: str
     ssid: str
@@ -25,11 +36,111 @@ class AccessPointInfo:
     is_active_ap: bool = False
 
 
+def enum_names(enum_type):
+    """
+    Map each value of a GObject enum or flags type to its member name, once per type
+    instead of scanning dir() on every lookup.
+    """
+    names = {}
+    for n in sorted(dir(enum_type)):
+        if re.search("^[A-Z0-9_]+$", n):
+            names.setdefault(int(getattr(enum_type, n)), n)
+    return names
+
+
+@dataclass(slots = True)
+class Activation:
+    """
+    Timings of one connection attempt, in seconds from the activation request.
+    """
+    ssid: str
+    associate_sec: float = None
+    ip_sec: float = None
+    state: str = "activating"
+
+
+class AccessPointIndex:
+    """
+    Access points of one device, kept up to date from NetworkManager signals.
+
+    Every BSSID is tracked, but only the strongest BSSID of each SSID is listed,
+    sorted by strength, so a page of the menu is a slice of sorted().
+    Only used on the GLib thread.
+    """
+
+    def __init__(self, describe):
+        """
+        :param describe: Callable(NM.AccessPoint) returning its AccessPointInfo.
+        """
+        self.describe = describe
+        self.by_path = {}
+        self.order = []
+        self.dirty = False
+
+
+    def add(self, ap):
+        self.by_path[ap.get_path()] = self.describe(ap)
+        self.dirty = True
+
+
+    def remove(self, ap):
+        if self.by_path.pop(ap.get_path(), None) is not None:
+            self.dirty = True
+
+
+    def update_strength(self, ap):
+        info = self.by_path.get(ap.get_path())
+        if info is None:
+            return False
+        strength = ap.get_strength()
+        if strength == info.strength:
+            return False
+        info.strength = strength
+        info.strength_bars = NM.utils_wifi_strength_bars(strength)
+        self.dirty = True
+        return True
+
+
+    def set_active(self, ssid):
+        for info in self.by_path.values():
+            info.is_active_ap = info.ssid == ssid
+
+
+    def sorted(self):
+        if self.dirty:
+            strongest = {}
+            for info in self.by_path.values():
+                best = strongest.get(info.ssid)
+                if best is None or info.strength > best.strength:
+                    strongest[info.ssid] = info
+            self.order = sorted(strongest.values(), key = lambda info: info.strength, reverse = True)
+            self.dirty = False
+        return self.order
+
+
+    def __len__(self):
+        return len(self.sorted())
+
+
 class NetworkManager:
+    """
+    libnm client driven by a GLib main loop on its own thread.
+
+    libnm objects must only be used from the thread iterating their main
+    context, so other threads go through call(), which runs a function on the
+    GLib thread and returns a concurrent.futures.Future. Nothing here blocks
+    waiting for NetworkManager: scans and activations complete through signals.
+    """
     NM80211Mode = getattr(NM, "80211Mode")
     NM80211ApFlags = getattr(NM, "80211ApFlags")
     NM80211ApSecurityFlags = getattr(NM, "80211ApSecurityFlags")
+    MODE_NAMES = enum_names(NM80211Mode)
+    AP_FLAG_NAMES = enum_names(NM80211ApFlags)
+    AP_SECURITY_FLAG_NAMES = enum_names(NM80211ApSecurityFlags)
     SCAN_THRESHOLD_MSEC = 500
+    ACTIVATION_TIMEOUT_SEC = 45
+    # After a drop, give NetworkManager's own autoconnect this long before picking a network
+    RECONNECT_DELAY_SEC = 3
 
 
     def __init__(self):
@@ -43,6 +154,129 @@ class NetworkManager:
         
         if not self.device:
             raise RuntimeError("No WIFI device found.")
+
+        # Called on the GLib thread with "added", "removed", "strength", "active" or "scanned" when
+        # the AP list changes, and "reconnected" after auto-reconnect brought the Wi-Fi back
+        self.listeners = []
+        self.index = AccessPointIndex(self.describe_access_point)
+        # NM.AccessPoint -> its notify::strength handler id
+        self.ap_handler_ids = {}
+        for ap in self.device.get_access_points():
+            self.track_access_point(ap)
+        self.index.set_active(self.get_current_ssid())
+        # Finished connection attempts, for print_stats()
+        self.activations = []
+        self.scan_started = None
+        # Future of the attempt in progress, auto-reconnect stays out of its way
+        self.activation = None
+        self.reconnect_id = None
+        # Connected once for the lifetime of the client and disconnected in close()
+        self.handler_ids = [
+            self.device.connect("access-point-added", self.on_access_point_added),
+            self.device.connect("access-point-removed", self.on_access_point_removed),
+            self.device.connect("notify::active-access-point", self.on_active_access_point),
+            self.device.connect("state-changed", self.on_device_state_changed),
+            self.device.connect("notify::last-scan", self.on_last_scan),
+        ]
+        if self.is_disconnected():
+            self.schedule_reconnect()
+        self.thread = threading.Thread(target = self.main_loop.run, name = "glib", daemon = True)
+        self.thread.start()
+
+
+    def call(self, func, *args):
+        """
+        Run func(*args) on the GLib thread, returns a Future with its result.
+        """
+        future = Future()
+
+        def run():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args))
+                except Exception as e:
+                    future.set_exception(e)
+            return GLib.SOURCE_REMOVE
+
+        GLib.idle_add(run)
+        return future
+
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+
+    def notify(self, event):
+        for listener in list(self.listeners):
+            listener(event)
+
+
+    def track_access_point(self, ap):
+        self.index.add(ap)
+        if ap not in self.ap_handler_ids:
+            self.ap_handler_ids[ap] = ap.connect("notify::strength", self.on_strength_changed)
+
+
+    def on_access_point_added(self, device, ap):
+        self.track_access_point(ap)
+        self.index.set_active(self.get_current_ssid())
+        self.notify("added")
+        if self.is_disconnected():
+            # A known network may just have come into range
+            self.schedule_reconnect()
+
+
+    def on_access_point_removed(self, device, ap):
+        handler_id = self.ap_handler_ids.pop(ap, None)
+        if handler_id is not None:
+            ap.disconnect(handler_id)
+        self.index.remove(ap)
+        self.notify("removed")
+
+
+    def on_strength_changed(self, ap, prop):
+        if self.index.update_strength(ap):
+            self.notify("strength")
+
+
+    def on_active_access_point(self, device, prop):
+        self.index.set_active(self.get_current_ssid())
+        self.notify("active")
+
+
+    def on_last_scan(self, device, prop):
+        if self.scan_started is not None:
+            SCAN_SECONDS.observe(time.monotonic() - self.scan_started)
+            self.scan_started = None
+        self.notify("scanned")
+
+
+    def on_device_state_changed(self, device, new_state, old_state, reason):
+        if self.is_disconnected():
+            self.schedule_reconnect()
+
+
+    def close(self):
+        def disconnect():
+            for handler_id in self.handler_ids:
+                self.device.disconnect(handler_id)
+            self.handler_ids = []
+            if self.reconnect_id is not None:
+                GLib.source_remove(self.reconnect_id)
+                self.reconnect_id = None
+            for ap, handler_id in self.ap_handler_ids.items():
+                ap.disconnect(handler_id)
+            self.ap_handler_ids = {}
+            self.main_loop.quit()
+
+        if self.thread.is_alive():
+            self.call(disconnect)
+            self.thread.join(timeout = 1)
  
 
     def print_device_info(self):
@@ -81,73 +315,151 @@ class NetworkManager:
 
 
     def request_scan(self):
+        """
+        Start a scan and return immediately. Access points are reported to the
+        listeners as they appear, and "scanned" once the scan has finished.
+        """
         if not self.device_needs_scan():
-            return
+            return False
 
-        print("Requesting Wi-Fi scan...")
-        self.device.request_scan_async(None)
-        
-        def cb():
-            self.main_loop.quit()
+        def cb(device, result, data):
+            try:
+                device.request_scan_finish(result)
+            except GLib.Error as e:
+                # NetworkManager refuses scans while one is running or right after one
+                log.info("Wi-Fi scan not started: %s", e.message)
+                self.scan_started = None
 
-        timeout_source = GLib.timeout_source_new(10 * 1000)
-        timeout_source.set_callback(cb)
-        timeout_source.attach(self.main_loop.get_context())
+        log.info("Requesting Wi-Fi scan")
+        self.scan_started = time.monotonic()
+        self.device.request_scan_async(None, cb, None)
+        return True
 
-        def cb(device, prop):
-            if not self.device_needs_scan():
-                self.main_loop.quit()
 
-        self.device.connect("notify", cb)
-        self.main_loop.run()
-        timeout_source.destroy()
-        print("Finished Wi-Fi scan")
+    def get_access_points(self):
+        """
+        One entry per SSID, the strongest BSSID first.
+        """
+        return list(self.index.sorted())
+
+
+    def get_ssids(self, start = 0, count = 5):
+        """
+        A page of get_access_points() and the total number of SSIDs.
+        """
+        ap_list = self.index.sorted()
+        return ap_list[start:start + count], len(ap_list)
+
+
+    def describe_access_point(self, ap):
+        strength = ap.get_strength()
+        frequency = ap.get_frequency()
+        flags = ap.get_flags()
+        wpa_flags = ap.get_wpa_flags()
+        rsn_flags = ap.get_rsn_flags()
+
+        t = ap.get_last_seen()
+        if t < 0:
+            last_seen = "never"
+        else:
+            t = time.clock_gettime(time.CLOCK_BOOTTIME) - t
+            last_seen = "%s sec ago" % (math.ceil(t),)
+
+        return AccessPointInfo(
+            dbus_path = ap.get_path(),
+            ssid = self.ap_get_ssid(ap),
+            bssid = ap.get_bssid(),
+            last_seen = last_seen,
+            frequency = frequency,
+            channel = NM.utils_wifi_freq_to_channel(frequency),
+            mode = self.genum_to_str(self.MODE_NAMES, ap.get_mode()),
+            flags = self.gflags_to_str(self.AP_FLAG_NAMES, flags),
+            wpa_flags = self.gflags_to_str(self.AP_SECURITY_FLAG_NAMES, wpa_flags),
+            rsn_flags = self.gflags_to_str(self.AP_SECURITY_FLAG_NAMES, rsn_flags),
+            security = self.ap_security_flags_to_security(flags, wpa_flags, rsn_flags),
+            strength = strength,
+            strength_bars = NM.utils_wifi_strength_bars(strength),
+        )
+
+
+    def add_connection(self, ssid, password, on_progress = None):
+        """
+        Start connecting, returns a Future resolved with an Activation once the
+        connection has an IP address, or failed with ConnectionError.
+
+        A saved profile for the SSID is reused, with its PSK updated in place
+        when a password is given; otherwise a new profile is added.
+
+        :param password: None to activate a saved profile as it is.
+        :param on_progress: Callable(state) run on the GLib thread as the connection
+                            goes through "activating", "associated" and "connected".
+        """
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.activation = future
+        started = time.monotonic()
+        activation = Activation(ssid)
+
+        def activated(finish):
+            def cb(client, result, data):
+                try:
+                    ac = finish(result)
+                except Exception as e:
+                    log.warning("Connection error: %s", e)
+                    self.activations.append(activation)
+                    CONNECTS.inc(result = "failed")
+                    future.set_exception(ConnectionError(str(e)))
+                    return
+                log.debug("ActiveConnection %s", ac.get_path())
+                self.watch_activation(ac, activation, started, future, on_progress)
+            return cb
+
+        saved = self.get_saved_connections().get(ssid)
+        if saved is None:
+            if password is None:
+                future.set_exception(ConnectionError(f"{ssid}: no saved connection"))
+                return future
+            connection = self.new_connection(ssid, password)
+            log.info("Adding connection %s", connection.get_id())
+            self.client.add_and_activate_connection_async(
+                connection, self.device, None, None, activated(self.client.add_and_activate_connection_finish), None)
+            return future
+
+        log.info("Reusing connection %s", saved.get_id())
+        activate = activated(self.client.activate_connection_finish)
+        if password is None:
+            self.client.activate_connection_async(saved, self.device, None, None, activate, None)
+            return future
+
+        s_wsec = saved.get_setting_wireless_security()
+        if s_wsec is None:
+            s_wsec = NM.SettingWirelessSecurity.new()
+            saved.add_setting(s_wsec)
+        s_wsec.set_property(NM.SETTING_WIRELESS_SECURITY_KEY_MGMT, "wpa-psk")
+        s_wsec.set_property(NM.SETTING_WIRELESS_SECURITY_PSK, password)
 
+        def commit_cb(connection, result, data):
+            try:
+                connection.commit_changes_finish(result)
+            except Exception as e:
+                log.warning("Connection error: %s", e)
+                self.activations.append(activation)
+                CONNECTS.inc(result = "failed")
+                future.set_exception(ConnectionError(str(e)))
+                return
+            self.client.activate_connection_async(connection, self.device, None, None, activate, None)
 
-    def get_access_points(self):
-        ap_list = []
-        active_ap = self.ap_get_ssid(self.device.get_active_access_point())
-        for ap in self.device.get_access_points():
-            strength = ap.get_strength()
-            frequency = ap.get_frequency()
-            flags = ap.get_flags()
-            wpa_flags = ap.get_wpa_flags()
-            rsn_flags = ap.get_rsn_flags()
-
-            t = ap.get_last_seen()
-            if t < 0:
-                last_seen = "never"
-            else:
-                t = time.clock_gettime(time.CLOCK_BOOTTIME) - t
-                last_seen = "%s sec ago" % (math.ceil(t),)
-
-            ap_info = AccessPointInfo(
-                dbus_path = ap.get_path(),
-                ssid = self.ap_get_ssid(ap),
-                bssid = ap.get_bssid(),
-                last_seen = last_seen,
-                frequency = frequency,
-                channel = NM.utils_wifi_freq_to_channel(frequency),
-                mode = self.genum_to_str(self.NM80211Mode, ap.get_mode()),
-                flags = self.gflags_to_str(self.NM80211ApFlags, flags),
-                wpa_flags = self.gflags_to_str(self.NM80211ApSecurityFlags, wpa_flags),
-                rsn_flags = self.gflags_to_str(self.NM80211ApSecurityFlags, rsn_flags),
-                security = self.ap_security_flags_to_security(flags, wpa_flags, rsn_flags),
-                strength = strength,
-                strength_bars = NM.utils_wifi_strength_bars(strength),
-            )
-            ap_info.is_active_ap = ap_info.ssid == active_ap
-            ap_list.append(ap_info)
-            print(f"SSID: {ap_info.ssid}, Strength: {ap_info.strength}% | {ap_info.strength_bars}")
-        return ap_list
-
-
-    def add_connection(self, ssid, password):
+        saved.commit_changes_async(True, None, commit_cb, None)
+        return future
+
+
+    def new_connection(self, ssid, password):
         connection = NM.SimpleConnection.new()
         ssid_bytes = GLib.Bytes.new(ssid.encode("utf-8"))
 
         s_con = NM.SettingConnection.new()
-        s_con.set_property(NM.SETTING_CONNECTION_ID, "my-wifi-connection")
+        s_con.set_property(NM.SETTING_CONNECTION_ID, self.unique_connection_id(ssid))
+        s_con.set_property(NM.SETTING_CONNECTION_UUID, NM.utils_uuid_generate())
         s_con.set_property(NM.SETTING_CONNECTION_TYPE, "802-11-wireless")
 
         s_wifi = NM.SettingWireless.new()
@@ -169,18 +481,147 @@ class NetworkManager:
         connection.add_setting(s_wsec)
         connection.add_setting(s_ip4)
         connection.add_setting(s_ip6)
-
-        def add_and_activate_cb(client, result, data):
-            try:
-                ac = client.add_and_activate_connection_finish(result)
-                print(f"ActiveConnection {ac.get_path()}")
-                print(f"State {ac.get_state().value_nick}")
-            except Exception as e:
-                print("Error:", e)
-            self.main_loop.quit()
-
-        self.client.add_and_activate_connection_async(connection, self.device, None, None, add_and_activate_cb, None)
-        self.main_loop.run()
+        return connection
+
+
+    def unique_connection_id(self, ssid):
+        """
+        The SSID, numbered like nmcli does when a profile with that name exists.
+        """
+        ids = {connection.get_id() for connection in self.client.get_connections()}
+        connection_id = ssid
+        n = 1
+        while connection_id in ids:
+            connection_id = f"{ssid} {n}"
+            n += 1
+        return connection_id
+
+
+    def get_saved_connections(self):
+        """
+        Saved Wi-Fi profiles by SSID, the most recently used one when there are several.
+        """
+        saved = {}
+        for connection in self.client.get_connections():
+            s_wifi = connection.get_setting_wireless()
+            if s_wifi is None or s_wifi.get_ssid() is None:
+                continue
+            ssid = str(NM.utils_ssid_to_utf8(s_wifi.get_ssid().get_data()))
+            best = saved.get(ssid)
+            if best is None or connection.get_setting_connection().get_timestamp() > \
+                    best.get_setting_connection().get_timestamp():
+                saved[ssid] = connection
+        return saved
+
+
+    def is_disconnected(self):
+        return self.device.get_state() in (NM.DeviceState.DISCONNECTED, NM.DeviceState.FAILED)
+
+
+    def schedule_reconnect(self):
+        if self.reconnect_id is None:
+            self.reconnect_id = GLib.timeout_add_seconds(self.RECONNECT_DELAY_SEC, self.reconnect)
+
+
+    def reconnect(self):
+        """
+        Auto-reconnect: try the saved networks in range, strongest first.
+        """
+        self.reconnect_id = None
+        if not self.is_disconnected() or (self.activation is not None and not self.activation.done()):
+            # NetworkManager or the user is already connecting
+            return GLib.SOURCE_REMOVE
+        saved = self.get_saved_connections()
+        candidates = [info.ssid for info in self.index.sorted() if info.ssid in saved]
+        if not candidates:
+            log.info("Auto-reconnect: no saved network in range")
+            return GLib.SOURCE_REMOVE
+        log.info("Auto-reconnect: trying %s", ", ".join(candidates))
+        self.try_reconnect(candidates)
+        return GLib.SOURCE_REMOVE
+
+
+    def try_reconnect(self, candidates):
+        def done(future):
+            # Resolved on the GLib thread
+            if future.exception() is None:
+                self.notify("reconnected")
+            elif len(candidates) > 1:
+                self.try_reconnect(candidates[1:])
+
+        self.add_connection(candidates[0], None).add_done_callback(done)
+
+
+    def watch_activation(self, ac, activation, started, future, on_progress):
+        """
+        Follow an NM.ActiveConnection through its state-changed and state-flags
+        signals until it has an IP address, fails or times out.
+        """
+        handler_ids = []
+
+        def progress(state):
+            if activation.state == state:
+                return
+            activation.state = state
+            log.info("%s: %s", activation.ssid, state)
+            if on_progress is not None:
+                on_progress(state)
+
+        def finish(error = None):
+            if future.done():
+                return
+            for handler_id in handler_ids:
+                ac.disconnect(handler_id)
+            GLib.source_remove(timeout_id)
+            self.activations.append(activation)
+            if activation.associate_sec is not None:
+                CONNECT_SECONDS.observe(activation.associate_sec, stage = "associate")
+            if activation.ip_sec is not None:
+                CONNECT_SECONDS.observe(activation.ip_sec, stage = "ip")
+            CONNECTS.inc(result = "connected" if error is None else error)
+            if error is None:
+                future.set_result(activation)
+            else:
+                progress(error)
+                future.set_exception(ConnectionError(f"{activation.ssid}: {error}"))
+
+        def check(*args):
+            elapsed = time.monotonic() - started
+            flags = ac.get_state_flags()
+            if activation.associate_sec is None and flags & NM.ActivationStateFlags.LAYER2_READY:
+                activation.associate_sec = elapsed
+                progress("associated")
+            if flags & (NM.ActivationStateFlags.IP4_READY | NM.ActivationStateFlags.IP6_READY):
+                activation.ip_sec = elapsed
+                progress("connected")
+                finish()
+                return
+            state = ac.get_state()
+            if state in (NM.ActiveConnectionState.DEACTIVATING, NM.ActiveConnectionState.DEACTIVATED):
+                finish("failed")
+
+        def on_timeout():
+            finish("timed out")
+            return GLib.SOURCE_REMOVE
+
+        timeout_id = GLib.timeout_add_seconds(self.ACTIVATION_TIMEOUT_SEC, on_timeout)
+        handler_ids.append(ac.connect("state-changed", check))
+        handler_ids.append(ac.connect("notify::state-flags", check))
+        progress("activating")
+        # The connection may have progressed before the handlers were connected
+        check()
+
+
+    def print_stats(self):
+        if not self.activations:
+            return
+        connected = [a for a in self.activations if a.ip_sec is not None]
+        mean_ip = sum(a.ip_sec for a in connected) / len(connected) if connected else 0.0
+        last = self.activations[-1]
+        associate = f"{last.associate_sec * 1000:.0f}ms" if last.associate_sec is not None else "-"
+        ip = f"{last.ip_sec * 1000:.0f}ms" if last.ip_sec is not None else "-"
+        print(f"Wi-Fi      connects={len(connected)}, failed={len(self.activations) - len(connected)}, "
+              f"last associate={associate}, last ip={ip}, mean ip={mean_ip * 1000:.0f}ms")
 
 
     def device_needs_scan(self):
@@ -199,24 +640,22 @@ class NetworkManager:
         return str(NM.utils_ssid_to_utf8(ssid.get_data()))
 
 
-    def genum_to_str(self, enum_type, value):
-        for n in sorted(dir(enum_type)):
-            if not re.search("^[A-Z0-9_]+$", n):
-                continue
-            enum_value = getattr(enum_type, n)
-            if value == enum_value:
-                return n
-        return f"({value}"
+    def genum_to_str(self, names, value):
+        """
+        :param names: Table from enum_names().
+        """
+        return names.get(int(value), f"({value}")
 
 
-    def gflags_to_str(self, flags_type, value):
+    def gflags_to_str(self, names, value):
+        """
+        :param names: Table from enum_names().
+        """
+        value = int(value)
         if value == 0:
             return "none"
         str = ""
-        for n in sorted(dir(flags_type)):
-            if not re.search("^[A-Z0-9_]+$", n):
-                continue
-            flag_value = getattr(flags_type, n)
+        for flag_value, n in names.items():
             if value & flag_value:
                 value &= ~flag_value
                 str += " " + n
@@ -1,27 +1,227 @@
+from collections import deque
 from dataclasses import dataclass
+import logging
+import queue
 import sys
+import threading
+import time
 import serial
+import metrics
 
+log = logging.getLogger(__name__)
 
-@dataclass
+SERIAL_BYTES = metrics.counter("serial_bytes_total", "Bytes written to the display.")
+SERIAL_COMMANDS = metrics.counter("serial_commands_total", "Instructions written to the display.")
+SERIAL_TRANSMIT_SECONDS = metrics.counter("serial_transmit_seconds_total", "Line time of the bytes written, 10 bits per byte at the baud rate in use.")
+DISPLAY_ERRORS = metrics.counter("display_errors_total", "Error return codes received from the display.")
+ACK_TIMEOUTS = metrics.counter("display_ack_timeouts_total", "Times the return codes of written instructions never arrived.")
+
+
+TERMINATOR = b'\xFF\xFF\xFF'
+
+# Nextion return codes (Nextion Instruction Set, "Format of Nextion Return Data")
+RETURN_CODES = {
+    0x00: "Invalid Instruction",
+    0x01: "Instruction Successful",
+    0x02: "Invalid Component ID",
+    0x03: "Invalid Page ID",
+    0x04: "Invalid Picture ID",
+    0x05: "Invalid Font ID",
+    0x06: "Invalid File Operation",
+    0x09: "Invalid CRC",
+    0x11: "Invalid Baud rate Setting",
+    0x12: "Invalid Waveform ID or Channel #",
+    0x1A: "Invalid Variable name or attribute",
+    0x1B: "Invalid Variable Operation",
+    0x1C: "Assignment failed to assign",
+    0x1D: "EEPROM Operation failed",
+    0x1E: "Invalid Quantity of Parameters",
+    0x1F: "IO Operation failed",
+    0x20: "Escape Character Invalid",
+    0x23: "Variable name too long",
+    0x24: "Serial Buffer Overflow",
+    0x65: "Touch Event",
+    0x66: "Current Page Number",
+    0x67: "Touch Coordinate (awake)",
+    0x68: "Touch Coordinate (sleep)",
+    0x70: "String Data Enclosed",
+    0x71: "Numeric Data Enclosed",
+    0x86: "Auto Entered Sleep Mode",
+    0x87: "Auto Wake from Sleep",
+    0x88: "Nextion Ready",
+    0x89: "Start microSD Upgrade",
+    0xFD: "Transparent Data Finished",
+    0xFE: "Transparent Data Ready",
+}
+
+# Return codes that answer an instruction when bkcmd=3, rather than reporting an event
+STATUS_CODES = frozenset(code for code in RETURN_CODES if code <= 0x24)
+
+# Bytes between the return code and the terminator, indexed by return code;
+# -1 for string data and unknown codes, whose end is found by searching.
+# Numeric data may itself contain 0xFF bytes, so it must not be searched.
+PAYLOAD_LENGTH = [-1] * 256
+for code in RETURN_CODES:
+    PAYLOAD_LENGTH[code] = 0
+PAYLOAD_LENGTH[0x65] = 3
+PAYLOAD_LENGTH[0x66] = 1
+PAYLOAD_LENGTH[0x67] = 5
+PAYLOAD_LENGTH[0x68] = 5
+PAYLOAD_LENGTH[0x70] = -1
+PAYLOAD_LENGTH[0x71] = 4
+
+
+@dataclass(slots = True)
 class Command:
     event: int = -1
     page: int = -1
     component: int = -1
     string_data: str = None
+    # Numeric data (0x71), touch state for 0x65/0x67/0x68 (1 press, 0 release)
+    value: int = None
+    x: int = -1
+    y: int = -1
 
     def __str__(self):
+        if self.event in RETURN_CODES and self.page == -1:
+            return f"Command(event=\\x{self.event:02x} {RETURN_CODES[self.event]}, value={self.value})"
         return f"Command(event=\\x{self.event:02x}, page=\\x{self.page:02x}, component=\\x{self.component:02x})"
 
 
+class FrameParser:
+    """
+    Incremental parser for the frames returned by the display.
+
+    Bytes are read straight into a preallocated bytearray. Consumed frames only
+    advance an offset and the search for a terminator resumes where the last one
+    stopped, so no byte is scanned twice; the unconsumed tail is moved to the
+    front only when the free space at the end runs out.
+    """
+
+    def __init__(self, size: int = 4096):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.scan = 0
+        self.dropped = 0
+
+
+    def space(self):
+        if self.start == self.end:
+            self.start = self.end = self.scan = 0
+        elif self.end == len(self.buffer):
+            length = self.end - self.start
+            if length == len(self.buffer):
+                # No terminator in a full buffer, drop it and resync on the next frame
+                self.dropped += length
+                self.start = self.end = self.scan = 0
+            else:
+                self.buffer[:length] = self.buffer[self.start:self.end]
+                self.scan -= self.start
+                self.start, self.end = 0, length
+        return len(self.buffer) - self.end
+
+
+    def read_from(self, ser):
+        """
+        Read the bytes waiting on a serial port without blocking. At most the
+        free space of the buffer is read, the rest is left for the next call.
+        """
+        n = min(ser.in_waiting, self.space())
+        if n > 0:
+            self.end += ser.readinto(self.view[self.end:self.end + n])
+
+
+    def feed(self, data):
+        """
+        Copy bytes into the buffer, returns how many fit.
+        """
+        n = min(len(data), self.space())
+        self.view[self.end:self.end + n] = data[:n]
+        self.end += n
+        return n
+
+
+    def frames(self):
+        """
+        Returns the commands of all complete frames in the buffer.
+        """
+        buf = self.buffer
+        end = self.end
+        start = self.start
+        commands = []
+        while end - start >= 4:
+            code = buf[start]
+            length = PAYLOAD_LENGTH[code]
+            if length >= 0:
+                stop = start + 1 + length
+                if stop + 3 > end:
+                    break
+                if buf[stop] == 0xFF and buf[stop + 1] == 0xFF and buf[stop + 2] == 0xFF:
+                    if code == 0x65:
+                        # Touch events are the bulk of the traffic, decode them inline
+                        commands.append(Command(code, buf[start + 1], buf[start + 2], None, buf[start + 3]))
+                    else:
+                        commands.append(self.decode(code, start + 1, stop))
+                    start = stop + 3
+                    continue
+            pos = buf.find(TERMINATOR, max(self.scan, start + 1), end)
+            if pos < 0:
+                self.scan = max(start + 1, end - 2)
+                break
+            command = self.decode(code, start + 1, pos)
+            if command is not None:
+                commands.append(command)
+            start = pos + 3
+        self.start = start
+        if self.scan < start:
+            self.scan = start
+        return commands
+
+
+    def decode(self, code, first, stop):
+        buf = self.buffer
+        if code == 0x00 and stop - first == 2 and buf[first] == 0 and buf[first + 1] == 0:
+            # 00 00 00 FF FF FF is sent once at power on
+            return Command(event = Nextion.STARTUP)
+        length = PAYLOAD_LENGTH[code]
+        if length >= 0 and length != stop - first:
+            self.dropped += stop - first + 4
+            return None
+        match code:
+            case 0x65:
+                return Command(event = code, page = buf[first], component = buf[first + 1], value = buf[first + 2])
+            case 0x66:
+                return Command(event = code, page = buf[first])
+            case 0x67 | 0x68:
+                return Command(event = code, x = buf[first] << 8 | buf[first + 1],
+                               y = buf[first + 2] << 8 | buf[first + 3], value = buf[first + 4])
+            case 0x70:
+                return Command(event = code, string_data = str(self.view[first:stop], "iso8859-1"))
+            case 0x71:
+                return Command(event = code, value = int.from_bytes(self.view[first:stop], "little", signed = True))
+        if code in RETURN_CODES:
+            return Command(event = code)
+        self.dropped += stop - first + 4
+        return None
+
+
 class Nextion:
     # Picture ID
     PICTURE_BACKGROUND = 0
 
     # Event Codes
+    INSTRUCTION_SUCCESSFUL = 0x01
     EVENT_TOUCH = 0x65
     CURRENT_PAGE_NUMBER = 0x66
+    TOUCH_COORDINATE = 0x67
+    TOUCH_COORDINATE_SLEEP = 0x68
     STRING_DATA = 0x70
+    NUMERIC_DATA = 0x71
+    NEXTION_READY = 0x88
+    # Not a return code, the 00 00 00 frame sent at power on
+    STARTUP = 0x100
 
     # Main Page Components
     PAGE_MAIN = 0x00
@@ -48,64 +248,438 @@ class Nextion:
     B_BACK = 0x01
 
 
-    def __init__(self, port: str = '/dev/ttyUSB0', baudrate: int = 9600):
+    # Baud rates accepted by the baud= instruction
+    BAUDRATES = (2400, 4800, 9600, 19200, 31250, 38400, 57600, 115200, 230400, 250000, 256000, 512000, 921600)
+
+    # Serial input buffer of the T-series displays. Unacknowledged bytes are kept
+    # below it so a burst of drawing instructions cannot overrun the display.
+    DEVICE_BUFFER_SIZE = 1024
+    TRANSMIT_WINDOW = 768
+    ACK_TIMEOUT_SEC = 0.5
+    PROBE_TIMEOUT_SEC = 0.5
+
+
+    def __init__(self, port: str = '/dev/ttyUSB0', baudrate: int = 9600, verbose: bool = False, ack: bool = False):
         """
         Initialize the Nextion class for communication.
 
         :param port: Serial port (e.g., 'COM1' or '/dev/ttyUSB0').
         :param baudrate: Baud rate for communication (default is 9600).
+        :param verbose: Log every frame received from the display at info instead of debug level.
+        :param ack: Enable bkcmd=3 and keep at most TRANSMIT_WINDOW unacknowledged bytes in flight.
         """
         self.port = port
         self.baudrate = baudrate
-        self.buffer = b''
-        self.ser = serial.Serial(port, baudrate, timeout = 1)
-        if self.ser.is_open:
-            print(f"Open {self.ser.name}, Baud: {self.ser.baudrate}.")
+        self.verbose = verbose
+        self.ack = ack
+        self.parser = FrameParser()
+        # Frames read while probing, returned by the next getCommands()
+        self.pending = []
+        # Encoded instructions waiting to be written, and written ones waiting for their return code
+        self.queue = deque()
+        self.in_flight = deque()
+        self.in_flight_bytes = 0
+        self.last_progress = 0.0
+        # Set to an event loop's call_later to get ack timeouts handled without new traffic
+        self.call_later = None
+        self.timeout_handle = None
+        self.bytes_sent = 0
+        self.commands_sent = 0
+        self.errors = 0
+        self.busy_sec = 0.0
+        self.busy_since = None
+        # Called once nothing is queued or in flight, see when_idle()
+        self.idle_callbacks = []
+        # (instruction, callback) of the get instructions sent with get(), in order
+        self.queries = deque()
+        # Set by start_writer(): bytes handed to the writer thread and not written yet
+        self.writes = None
+        self.writer = None
+        self.writer_closing = False
+        self.write_lock = threading.Lock()
+        self.backlog = 0
+        self.max_backlog = 0
+        self.ser = self.open()
+        if self.ack:
+            self.write(b'bkcmd=3\xFF\xFF\xFF')
+
+
+    def open(self):
+        ser = serial.Serial(self.port, self.baudrate, timeout = 1)
+        if ser.is_open:
+            log.info("Open %s, Baud: %s.", ser.name, ser.baudrate)
         else:
-            raise RuntimeError(f"Failed to open {self.ser.name}, Baud: {self.ser.baudrate}.")
+            raise RuntimeError(f"Failed to open {ser.name}, Baud: {ser.baudrate}.")
+        return ser
+
+
+    def negotiate_baudrate(self, target: int):
+        """
+        Switch the link to a higher baud rate with the baud= instruction.
+        The display may still run at target from an earlier session, so that rate
+        is probed as well. Falls back to the current rate if the display does not
+        answer at target. Returns the baud rate in use.
+        """
+        if target not in self.BAUDRATES:
+            raise ValueError(f"Unsupported baud rate {target}")
+        initial = self.baudrate
+        if target == initial:
+            return initial
+        if not self.probe():
+            self.set_port_baudrate(target)
+            if self.probe():
+                log.info("Display already at %s baud.", target)
+                return target
+            self.set_port_baudrate(initial)
+
+        self.write(f'baud={target}\xFF\xFF\xFF'.encode('iso-8859-1'))
+        self.ser.flush()
+        # The display switches after executing the instruction
+        time.sleep(0.05)
+        self.set_port_baudrate(target)
+        if self.probe():
+            log.info("Switched to %s baud.", target)
+            return target
+
+        log.warning("No answer at %s baud, falling back to %s.", target, initial)
+        self.write(f'baud={initial}\xFF\xFF\xFF'.encode('iso-8859-1'))
+        self.ser.flush()
+        time.sleep(0.05)
+        self.set_port_baudrate(initial)
+        if not self.probe():
+            log.error("No answer at %s baud either.", initial)
+        return initial
+
+
+    def set_port_baudrate(self, baudrate):
+        self.ser.baudrate = baudrate
+        self.baudrate = baudrate
+        self.ser.reset_input_buffer()
+        self.parser = FrameParser()
+
+
+    def probe(self):
+        """
+        Send sendme and wait for the page number, returns True if the display answered.
+        """
+        self.write(b'sendme\xFF\xFF\xFF')
+        deadline = time.monotonic() + self.PROBE_TIMEOUT_SEC
+        while time.monotonic() < deadline:
+            if self.ser.in_waiting <= 0:
+                time.sleep(0.01)
+                continue
+            self.parser.read_from(self.ser)
+            for c in self.parser.frames():
+                if c.event == self.CURRENT_PAGE_NUMBER:
+                    return True
+                if c.event not in STATUS_CODES:
+                    self.pending.append(c)
+        return False
 
 
     def getCommands(self):
         """
-        Reads commands sent from the display.
+        Reads commands sent from the display. Return codes answering our own
+        instructions are consumed here and not returned.
+        """
+        commands, self.pending = self.pending, []
+        if self.read():
+            for c in self.parser.frames():
+                if c.event in STATUS_CODES:
+                    self.acknowledge(c.event)
+                    continue
+                if self.is_answer(c):
+                    # Answers to sendme and get take the place of 0x01
+                    if self.acknowledge(None, c):
+                        continue
+                commands.append(c)
+        level = logging.INFO if self.verbose else logging.DEBUG
+        if commands and log.isEnabledFor(level):
+            for c in commands:
+                log.log(level, "<= %s", "string data" if c.event == self.STRING_DATA else c)
+        return commands
+
+
+    def is_answer(self, command):
+        """
+        Whether command answers the oldest instruction in flight. The display
+        also sends 0x66 on its own when the user changes page, that is an event.
+        """
+        if not self.in_flight:
+            return False
+        head = self.in_flight[0]
+        if command.event == self.CURRENT_PAGE_NUMBER:
+            return head.startswith(b'sendme')
+        if command.event in (self.STRING_DATA, self.NUMERIC_DATA):
+            return head.startswith(b'get ')
+        return False
+
+
+    def read(self):
+        """
+        Move the bytes waiting on the port into the parser, returns whether there were any.
         """
         if self.ser.in_waiting <= 0:
-            return []
-        self.buffer += self.ser.read(self.ser.inWaiting())
-        rawCommands = self.buffer.split(b'\xFF\xFF\xFF')
-        if self.buffer[-3:] == b'\xFF\xFF\xFF':
-            self.buffer = b''
+            return False
+        self.parser.read_from(self.ser)
+        return True
+
+
+    def send(self, instruction_str, should_log = True):
+        data = instruction_str.encode('iso-8859-1')
+        if should_log and log.isEnabledFor(logging.DEBUG):
+            log.debug("=> %s", instruction_str.replace("\xFF\xFF\xFF", ", "))
+        if not self.ack:
+            self.write(data)
+            return
+        start = 0
+        while start < len(data):
+            stop = data.find(b'\xFF\xFF\xFF', start)
+            stop = len(data) if stop < 0 else stop + 3
+            self.queue.append(data[start:stop])
+            start = stop
+        self.pump()
+
+
+    def send_batch(self, batch, should_log = True):
+        """
+        Send the instructions of a CommandBatch, already encoded and split.
+        """
+        instructions = batch.instructions()
+        if not instructions:
+            return
+        if should_log and log.isEnabledFor(logging.DEBUG):
+            log.debug("=> %s (~%.0fms)", ", ".join(i[:-3].decode('iso-8859-1') for i in instructions),
+                      batch.transmit_seconds(self.baudrate) * 1000)
+        if not self.ack:
+            self.write(b''.join(instructions), len(instructions))
+            return
+        self.queue.extend(instructions)
+        self.pump()
+
+
+    def pump(self):
+        """
+        Write queued instructions while the unacknowledged bytes fit in the window.
+        """
+        if self.in_flight and time.monotonic() - self.last_progress > self.ack_timeout():
+            log.warning("No return code for %d instructions, assuming they were executed.", len(self.in_flight))
+            ACK_TIMEOUTS.inc()
+            self.acknowledge_all()
+        chunk = []
+        size = 0
+        while self.queue:
+            command = self.queue[0]
+            if self.in_flight and self.in_flight_bytes + size + len(command) > self.TRANSMIT_WINDOW:
+                break
+            self.queue.popleft()
+            self.in_flight.append(command)
+            chunk.append(command)
+            size += len(command)
+            if self.in_flight_bytes + size >= self.TRANSMIT_WINDOW:
+                break
+        if chunk:
+            if not self.in_flight_bytes:
+                self.last_progress = time.monotonic()
+                if self.busy_since is None:
+                    self.busy_since = self.last_progress
+            self.in_flight_bytes += size
+            self.write(b''.join(chunk), len(chunk))
+            self.arm_timeout()
+
+
+    def get(self, variable, callback):
+        """
+        Send get variable and call callback with the number or text returned, or
+        with None when the display answers with an error, e.g. for a variable it
+        does not have. The answer is not returned by getCommands(). Needs ack,
+        answers are matched to instructions by their order.
+        """
+        instruction = f'get {variable}\xFF\xFF\xFF'.encode('iso-8859-1')
+        log.debug("=> get %s", variable)
+        if not self.ack:
+            callback(None)
+            return
+        self.queries.append((instruction, callback))
+        self.queue.append(instruction)
+        self.pump()
+
+
+    def answer_query(self, command, answer):
+        """
+        Call the callback of a get() instruction, returns whether command was one.
+        """
+        if not self.queries or self.queries[0][0] is not command:
+            return False
+        _, callback = self.queries.popleft()
+        if answer is None:
+            callback(None)
         else:
-            self.buffer = rawCommands[-1]
+            callback(answer.string_data if answer.event == self.STRING_DATA else answer.value)
+        return True
 
-        commands = []
-        for bytes in rawCommands[:-1]:
-            match bytes[0]:
-                case self.EVENT_TOUCH:
-                    c = Command(event=bytes[0], page=bytes[1], component=bytes[2])
-                    print("<=", c)
-                    commands.append(c)
-                case self.CURRENT_PAGE_NUMBER:
-                    c = Command(event=bytes[0], page=bytes[1])
-                    print("<=", c)
-                    commands.append(c)
-                case self.STRING_DATA:
-                    c = Command(event=bytes[0], string_data=bytes[1:].decode("iso8859-1"))
-                    print("<= string data")
-                    commands.append(c)
 
-        return commands
+    def acknowledge(self, code, answer = None):
+        """
+        Handle the return code of the oldest instruction in flight, or answer
+        data. Returns True when the answer was consumed by a get() callback.
+        """
+        if not self.in_flight:
+            if code is not None and code != self.INSTRUCTION_SUCCESSFUL:
+                self.errors += 1
+                DISPLAY_ERRORS.inc(code = f"0x{code:02x}")
+                log.warning("Display error 0x%02x %s", code, RETURN_CODES[code])
+            return
+        command = self.in_flight.popleft()
+        self.in_flight_bytes -= len(command)
+        self.last_progress = time.monotonic()
+        consumed = self.answer_query(command, answer)
+        if consumed and answer is None:
+            # An error answering get() is the answer, the caller handles it
+            code = None
+        if code is not None and code != self.INSTRUCTION_SUCCESSFUL:
+            self.errors += 1
+            DISPLAY_ERRORS.inc(code = f"0x{code:02x}")
+            log.warning("Display error 0x%02x %s: %s", code, RETURN_CODES[code], command[:-3].decode('iso-8859-1'))
+        self.pump()
+        self.update_busy()
+        return consumed
 
 
-    def send(self, instruction_str, should_log = True):
-        self.ser.write(instruction_str.encode('iso-8859-1'))
-        if should_log:
-            print("=>", instruction_str.replace("\xFF\xFF\xFF", ", "))
+    def acknowledge_all(self):
+        for command in self.in_flight:
+            self.answer_query(command, None)
+        self.in_flight.clear()
+        self.in_flight_bytes = 0
+        self.last_progress = time.monotonic()
+        self.update_busy()
+
+
+    def update_busy(self):
+        if not self.is_idle():
+            return
+        if self.busy_since is not None:
+            self.busy_sec += self.last_progress - self.busy_since
+            self.busy_since = None
+        callbacks, self.idle_callbacks = self.idle_callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+    def when_idle(self, callback):
+        """
+        Call callback once every instruction sent so far has been acknowledged.
+        """
+        if self.is_idle():
+            callback()
+        else:
+            self.idle_callbacks.append(callback)
+
+
+    def ack_timeout(self):
+        # Allow for transmitting a full window, about 0.8 s at 9600 baud
+        return self.ACK_TIMEOUT_SEC + self.TRANSMIT_WINDOW * 10 / self.baudrate
+
+
+    def arm_timeout(self):
+        if self.call_later is None or self.timeout_handle is not None:
+            return
+
+        def on_timeout():
+            self.timeout_handle = None
+            if self.in_flight:
+                self.pump()
+                self.arm_timeout()
+
+        self.timeout_handle = self.call_later(self.ack_timeout(), on_timeout)
+
+
+    def is_idle(self):
+        return not self.queue and not self.in_flight
+
+
+    def start_writer(self):
+        """
+        Write from a thread of this port from now on, so write() returns at once
+        even when the port cannot take more bytes, e.g. a slow baud rate or a
+        hung USB adapter, and one display never holds up the event loop or the
+        other displays. Call after negotiate_baudrate(), which waits for its
+        writes to go out.
+        """
+        if self.writer is not None:
+            return
+        self.writes = queue.SimpleQueue()
+        self.writer = threading.Thread(target = self.write_loop, name = f"nextion-writer {self.port}", daemon = True)
+        self.writer.start()
+
+
+    def write_loop(self):
+        while True:
+            data = self.writes.get()
+            if data is None or self.writer_closing:
+                return
+            try:
+                self.ser.write(data)
+            except (serial.SerialException, OSError) as e:
+                log.warning("Error writing to %s: %s", self.port, e)
+            with self.write_lock:
+                self.backlog -= len(data)
+
+
+    def stop_writer(self, timeout = 1.0):
+        if self.writer is None:
+            return
+        self.writes.put(None)
+        self.writer.join(timeout)
+        if self.writer.is_alive():
+            # The display is not taking bytes, drop the rest
+            log.warning("Dropping %dB not written to %s", self.backlog, self.port)
+            self.writer_closing = True
+            self.ser.cancel_write()
+            self.writer.join(timeout)
+        self.writer = None
+
+
+    def write(self, data, commands = None):
+        self.transmit(data)
+        commands = commands if commands is not None else data.count(b'\xFF\xFF\xFF')
+        self.bytes_sent += len(data)
+        self.commands_sent += commands
+        SERIAL_BYTES.inc(len(data))
+        SERIAL_COMMANDS.inc(commands)
+        SERIAL_TRANSMIT_SECONDS.inc(len(data) * 10 / self.baudrate)
+
+
+    def transmit(self, data):
+        if self.writer is not None:
+            with self.write_lock:
+                self.backlog += len(data)
+                self.max_backlog = max(self.max_backlog, self.backlog)
+            self.writes.put(data)
+        else:
+            self.ser.write(data)
+
+
+    def print_stats(self):
+        rate = ""
+        if self.ack and self.busy_sec > 0:
+            rate = f", {self.bytes_sent / self.busy_sec:.0f}B/s, {self.commands_sent / self.busy_sec:.0f}cmd/s while busy"
+        if self.writes is not None:
+            rate += f", max backlog={self.max_backlog}B"
+        print(f"Serial     {self.port} baud={self.baudrate}, sent={self.bytes_sent}B, commands={self.commands_sent}, errors={self.errors}{rate}")
+
+
+    def fileno(self):
+        """
+        File descriptor of the serial port, for registering with an event loop.
+        """
+        return self.ser.fileno()
 
 
     def close(self):
         """
-        Close the serial connection.
+        Close the serial connection, after the bytes already handed to the writer thread.
         """
+        self.stop_writer()
         if self.ser.is_open:
             self.ser.close()
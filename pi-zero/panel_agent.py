@@ -0,0 +1,118 @@
+"""
+Runs on the Pi of a display in hub mode, see hub.py: forwards the bytes of
+the display's serial port to the hub and the hub's instructions back,
+reconnecting with a growing delay while the hub is unreachable. Touches
+while disconnected are dropped; the hub resends the whole page on reconnect.
+
+    $ python panel_agent.py --hub hub.local:7300 --id lobby
+
+Needs pyserial only, no NetworkManager or requests.
+"""
+import argparse
+import asyncio
+import logging
+import socket
+from hub import DEFAULT_PORT, hello
+from nextion import Nextion
+
+log = logging.getLogger("panel_agent")
+
+# Rate negotiated with the display at startup, as main.py does
+BAUDRATE = 115200
+
+
+class PanelAgent:
+    RECONNECT_SEC = 1
+    MAX_RECONNECT_SEC = 30
+
+    def __init__(self, nextion, host, port, panel_id):
+        """
+        :param nextion: Nextion of the display, at the baud rate to forward at.
+        :param host: Host name or address of the hub.
+        :param port: TCP port of the hub.
+        :param panel_id: Name of this panel at the hub, keeps its selections across reconnects.
+        """
+        self.nextion = nextion
+        self.host = host
+        self.port = port
+        self.panel_id = panel_id
+        self.writer = None
+        self.connections = 0
+        self.bytes_up = 0
+        self.bytes_dropped = 0
+
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.nextion.start_writer()
+        loop.add_reader(self.nextion.fileno(), self.forward)
+        delay = self.RECONNECT_SEC
+        try:
+            while True:
+                try:
+                    reader, writer = await asyncio.open_connection(self.host, self.port)
+                except OSError as e:
+                    log.warning("Hub %s:%s unreachable: %s, retrying in %.0fs", self.host, self.port, e, delay)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.MAX_RECONNECT_SEC)
+                    continue
+                delay = self.RECONNECT_SEC
+                self.connections += 1
+                log.info("Connected to hub %s:%s as %s", self.host, self.port, self.panel_id)
+                writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                writer.write(hello(self.panel_id, self.nextion.baudrate))
+                self.writer = writer
+                try:
+                    while data := await reader.read(4096):
+                        self.nextion.write(data)
+                except OSError as e:
+                    log.warning("Connection to hub failed: %s", e)
+                finally:
+                    self.writer = None
+                    writer.close()
+                log.warning("Disconnected from hub, reconnecting")
+                await asyncio.sleep(self.RECONNECT_SEC)
+        finally:
+            loop.remove_reader(self.nextion.fileno())
+
+
+    def forward(self):
+        ser = self.nextion.ser
+        data = ser.read(ser.in_waiting)
+        if self.writer is None:
+            self.bytes_dropped += len(data)
+            return
+        self.writer.write(data)
+        self.bytes_up += len(data)
+
+
+    def print_stats(self):
+        print(f"Agent      {self.panel_id}, connections={self.connections}, up={self.bytes_up}B, "
+              f"dropped={self.bytes_dropped}B while disconnected")
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Forward a display to a hub, see hub.py.")
+    parser.add_argument("--hub", required = True, help = f"HOST[:PORT] of the hub, port {DEFAULT_PORT} by default")
+    parser.add_argument("--port", default = "/dev/serial0", help = "serial port of the display")
+    parser.add_argument("--id", default = socket.gethostname(), help = "name of this panel at the hub (default: host name)")
+    parser.add_argument("--log-level", default = "INFO", choices = ["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args()
+    logging.basicConfig(level = args.log_level, format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+    host, _, port = args.hub.partition(":")
+
+    nextion = Nextion(port = args.port, baudrate = 9600)
+    nextion.negotiate_baudrate(BAUDRATE)
+    agent = PanelAgent(nextion, host, int(port or DEFAULT_PORT), args.id)
+    try:
+        asyncio.run(agent.run())
+    except KeyboardInterrupt:
+        print("Program terminated.")
+    finally:
+        nextion.close()
+        agent.print_stats()
+        nextion.print_stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. acquire() reserves a token and sleeps until it is
+    due, so concurrent callers are served in the order they asked.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        """
+        :param rate: Tokens added per second.
+        :param capacity: Largest burst allowed after a quiet period.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait_sec = 0.0
+        self.max_wait_sec = 0.0
+
+
+    def acquire(self):
+        """
+        Blocks until a token is available, returns the seconds spent waiting.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            # A negative balance is a reservation behind the callers already waiting
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.acquired += 1
+            if wait > 0:
+                self.waited += 1
+                self.total_wait_sec += wait
+                self.max_wait_sec = max(self.max_wait_sec, wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+    def __str__(self):
+        mean = self.total_wait_sec / self.waited if self.waited else 0.0
+        return f"acquired={self.acquired}, waited={self.waited}, " \
+               f"mean wait={mean * 1000:.0f}ms, max wait={self.max_wait_sec * 1000:.0f}ms"
+
+
+# Nominatim usage policy: at most 1 request per second from one application.
+# Shared by every ApiClient in the process.
+NOMINATIM = TokenBucket(rate = 1.0, capacity = 1)
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ForecastScheduler:
+    """
+    Refreshes the forecasts of the locations in the background, all with one
+    fetch, so pages render the latest snapshots from memory instead of waiting
+    for the network.
+
+    Runs are aligned to multiples of interval (plus offset) on the wall clock,
+    because Open-Meteo publishes new current conditions every 15 minutes and
+    refreshing in between only returns the same data. Only runs triggered with
+    refresh skip the cache of fetch.
+    """
+    INTERVAL_SEC = 15 * 60
+    OFFSET_SEC = 2 * 60
+    RETRY_SEC = 60
+
+    def __init__(self, fetch, on_update = None, interval: float = INTERVAL_SEC, offset: float = OFFSET_SEC):
+        """
+        :param fetch: Blocking callable(locations, refresh) returning a WeatherData or None per (lat, lng, timezone),
+                      run on a worker thread; refresh asks to skip any cache.
+        :param on_update: Callable(snapshots) run on the event loop after every refresh, snapshots maps location to WeatherData.
+        :param interval: Seconds between refreshes.
+        :param offset: Seconds after each interval boundary to refresh at.
+        """
+        self.fetch = fetch
+        self.on_update = on_update
+        self.interval = interval
+        self.offset = offset
+        # (lat, lng, timezone) of every location
+        self.locations = ()
+        self.snapshots = {}
+        self.next_run = None
+        # The next run was triggered with refresh
+        self.refresh_requested = False
+        self.last_fetch_sec = None
+        self.last_fetch_time = None
+        self.errors = 0
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+    def set_locations(self, locations, peek = None):
+        """
+        :param locations: (lat, lng, timezone) of every location to keep fresh.
+        :param peek: Callable(location) returning a forecast to show until the
+                     first refresh, e.g. from a cache; only called for new locations.
+        """
+        locations = tuple(locations)
+        if locations == self.locations:
+            return
+        snapshots = {}
+        for location in locations:
+            snapshot = self.snapshots.get(location)
+            if snapshot is None and peek is not None:
+                snapshot = peek(location)
+            if snapshot is not None:
+                snapshots[location] = snapshot
+        self.locations = locations
+        self.snapshots = snapshots
+        self.trigger()
+
+
+    def snapshot(self, location):
+        return self.snapshots.get(location)
+
+
+    def trigger(self, refresh = False):
+        """
+        Refresh as soon as possible, e.g. after a location change, or with
+        refresh bypassing the cache, e.g. after B_REFRESH.
+        """
+        self.refresh_requested = self.refresh_requested or refresh
+        self.next_run = time.time()
+        self.wakeup.set()
+
+
+    async def run(self):
+        while True:
+            timeout = None
+            if self.locations:
+                if self.next_run is None or self.next_run <= time.time():
+                    try:
+                        await self.refresh()
+                    except Exception:
+                        # The task must outlive a bad response or a failing render
+                        log.exception("Refreshing the forecasts failed, retrying in %ss", self.RETRY_SEC)
+                        self.errors += 1
+                        self.next_run = time.time() + self.RETRY_SEC
+                timeout = max(0, self.next_run - time.time())
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+
+
+    async def refresh(self):
+        locations = self.locations
+        refresh, self.refresh_requested = self.refresh_requested, False
+        start = time.monotonic()
+        forecasts = await asyncio.to_thread(self.fetch, locations, refresh)
+        self.last_fetch_sec = time.monotonic() - start
+        if locations != self.locations:
+            # Changed while fetching, the new locations are already due
+            return
+        fetched = {location: data for location, data in zip(locations, forecasts) if data is not None}
+        self.snapshots.update(fetched)
+        if len(fetched) == len(locations):
+            self.last_fetch_time = time.time()
+            self.next_run = self.next_aligned(time.time())
+        else:
+            self.next_run = time.time() + self.RETRY_SEC
+        if self.on_update is not None:
+            self.on_update(self.snapshots)
+
+
+    def next_aligned(self, now):
+        return (now - self.offset) // self.interval * self.interval + self.interval + self.offset
+
+
+    def print_stats(self):
+        next_run = time.strftime("%H:%M:%S", time.localtime(self.next_run)) if self.next_run else "-"
+        latency = f"{self.last_fetch_sec * 1000:.0f}ms" if self.last_fetch_sec is not None else "-"
+        print(f"Scheduler  locations={len(self.locations)}, next run={next_run}, last fetch={latency}, errors={self.errors}")
@@ -0,0 +1,102 @@
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+NAN = float("nan")
+
+
+def to_array(values, typecode = "f"):
+    """
+    Typed array of a JSON list, missing values (null) become NaN.
+    """
+    return array(typecode, [NAN if v is None else v for v in values])
+
+
+def empty():
+    return array("f")
+
+
+@dataclass
+class HourlySeries:
+    """
+    Hourly forecast with one typed array per variable instead of an object per
+    hour; a week of data is a few kilobytes and slicing it copies no objects.
+    """
+    start: datetime = None
+    temperature: array = field(default_factory = empty)
+    precipitation_probability: array = field(default_factory = empty)
+    wind_speed: array = field(default_factory = empty)
+
+    def __len__(self):
+        return len(self.temperature)
+
+
+    def time(self, i):
+        return self.start + timedelta(hours = i)
+
+
+    def index(self, t):
+        """
+        Index of the hour containing t, may be out of range.
+        """
+        return int((t - self.start).total_seconds() // 3600)
+
+
+    def window(self, t, hours):
+        """
+        The series from the hour containing t, at most hours long.
+        """
+        first = min(max(self.index(t), 0), len(self))
+        last = first + hours
+        return HourlySeries(
+            start = self.time(first),
+            temperature = self.temperature[first:last],
+            precipitation_probability = self.precipitation_probability[first:last],
+            wind_speed = self.wind_speed[first:last],
+        )
+
+
+def finite(values):
+    """
+    (indices, values) of the points that are not NaN.
+    """
+    indices = [i for i, v in enumerate(values) if v == v]
+    return indices, [values[i] for i in indices]
+
+
+def lttb(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling: keeps threshold points that
+    preserve the visual shape of the line, including its peaks.
+
+    :param xs: Ascending x of each point.
+    :param ys: y of each point.
+    :return: Indices of the kept points, first and last always included.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    every = (n - 2) / (threshold - 2)
+    kept = [0]
+    a = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        # Average of the next bucket, the last bucket is the last point
+        next_end = min(int((bucket + 2) * every) + 1, n)
+        count = next_end - end
+        avg_x = sum(xs[end:next_end]) / count
+        avg_y = sum(ys[end:next_end]) / count
+
+        ax, ay = xs[a], ys[a]
+        best_area = -1.0
+        best = start
+        for i in range(start, end):
+            area = abs((ax - avg_x) * (ys[i] - ay) - (ax - xs[i]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = i
+        kept.append(best)
+        a = best
+    kept.append(n - 1)
+    return kept
@@ -0,0 +1,113 @@
+from array import array
+from dataclasses import replace
+
+# Open-Meteo unit parameter values and the symbols it reports in current_units
+UNIT_SYMBOLS = {
+    "celsius": "°C",
+    "fahrenheit": "°F",
+    "kmh": "km/h",
+    "ms": "m/s",
+    "mph": "mph",
+    "kn": "kn",
+    "mm": "mm",
+    "inch": "inch",
+}
+
+# Each symbol as (scale, offset) from the canonical unit the forecast is fetched in
+# (°C, km/h, mm): value = canonical * scale + offset
+CANONICAL = {"°C": "°C", "°F": "°C", "km/h": "km/h", "m/s": "km/h", "mph": "km/h", "kn": "km/h", "mm": "mm", "inch": "mm"}
+LINEAR = {
+    "°C": (1.0, 0.0),
+    "°F": (9 / 5, 32.0),
+    "km/h": (1.0, 0.0),
+    "m/s": (1 / 3.6, 0.0),
+    "mph": (1 / 1.609344, 0.0),
+    "kn": (1 / 1.852, 0.0),
+    "mm": (1.0, 0.0),
+    "inch": (1 / 25.4, 0.0),
+}
+
+
+def symbol(unit):
+    """
+    Accepts an Open-Meteo parameter value ("fahrenheit") or a symbol ("°F").
+    """
+    return UNIT_SYMBOLS.get(unit, unit)
+
+
+def convert(value, from_unit, to_unit, digits = 1):
+    from_unit, to_unit = symbol(from_unit), symbol(to_unit)
+    if value is None or from_unit == to_unit:
+        return value
+    if CANONICAL[from_unit] != CANONICAL[to_unit]:
+        raise ValueError(f"Cannot convert {from_unit} to {to_unit}")
+    scale, offset = LINEAR[from_unit]
+    canonical = (value - offset) / scale
+    scale, offset = LINEAR[to_unit]
+    return round(canonical * scale + offset, digits)
+
+
+def convert_array(values, from_unit, to_unit, digits = None):
+    """
+    convert() for a whole typed array, rounded only when digits is given. NaN stays NaN.
+    """
+    from_unit, to_unit = symbol(from_unit), symbol(to_unit)
+    if from_unit == to_unit:
+        return values
+    if CANONICAL[from_unit] != CANONICAL[to_unit]:
+        raise ValueError(f"Cannot convert {from_unit} to {to_unit}")
+    # Both steps are linear, so fold them into one multiply-add per value
+    from_scale, from_offset = LINEAR[from_unit]
+    to_scale, to_offset = LINEAR[to_unit]
+    scale = to_scale / from_scale
+    offset = to_offset - from_offset * scale
+    if digits is not None:
+        return array(values.typecode, [round(v * scale + offset, digits) for v in values])
+    return array(values.typecode, [v * scale + offset for v in values])
+
+
+def convert_weather(weatherData, temperature = None, wind_speed = None, precipitation = None):
+    """
+    Returns a copy of weatherData in the given units, None keeps a quantity as it is.
+    """
+    def target(current, wanted):
+        # Quantities that were not requested come back without a unit and stay as they are
+        return symbol(wanted) if wanted and current in LINEAR else current
+
+    units = weatherData.current_units
+    temperature = target(units.temperature, temperature)
+    wind_speed = target(units.wind_speed, wind_speed)
+    precipitation = target(units.precipitation, precipitation)
+    if (temperature, wind_speed, precipitation) == (units.temperature, units.wind_speed, units.precipitation):
+        return weatherData
+
+    def t(value):
+        return convert(value, units.temperature, temperature)
+
+    current = weatherData.current
+    current = replace(
+        current,
+        temperature = t(current.temperature),
+        precipitation = convert(current.precipitation, units.precipitation, precipitation),
+        wind_speed = convert(current.wind_speed, units.wind_speed, wind_speed),
+    )
+    daily = weatherData.daily
+    daily = replace(
+        daily,
+        temperature_max = convert_array(daily.temperature_max, units.temperature, temperature, 1),
+        temperature_min = convert_array(daily.temperature_min, units.temperature, temperature, 1),
+    )
+    hourly = weatherData.hourly
+    if hourly is not None:
+        hourly = replace(
+            hourly,
+            temperature = convert_array(hourly.temperature, units.temperature, temperature),
+            wind_speed = convert_array(hourly.wind_speed, units.wind_speed, wind_speed),
+        )
+    return replace(
+        weatherData,
+        current_units = replace(units, temperature = temperature, wind_speed = wind_speed, precipitation = precipitation),
+        current = current,
+        daily = daily,
+        hourly = hourly,
+    )